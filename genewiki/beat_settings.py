@@ -7,8 +7,16 @@ CELERYBEAT_SCHEDULE = {
         'schedule': timedelta(days=1)
     },
     'update-articles': {
-        'task': 'genewiki.wiki.tasks.update_all_infoboxes',
-        'schedule': timedelta(days=2)
+        'task': 'genewiki.wiki.tasks.schedule_infobox_updates',
+        'schedule': timedelta(hours=1)
+    },
+    'drain-outbox': {
+        'task': 'genewiki.wiki.tasks.drain_outbox',
+        'schedule': timedelta(minutes=1)
+    },
+    'update-structure-index': {
+        'task': 'genewiki.bio.tasks.update_structure_index',
+        'schedule': timedelta(days=7)
     },
     'update-g2p': {
         'task': 'genewiki.wiki.tasks.update_gene2pubmed',
@@ -1,3 +1,7 @@
+# Serve upstream requests from recorded fixtures when configured
+from genewiki.common.fixtures import install
+install()
+
 # Make sure redis is started on app load
 from genewiki.bio.g2p_redis import init_redis
 init_redis()
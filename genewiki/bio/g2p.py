@@ -0,0 +1,49 @@
+'''
+    Gene to PubMed lookups, from the backend chosen by G2P_BACKEND: 'redis'
+    (see g2p_redis) or 'snapshot' (see g2p_snapshot).
+'''
+
+from django.conf import settings
+
+from genewiki.bio.g2p_redis import init_redis, update_redis
+from genewiki.bio import g2p_redis
+
+
+def get_pmids(gene, limit=None):
+    '''
+        Returns the pmids associated with a gene, with an optional limit (i.e.
+        if a pmid references >= that number of genes, it is excluded).
+    '''
+    if settings.G2P_BACKEND == 'snapshot':
+        from genewiki.bio.g2p_snapshot import get_snapshot
+        return get_snapshot().get_pmids(gene, limit)
+    return g2p_redis.get_pmids(gene, init_redis(), limit)
+
+
+def get_ranked_pmids(gene, count=None):
+    '''
+        Returns up to `count` of the gene's best citations: pmids citing fewer
+        than G2P_RANKED_MAX_GENES genes, the most specific and then the most
+        recent first, as precomputed when the data was loaded.
+    '''
+    if settings.G2P_BACKEND == 'snapshot':
+        from genewiki.bio.g2p_snapshot import get_snapshot
+        return get_snapshot().get_ranked_pmids(gene, count)
+    ranked = g2p_redis.get_ranked_pmids(gene, init_redis(), count)
+    if ranked is None:
+        # not precomputed yet; fall back to an unranked lookup
+        ranked = get_pmids(gene, settings.G2P_RANKED_MAX_GENES)
+        ranked = ranked[:count] if count else ranked
+    return ranked
+
+
+def load(gene2pubmed_file):
+    '''
+        Loads a gene2pubmed file into the configured backend: a new snapshot,
+        or the changes since the last load for redis.
+    '''
+    if settings.G2P_BACKEND == 'snapshot':
+        from genewiki.bio.g2p_snapshot import compile_snapshot
+        compile_snapshot(gene2pubmed_file)
+    else:
+        update_redis(gene2pubmed_file, init_redis())
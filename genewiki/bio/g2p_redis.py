@@ -7,20 +7,104 @@
     Requires redis (the server) and redis (the python module).
     Install the server according to instructions at http://redis.io.
 
+    Weekly refreshes are incremental: update_redis() compares the human
+    (gene, pmid) pairs of the new file with those loaded last time, kept sorted
+    in G2P_STATE_PATH, in a single merge pass and applies only the pairs added
+    and removed, so readers never see a partial or empty database. Pairs are
+    sorted and diffed as streams, so memory use does not grow with the file.
+
+    Each gene's best citations are also precomputed into a single key, r:<gene>
+    (i.e. r:1017), holding up to G2P_RANKED_SIZE comma separated pmids that
+    cite fewer than G2P_RANKED_MAX_GENES genes, the most specific first and
+    the most recent (highest pmid) among equally specific ones. Rankings are
+    computed for every gene until RANKINGS_KEY records that this was done, and
+    only for the genes a diff affects afterwards.
 '''
 
-import subprocess, gzip, redis
+from django.conf import settings
+
+from genewiki.common import upstream, http
+
+from itertools import groupby
+import os, gzip, json, heapq, tempfile, logging, redis
+logger = logging.getLogger(__name__)
+
+g2p_remote_file = 'https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2pubmed.gz'
 
-g2p_remote_file = 'ftp://ftp.ncbi.nih.gov/gene/DATA/gene2pubmed.gz'
+# Set once the rankings of every gene have been stored
+RANKINGS_KEY = 'rankings:complete'
+
+# KEYS[1]: gene set, KEYS[2]: pmid count, also the set member. ARGV[1]: '+'
+# to add the pmid to the set, '-' to remove it. The count changes only if the
+# set did, so applying the same change twice counts it once; a count reaching
+# zero is deleted. Returns 1 if the set changed.
+APPLY_CHANGE = '''
+if ARGV[1] == '+' then
+    if redis.call('SADD', KEYS[1], KEYS[2]) == 1 then
+        redis.call('INCR', KEYS[2])
+        return 1
+    end
+elseif redis.call('SREM', KEYS[1], KEYS[2]) == 1 then
+    if redis.call('DECR', KEYS[2]) <= 0 then
+        redis.call('DEL', KEYS[2])
+    end
+    return 1
+end
+return 0
+'''
 
 
-def download_g2p():
+def download_g2p(filename='gene2pubmed.gz'):
     '''
         Downloads the gene2pubmed file at
-        ftp://ftp.ncbi.nih.gov/gene/DATA/gene2pubmed.gz
+        https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2pubmed.gz, unless it has not
+        changed since the last download that was loaded. Returns the filename,
+        or None if the local copy is current.
+
+        The response's validators are only kept for the next download once
+        mark_loaded() is called, so a file that failed to load is fetched and
+        loaded again.
     '''
-    subprocess.check_call(['curl', '-O', g2p_remote_file])
-    return 'gene2pubmed.gz'
+    meta_file = filename + '.json'
+    headers = {}
+    if os.path.exists(filename) and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = upstream.call('ncbi', 'ncbi.gene2pubmed', http.session('ncbi').get, g2p_remote_file,
+                             headers=headers, stream=True)
+    try:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        partial = filename + '.partial'
+        with open(partial, 'wb') as local:
+            for chunk in response.iter_content(1024 * 1024):
+                local.write(chunk)
+        os.rename(partial, filename)
+    finally:
+        response.close()
+
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    with open(meta_file + '.pending', 'w') as f:
+        json.dump({'etag': response.headers.get('ETag'),
+                   'last_modified': response.headers.get('Last-Modified')}, f)
+    return filename
+
+
+def mark_loaded(filename='gene2pubmed.gz'):
+    '''
+        Records that the file returned by download_g2p() has been loaded, so
+        the next download is skipped unless the file has changed.
+    '''
+    pending = filename + '.json.pending'
+    if os.path.exists(pending):
+        os.rename(pending, filename + '.json')
 
 
 def init_redis(host='127.0.0.1', port=6379, db=1):
@@ -76,3 +160,208 @@ def get_pmids(gene, redis_connection, limit=None):
             pmids.append(pmid.replace('p:', ''))
     return pmids
 
+
+def sort_pairs(pairs, chunk_size=None):
+    '''
+        Yields the distinct pairs of an iterable in order. Runs of `chunk_size`
+        (default G2P_SORT_CHUNK_SIZE) pairs are sorted in memory and spilled to
+        temporary files, which are then merged, so memory use is bounded
+        whatever the number of pairs.
+    '''
+    chunk_size = chunk_size or settings.G2P_SORT_CHUNK_SIZE
+    runs = []
+    try:
+        chunk = []
+        for pair in pairs:
+            chunk.append(pair)
+            if len(chunk) >= chunk_size:
+                handle, run = tempfile.mkstemp(suffix='.tsv')
+                os.close(handle)
+                runs.append(run)
+                write_state(run, sorted(set(chunk)))
+                chunk = []
+        previous = None
+        for pair in heapq.merge(sorted(set(chunk)), *[read_state(path) for path in runs]):
+            if pair != previous:
+                yield pair
+            previous = pair
+    finally:
+        for run in runs:
+            os.remove(run)
+
+
+def human_pairs(gene2pubmed_file):
+    '''
+        Yields the sorted, distinct (gene, pmid) pairs of the human entries in a
+        gene2pubmed file.
+    '''
+    def entries():
+        with gzip.open(gene2pubmed_file, 'rb') as infile:
+            for line in infile:
+                if line.startswith('9606\t'):
+                    fields = line.split('\t')
+                    yield int(fields[1]), int(fields[2])
+    return sort_pairs(entries())
+
+
+def loaded_pairs(redis_connection):
+    '''
+        Yields the sorted (gene, pmid) pairs currently in redis.
+    '''
+    def entries():
+        for gene in redis_connection.scan_iter('g:*', count=1000):
+            gene_id = int(gene[2:])
+            for pmid in redis_connection.sscan_iter(gene, count=1000):
+                yield gene_id, int(pmid[2:])
+    return sort_pairs(entries())
+
+
+def read_state(path):
+    with open(path) as f:
+        for line in f:
+            gene, pmid = line.split('\t')
+            yield int(gene), int(pmid)
+
+
+def write_state(path, pairs):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    partial = path + '.partial'
+    with open(partial, 'w') as f:
+        for gene, pmid in pairs:
+            f.write('{0}\t{1}\n'.format(gene, pmid))
+    os.rename(partial, path)
+
+
+def diff_sorted(old, new):
+    '''
+        Merges two sorted streams of pairs, yielding ('+', pair) for each pair
+        only in `new` and ('-', pair) for each pair only in `old`.
+    '''
+    tagged = heapq.merge(((pair, 0) for pair in old), ((pair, 1) for pair in new))
+    previous = None
+    for pair, side in tagged:
+        if previous is not None:
+            if previous[0] == pair:
+                # in both
+                previous = None
+                continue
+            yield ('-' if previous[1] == 0 else '+', previous[0])
+        previous = (pair, side)
+    if previous is not None:
+        yield ('-' if previous[1] == 0 else '+', previous[0])
+
+
+def apply_diff(changes, redis_connection, batch_size=10000):
+    '''
+        Applies the additions and removals from diff_sorted() to redis, updating
+        each pmid's gene count by the difference (see APPLY_CHANGE). Changes
+        already in redis, e.g. from an interrupted update, are not applied
+        again. Returns the number of pairs (added, removed).
+    '''
+    apply_change = redis_connection.register_script(APPLY_CHANGE)
+    counts = {'+': 0, '-': 0}
+    batch = []
+
+    def flush():
+        pipe = redis_connection.pipeline(transaction=False)
+        for change, (gene, pmid) in batch:
+            apply_change(keys=['g:{0}'.format(gene), 'p:{0}'.format(pmid)], args=[change], client=pipe)
+        for (change, pair), applied in zip(batch, pipe.execute()):
+            counts[change] += applied
+        del batch[:]
+
+    for change in changes:
+        batch.append(change)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return counts['+'], counts['-']
+
+
+def update_redis(gene2pubmed_file, redis_connection, state_path=None):
+    '''
+        Brings redis up to date with a gene2pubmed file by applying only the
+        pairs added and removed since the last update. The first update, with no
+        saved state, compares against the current contents of redis. Every
+        gene is ranked if redis has no complete set of rankings yet.
+
+        The file's pairs are sorted into the new state file first; the diff is
+        then streamed from the old and new state files and applied in batches,
+        so only the sets of genes and pmids changed are held in memory.
+    '''
+    state_path = state_path or settings.G2P_STATE_PATH
+    pending = state_path + '.new'
+    write_state(pending, human_pairs(gene2pubmed_file))
+    rank_all = not os.path.exists(state_path) or not redis_connection.exists(RANKINGS_KEY)
+    old = read_state(state_path) if os.path.exists(state_path) else loaded_pairs(redis_connection)
+
+    genes, pmids = set(), set()
+
+    def tracked(changes):
+        for change, (gene, pmid) in changes:
+            if not rank_all:
+                genes.add(gene)
+                pmids.add(pmid)
+            yield change, (gene, pmid)
+
+    added, removed = apply_diff(tracked(diff_sorted(old, read_state(pending))), redis_connection)
+    if rank_all:
+        genes = None
+    else:
+        # genes citing a pmid whose gene count changed are ranked again too
+        genes.update(gene for gene, pmid in read_state(pending) if pmid in pmids)
+    store_rankings(rank_citations(read_state(pending), redis_connection, genes), genes, redis_connection)
+    redis_connection.set(RANKINGS_KEY, 1)
+    os.rename(pending, state_path)
+    logger.info('gene2pubmed: {0} citations added, {1} removed'.format(added, removed))
+    return added, removed
+
+
+def rank_citations(pairs, redis_connection, genes=None):
+    '''
+        Yields each gene's ranked citations (see above) as (gene, pmids), for the
+        given genes or all of them, from pairs sorted by gene. The number of
+        genes each pmid cites is read from redis, so apply the changes first.
+    '''
+    for gene, group in groupby(pairs, key=lambda pair: pair[0]):
+        if genes is not None and gene not in genes:
+            continue
+        pmids = [pmid for _, pmid in group]
+        counts = redis_connection.mget(['p:{0}'.format(pmid) for pmid in pmids])
+        cited = [(int(count), -pmid) for pmid, count in zip(pmids, counts) if count and int(count) < settings.G2P_RANKED_MAX_GENES]
+        if cited:
+            yield gene, [-pmid for count, pmid in sorted(cited)[:settings.G2P_RANKED_SIZE]]
+
+
+def store_rankings(rankings, genes, redis_connection, batch_size=10000):
+    '''
+        Writes ranked citations in batches, removing those of `genes` left
+        without any.
+    '''
+    ranked = set()
+    pipe = redis_connection.pipeline(transaction=False)
+    for gene, pmids in rankings:
+        ranked.add(gene)
+        pipe.set('r:{0}'.format(gene), ','.join(str(pmid) for pmid in pmids))
+        if len(pipe) >= batch_size:
+            pipe.execute()
+    for gene in (genes or ()):
+        if gene not in ranked:
+            pipe.delete('r:{0}'.format(gene))
+    pipe.execute()
+
+
+def get_ranked_pmids(gene, redis_connection, count=None):
+    '''
+        Returns up to `count` of a gene's precomputed ranked citations, or None
+        if none have been computed for it.
+    '''
+    gene = str(gene).replace('g:', '')
+    ranked = redis_connection.get('r:' + gene)
+    if ranked is None:
+        return None
+    pmids = ranked.split(',') if ranked else []
+    return pmids[:count] if count else pmids
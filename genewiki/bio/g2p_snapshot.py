@@ -0,0 +1,126 @@
+'''
+    gene2pubmed/snapshot.py
+
+    A read-only, memory-mapped snapshot of the human gene2pubmed data, as an
+    alternative to the redis store that needs no server.
+
+    compile_snapshot() turns a gene2pubmed file into four NumPy arrays laid
+    out like a compressed sparse row matrix:
+
+    - genes: the sorted gene ids
+    - offsets: where each gene's pmids start in pmids (one more than genes)
+    - pmids: every gene's pmids, gene after gene, the most specific (citing
+      the fewest genes) and then most recent first
+    - counts: next to each pmid, the number of genes that pmid cites
+
+    They are saved as .npy files in a new directory, and the G2P_SNAPSHOT_PATH
+    symlink is switched to it atomically. Snapshot maps the files read-only, so
+    every worker process shares the same pages of the OS page cache, and a
+    lookup is a binary search and an array slice.
+'''
+
+from django.conf import settings
+
+import os, gzip, shutil, tempfile, threading, numpy
+
+ARRAYS = ('genes', 'offsets', 'pmids', 'counts')
+
+
+def compile_snapshot(gene2pubmed_file, path=None, chatty=True):
+    '''
+        Compiles the human entries of a gene2pubmed file into a snapshot and
+        points `path` (default G2P_SNAPSHOT_PATH) at it. Returns the directory
+        holding the new snapshot.
+    '''
+    path = path or settings.G2P_SNAPSHOT_PATH
+    if chatty:
+        print 'loading human genes...'
+    pairs = set()
+    with gzip.open(gene2pubmed_file, 'rb') as infile:
+        for line in infile:
+            if line.startswith('9606\t'):
+                fields = line.split('\t')
+                pairs.add((int(fields[1]), int(fields[2])))
+
+    if chatty:
+        print 'compiling snapshot...'
+    entries = numpy.array(sorted(pairs), dtype=numpy.int64).reshape(-1, 2)
+    cited, citations = numpy.unique(entries[:, 1], return_counts=True)
+    counts = citations[numpy.searchsorted(cited, entries[:, 1])].astype(numpy.int32)
+    # rank each gene's pmids: by gene, then gene count, then newest first
+    order = numpy.lexsort((-entries[:, 1], counts, entries[:, 0]))
+    entries, counts = entries[order], counts[order]
+    gene_column, pmid_column = entries[:, 0], entries[:, 1]
+    genes, starts = numpy.unique(gene_column, return_index=True)
+    offsets = numpy.append(starts, len(entries)).astype(numpy.int64)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    # a unique name, as two snapshots may be compiled within a second
+    directory = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=parent)
+    # mkdtemp makes it private; every worker needs to read it
+    os.chmod(directory, 0755)
+    for name, array in zip(ARRAYS, (genes, offsets, pmid_column.astype(numpy.int64), counts)):
+        numpy.save(os.path.join(directory, name + '.npy'), array)
+
+    # replace the symlink in one step so readers see the old or new snapshot
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    link = '{0}.{1}.link'.format(path, os.getpid())
+    os.symlink(os.path.abspath(directory), link)
+    os.rename(link, path)
+    if previous and previous != os.path.abspath(directory):
+        # processes that still map the old files keep them until they reload
+        shutil.rmtree(previous, ignore_errors=True)
+    return directory
+
+
+class Snapshot(object):
+    '''
+      A memory-mapped gene2pubmed snapshot.
+    '''
+
+    def __init__(self, path=None):
+        self.path = os.path.realpath(path or settings.G2P_SNAPSHOT_PATH)
+        for name in ARRAYS:
+            setattr(self, name, numpy.load(os.path.join(self.path, name + '.npy'), mmap_mode='r'))
+
+    def get_pmids(self, gene, limit=None):
+        '''
+            Returns the pmids associated with a gene, with an optional limit (i.e.
+            if a pmid references >= that number of genes, it is excluded).
+        '''
+        gene = int(str(gene).replace('g:', ''))
+        i = numpy.searchsorted(self.genes, gene)
+        if i == len(self.genes) or self.genes[i] != gene:
+            return []
+        start, end = self.offsets[i], self.offsets[i + 1]
+        pmids = self.pmids[start:end]
+        if limit:
+            pmids = pmids[self.counts[start:end] < limit]
+        return [str(pmid) for pmid in pmids]
+
+    def get_ranked_pmids(self, gene, count=None):
+        '''
+            Returns up to `count` of the gene's pmids citing fewer than
+            G2P_RANKED_MAX_GENES genes, best ranked first.
+        '''
+        pmids = self.get_pmids(gene, settings.G2P_RANKED_MAX_GENES)
+        return pmids[:count] if count else pmids
+
+
+_state = {}
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    '''
+        Returns the process wide Snapshot, mapping a new one if the
+        G2P_SNAPSHOT_PATH symlink has been switched since it was loaded.
+    '''
+    current = os.path.realpath(settings.G2P_SNAPSHOT_PATH)
+    with _lock:
+        snapshot = _state.get('snapshot')
+        if snapshot is None or snapshot.path != current:
+            snapshot = _state['snapshot'] = Snapshot(current)
+        return snapshot
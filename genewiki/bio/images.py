@@ -1,5 +1,10 @@
 from django.conf import settings
-import urllib, subprocess, os, sys, datetime, mwclient
+
+from genewiki.bio.structures import choose_structure
+from genewiki.common import instrumentation, upstream, http
+
+import subprocess, os, re, sys, shutil, json, gzip, hashlib, time, datetime, threading, logging, redis, mwclient
+logger = logging.getLogger(__name__)
 
 
 '''
@@ -23,65 +28,344 @@ caption_skeleton = 'Rendering based on [[Protein_Data_Bank | PDB]] {{{{PDB2|{pdb
 
 rcsb_skeleton = 'http://www.rcsb.org/pdb/files/{}.pdb'
 
-# A dev server at EBI that provides 'chosen' PDB structures and images based
-# on homologene ID
-ebiserver = 'http://wwwdev.ebi.ac.uk/pdbe-apps/jsonizer/homologene/{}/'
-
 title_skeleton = 'File:Protein_{hugo_sym}_PDB_{pdb_id}.png'
 
+commons_api = 'https://commons.wikimedia.org/w/api.php'
+
+# The most titles the MediaWiki API checks in one anonymous query
+COMMONS_BATCH_SIZE = 50
+
+
+def structure_for(fields, use_experimental=True):
+    '''
+        Returns the PDB id of the structure to illustrate a gene with, given the
+        fields of its ProteinBox: the best structure chosen from the local
+        structure index or by EBI (see genewiki.bio.structures), otherwise the
+        first one listed. Rendering and linking both choose through here, so
+        they agree on the render cache key.
+    '''
+    pdb_id = None
+    if use_experimental and (fields.get('Hs_Uniprot') or fields.get('Homologene')):
+        try:
+            pdb_id = choose_structure(fields.get('Hs_Uniprot'), fields.get('Homologene'))
+        except Exception:
+            logger.warn('Could not choose a structure for {0}'.format(fields.get('Symbol')), exc_info=True)
+    if not pdb_id and fields.get('PDB'):
+        pdb_id = fields['PDB'][0]
+    return pdb_id
 
-def get_image(proteinbox, use_experimental=True):
-    '''Attempts to find a suitable image given a gene. Returns the image filename as
-    it exists on Wikipedia commons, along with a suitable caption.
+
+def get_image(proteinbox, use_experimental=True, render=True, upload=True):
+    '''Attempts to find a suitable image given a gene. Returns the image title as
+    it exists on Wikipedia commons, along with a suitable caption, or None.
+
+    An existing Commons image of one of the gene's structures is used first.
+    Otherwise the structure chosen by structure_for() is taken from the render
+    cache, or rendered, and uploaded to Commons.
 
     Arguments:
     - `proteinbox`: a ProteinBox object representing known information about a gene
-    - `use_experimental`: use a dev server at EBI to provide chosen PDB structures and
-    images.'''
+    - `use_experimental`: choose the structure from the local structure index or by EBI
+    - `render`: render the structure if it is not in the render cache
+    - `upload`: upload a rendering to Commons; if not set, only existing Commons
+    images are used.'''
     fields = proteinbox.fieldsdict
-    pdbid = ''
-    if use_experimental and fields['Homologene']:
-        import json
-        homologene = fields['Homologene']
+    symbol = fields['Symbol']
+    pdb_id = structure_for(fields, use_experimental)
+    if not pdb_id:
+        return None
+
+    # Try to find one on Commons
+    pdb_ids = [pdb_id] + [other for other in fields['PDB'] if other != pdb_id]
+    found = find_commons_images([(symbol, pdb_ids)]).get(symbol)
+    if found:
+        return found
+
+    # otherwise use the cached rendering, or render a new one
+    if not upload or not (render or cached_render(pdb_id)):
+        return None
+    pdb = PDB(pdb_id, symbol)
+    rendered = pdb.render()
+    if rendered:
+        imagefile, caption = rendered
+        pdb.uploadToCommons(png_file=imagefile)
+        return title_skeleton.format(hugo_sym=symbol, pdb_id=pdb_id), caption
+
+
+def candidate_titles(symbol, pdb_ids):
+    '''
+        Returns the Commons titles an image of the gene's structures could have,
+        in order of preference: the first structure with its id upper then
+        lower case, then every structure as listed.
+    '''
+    titles = []
+    ids = [pdb_ids[0].upper(), pdb_ids[0].lower()] + list(pdb_ids) if pdb_ids else []
+    for pdb_id in ids:
+        title = title_skeleton.format(hugo_sym=symbol, pdb_id=pdb_id)
+        if title not in titles:
+            titles.append(title)
+    return titles
+
+
+def _commons_cache():
+    return redis.StrictRedis(**settings.COMMONS_CACHE_REDIS)
+
+
+def commons_files_exist(titles):
+    '''
+        Returns a dict of each title to the name of the Commons file it resolves
+        to, or None if there is none. Titles are checked COMMONS_BATCH_SIZE at a
+        time; results are cached in Redis, files found for COMMONS_HIT_TTL
+        seconds and files missing for COMMONS_MISS_TTL.
+    '''
+    titles = list(set(titles))
+    if not titles:
+        return {}
+    cache = _commons_cache()
+    try:
+        cached = dict(zip(titles, cache.mget(['commons:' + title for title in titles])))
+    except redis.RedisError:
+        logger.warn('Commons cache unavailable', exc_info=True)
+        cache, cached = None, {}
+
+    results = {}
+    unknown = []
+    for title in titles:
+        value = cached.get(title)
+        if value is None:
+            unknown.append(title)
+        else:
+            results[title] = value or None
+    instrumentation.count('commons.cached', len(titles) - len(unknown))
+
+    session = http.session('commons')
+    for i in range(0, len(unknown), COMMONS_BATCH_SIZE):
+        batch = unknown[i:i + COMMONS_BATCH_SIZE]
+        params = {'action': 'query', 'titles': '|'.join(batch), 'format': 'json'}
+        query = upstream.call('commons', 'commons.check_titles', session.get, commons_api, params=params).json()['query']
+        normalized = dict((n['from'], n['to']) for n in query.get('normalized', []))
+        existing = set(page['title'] for page in query.get('pages', {}).values() if 'missing' not in page and 'invalid' not in page)
+        for title in batch:
+            name = normalized.get(title, title)
+            results[title] = name if name in existing else None
+
+    if cache is not None and unknown:
+        try:
+            pipe = cache.pipeline(transaction=False)
+            for title in unknown:
+                if results[title]:
+                    pipe.setex('commons:' + title, settings.COMMONS_HIT_TTL, results[title])
+                else:
+                    pipe.setex('commons:' + title, settings.COMMONS_MISS_TTL, '')
+            pipe.execute()
+        except redis.RedisError:
+            logger.warn('Commons cache unavailable', exc_info=True)
+    return results
+
+
+def find_commons_images(genes):
+    '''
+        Returns a dict of gene symbol to the (file name, caption) of an existing
+        Commons image of one of its structures, for the genes that have one.
+        `genes` is a list of (symbol, PDB ids); every candidate title of every
+        gene is checked in the same batches.
+    '''
+    candidates = dict((symbol, candidate_titles(symbol, pdb_ids)) for symbol, pdb_ids in genes)
+    exists = commons_files_exist([title for titles in candidates.values() for title in titles])
+    images = {}
+    for symbol, titles in candidates.items():
+        for title in titles:
+            if exists.get(title):
+                pdb = re.search(r'PDB[ _]([\d\w]*)\.png', title).group(1)
+                images[symbol] = (exists[title], caption_skeleton.format(pdb=pdb))
+                break
+    return images
+
+
+def commons_site():
+    '''
+        Returns an mwclient connection to Wikimedia Commons with its own pooled
+        session (see genewiki.common.http).
+    '''
+    return upstream.call('commons', 'commons.connect', mwclient.Site, 'commons.wikimedia.org',
+                         pool=http.new_session('commons'))
+
+
+def render_key(pdb_id):
+    '''
+        Returns the cache key of a structure's rendering: a digest of the PDB id,
+        the render settings and the PyMOL script.
+    '''
+    options = settings.PYMOL_RENDER
+    with open(settings.PROJECT_PATH.format(options['script'])) as script:
+        source = script.read()
+    return hashlib.sha1(json.dumps([pdb_id.upper(), options, source], sort_keys=True)).hexdigest()
+
+
+def render_cache_path(pdb_id):
+    key = render_key(pdb_id)
+    return os.path.join(settings.RENDER_CACHE_PATH, key[:2], key + '.png')
+
+
+def cached_render(pdb_id):
+    '''
+        Returns the path of the cached rendering of a structure, or None.
+    '''
+    path = render_cache_path(pdb_id)
+    return path if os.path.exists(path) else None
+
+
+def store_render(pdb_id, png_file):
+    '''
+        Adds a rendering to the cache. The copy is renamed into place so readers
+        never see a partial file.
+    '''
+    path = render_cache_path(pdb_id)
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # made by a concurrent render
+            pass
+    partial = '{0}.{1}.tmp'.format(path, os.getpid())
+    shutil.copyfile(png_file, partial)
+    os.rename(partial, path)
+    return path
+
+
+_writable = set()
+_writable_lock = threading.Lock()
+
+
+def ensure_writable(path):
+    '''
+        Creates `path` if needed and checks it can be written to, once per
+        process. Raises ValueError if not.
+    '''
+    with _writable_lock:
+        if path in _writable:
+            return
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                raise ValueError('Could not access pdb path at {} nor create it.'.format(path))
+        if not os.access(path, os.W_OK):
+            raise ValueError('Could not write in pdb path {}: permission denied.'.format(path))
+        _writable.add(path)
+
+
+class StructureCache(object):
+    '''
+      Downloaded PDB files, stored gzipped (with PDB_CACHE_COMPRESS) under
+      `path` by PDB id alongside the ETag and Last-Modified they were served
+      with. A cached structure is used as is for PDB_CACHE_REVALIDATE_HOURS,
+      then revalidated with a conditional request, so an unchanged structure is
+      not downloaded again. Downloads are streamed to disk in chunks. Once the
+      cache grows past PDB_CACHE_MAX_BYTES the least recently used structures
+      are evicted.
+    '''
+    chunk_size = 64 * 1024
+
+    def __init__(self, path=None):
+        self.path = path or settings.PDB_PATH
+        ensure_writable(self.path)
+
+    def filename(self, pdb_id):
+        extension = '.pdb.gz' if settings.PDB_CACHE_COMPRESS else '.pdb'
+        return os.path.join(self.path, pdb_id.upper() + extension)
+
+    def _meta_filename(self, pdb_id):
+        return os.path.join(self.path, pdb_id.upper() + '.json')
+
+    def _meta(self, pdb_id):
         try:
-            req = urllib.urlopen(ebiserver.format(homologene))
-            rawj = req.read()
-            rawj = rawj.replace(' ', '').replace('\n', '')
-            info = json.loads(rawj)
-            if 'best_structure' in info:
-                pdbid = info['best_structure']['pdbid']
-                pdb = PDB(pdbid, fields['Symbol'])
-                # They often have images, but we're going to render them again anyway.
-                imagefile, caption = pdb.render()
-                pdb.uploadToCommons()
-                return image, caption
+            with open(self._meta_filename(pdb_id)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_meta(self, pdb_id, meta):
+        with open(self._meta_filename(pdb_id), 'w') as f:
+            json.dump(meta, f)
+
+    def get(self, pdb_id):
+        '''
+            Returns the filename of the structure, downloading it if it is not
+            cached or has changed, or None if it could not be fetched.
+        '''
+        filename = self.filename(pdb_id)
+        meta = self._meta(pdb_id) if os.path.exists(filename) else {}
+        if meta and time.time() - meta.get('checked', 0) < settings.PDB_CACHE_REVALIDATE_HOURS * 3600:
+            instrumentation.count('pdb.cached')
+            os.utime(filename, None)
+            return filename
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        url = rcsb_skeleton.format(pdb_id)
+        remote = None
+        try:
+            remote = upstream.call('rcsb', 'rcsb.download', http.session('rcsb').get, url, headers=headers, stream=True)
+            if remote.status_code == 304:
+                instrumentation.count('pdb.revalidated')
+            else:
+                remote.raise_for_status()
+                self._write(filename, remote)
+                instrumentation.count('pdb.downloaded')
+                meta = {'etag': remote.headers.get('ETag'), 'last_modified': remote.headers.get('Last-Modified')}
+        except IOError:
+            sys.stderr.write('pdb: error downloading pdb file from {}\n'.format(url))
+            return None
         finally:
-            req.close()
-    else:
-        # Try to find one on Commons
-        commons = mwclient.Site('commons.wikimedia.org')
-        title1 = title_skeleton.format(hugo_sym=fields['Symbol'], pdb_id=fields['PDB'][0].upper())
-        title2 = title_skeleton.format(hugo_sym=fields['Symbol'], pdb_id=fields['PDB'][0].lower())
-        page1 = commons.Pages[title1]
-        page2 = commons.Pages[title2]
-        if page1.exists:
-            return page1.name, caption_skeleton.format(pdb=fields['PDB'][0])
-        elif page2.exists:
-            return page2.name, caption_skeleton.format(pdb=fields['PDB'][0])
-        elif len(fields['PDB']) > 1:
-            titles = [title_skeleton.format(hugo_sym=fields['Symbol'], pdb_id=pdb) for pdb in fields['PDB']]
-            for title in titles:
-                page = commons.Pages[title]
-                if page.exists:
-                    import re
-                    pdb = re.search(r'PDB[ _]([\d\w]*).png', title)
-                    return page.name, caption_skeleton.format(pdb=pdb)
-
-        # otherwise render a new one
-        else:
-            pdb = PDB(fields['PDB'][0], fields['Symbol'])
-            image, caption = pdb.render()
-            return image, caption
+            # releases the pooled connection whatever the response was
+            if remote is not None:
+                remote.close()
+
+        meta['checked'] = time.time()
+        self._save_meta(pdb_id, meta)
+        os.utime(filename, None)
+        self.evict()
+        return filename
+
+    def _write(self, filename, remote):
+        partial = '{0}.{1}.{2}.tmp'.format(filename, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(partial, 'wb') as raw:
+                local = gzip.GzipFile(fileobj=raw, mode='wb') if settings.PDB_CACHE_COMPRESS else raw
+                for chunk in remote.iter_content(self.chunk_size):
+                    local.write(chunk)
+                if local is not raw:
+                    local.close()
+            os.rename(partial, filename)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def evict(self):
+        '''
+            Removes the least recently used structures until the cache fits in
+            PDB_CACHE_MAX_BYTES.
+        '''
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pdb') or name.endswith('.pdb.gz'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= settings.PDB_CACHE_MAX_BYTES:
+                break
+            pdb_id = name.split('.')[0]
+            for filename in (os.path.join(self.path, name), self._meta_filename(pdb_id)):
+                if os.path.exists(filename):
+                    os.remove(filename)
+            total -= size
+            instrumentation.count('pdb.evicted')
 
 
 class PDB(object):
@@ -89,28 +373,12 @@ class PDB(object):
     def __init__(self, pdbid, hugosym, pdbpath=None, pymolpath=None, commons=None):
         self.pdbid = pdbid
         self.hugosym = hugosym
-        self.pdbpath = pdbpath if pdbpath else settings.pbbhome + 'pdb/'
+        self.pdbpath = pdbpath if pdbpath else settings.PDB_PATH
         if not self.pdbpath.endswith(os.sep):
             self.pdbpath = self.pdbpath + os.sep
+        self.structures = StructureCache(self.pdbpath)
 
-        # ensure that pdb path exists
-
-        if not os.path.exists(self.pdbpath):
-            try:
-                os.makedirs(self.pdbpath)
-            except OSError:
-                raise ValueError('Could not access pdb path at {} nor create it.'.format(self.pdbpath))
-
-        # ensure that we can write in it
-        try:
-            open(self.pdbpath + 'test', 'w').close()
-            os.remove(self.pdbpath + 'test')
-        except IOError:
-            raise ValueError(
-                'Could not write in pdb path {}: permission denied.'.format(
-                    self.pdbpath))
-
-        self.pymolpath = pymolpath if pymolpath else settings.pymol
+        self.pymolpath = pymolpath if pymolpath else settings.PYMOL
         self.pdbfile = None
         self.pngfile = None
         self.commons = commons
@@ -118,24 +386,15 @@ class PDB(object):
 
     def download(self, pdb_id=None):
         '''
-            Downloads a PDB file from rcsb.org and returns the filename if
-            successful (or None if failed).
+            Returns the filename of a PDB file from rcsb.org, fetched through
+            the structure cache, or None if it could not be fetched.
         '''
         if not pdb_id:
             pdb_id = self.pdbid
 
-        try:
-            remote = urllib.urlopen(rcsb_skeleton.format(pdb_id))
-        except IOError:
-            sys.stderr.write('pdb: error downloading pdb file from {}\n'
-                             .format(rcsb_skeleton.format(pdb_id)))
-            return None
-
-        filename = self.pdbpath + pdb_id + '.pdb'
-        with open(filename, 'wb') as local:
-            local.write(remote.read())
-            remote.close()
-        self.pdbfile = filename
+        filename = self.structures.get(pdb_id)
+        if filename:
+            self.pdbfile = filename
         return filename
 
     def render(self, pdb_id=None, hugo_sym=None, pdb_file=None):
@@ -144,6 +403,8 @@ class PDB(object):
             and hugo symbol.
             If the pdb file is already present, it can be passed as a parameter;
             otherwise it will be downloaded from rcsb.org.
+            Structures already rendered with the current settings are copied
+            from the render cache instead (see render_key()).
         '''
 
         if not pdb_id:
@@ -151,6 +412,18 @@ class PDB(object):
         if not hugo_sym:
             hugo_sym = self.hugosym
 
+        # Set up the future location of the image
+        if pdb_id is None:
+            return None
+        png_file = '{pdbpath}Protein_{hugo_sym}_PDB_{pdb_id}.png'.format(pdbpath=self.pdbpath, hugo_sym=hugo_sym, pdb_id=pdb_id)
+
+        cached = cached_render(pdb_id)
+        if cached:
+            instrumentation.count('pymol.cached')
+            shutil.copyfile(cached, png_file)
+            self.pngfile = png_file
+            return png_file, caption_skeleton.format(pdb=pdb_id)
+
         # Attempt to download the pdb file if not explicitly passed
         if not pdb_file:
             pdb_file = self.pdbfile
@@ -159,20 +432,20 @@ class PDB(object):
         if not pdb_file:
             return None
 
-        # Set up the future location of the image
-        if pdb_id is None:
-            return None
-        png_file = '{pdbpath}Protein_{hugo_sym}_PDB_{pdb_id}.png'.format(pdbpath=self.pdbpath, hugo_sym=hugo_sym, pdb_id=pdb_id)
-
         # Launch pymol as a subprocess and wait for return
-        rendercmd = "cmd.png('{png_file}', 1200, 1000)".format(png_file=png_file)
-        pymolcmd = [self.pymolpath, '-c', pdb_file, settings.PROJECT_PATH.format('commands.pml'), '-d', rendercmd]
+        options = settings.PYMOL_RENDER
+        rendercmd = "cmd.png('{png_file}', {width}, {height})".format(png_file=png_file, **options)
+        pymolcmd = [self.pymolpath, '-c', pdb_file, settings.PROJECT_PATH.format(options['script']), '-d', rendercmd]
         print ' '.join(pymolcmd)
+        start = time.time()
         try:
-            subprocess.check_call(pymolcmd)
-        except CalledProcessError:
+            with instrumentation.timer('pymol.render'):
+                subprocess.check_call(pymolcmd)
+        except subprocess.CalledProcessError:
             print 'pdb: error rendering pdb file for id {}'.format(pdb_id)
             return None
+        logger.info('Rendered PDB {0} in {1:.1f}s'.format(pdb_id, time.time() - start))
+        store_render(pdb_id, png_file)
         self.pngfile = png_file
         return png_file, caption_skeleton.format(pdb=pdb_id)
 
@@ -181,7 +454,7 @@ class PDB(object):
             raise ValueError('No .png file specified.')
 
         self.commons = commons
-        self.commons = mwclient.Site('commons.wikimedia.org')
+        self.commons = commons_site()
         if hasattr(settings, 'commons_user'):
             cuser = settings.commons_user
             cpass = settings.commons_pass
@@ -189,17 +462,20 @@ class PDB(object):
             cuser = settings.wiki_user
             cpass = settings.wiki_pass
 
-        self.commons.login(cuser, cpass)
+        upstream.call('commons', 'commons.login', self.commons.login, cuser, cpass)
 
         if not description:
             description = description_skeleton.format(symbol=self.hugosym,
                                                       pdb=self.pdbid, username=cuser,
                                                       date=str(datetime.datetime.now()))
 
+        def upload():
+            # reopened on every attempt, as a failed one may have consumed the file
+            with open(png_file, 'rb') as image:
+                return self.commons.upload(image, png_file.split(os.sep).pop(), description)
+
         try:
-            self.commons.upload(open(png_file),
-                                png_file.split(os.sep).pop(),
-                                description)
+            upstream.call('commons', 'commons.upload', upload)
 
         except mwclient.errors.LoginError:
             self.commons.login()
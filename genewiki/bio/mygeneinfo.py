@@ -2,9 +2,19 @@ from django.conf import settings
 
 from genewiki.wiki.textutils import ProteinBox
 from genewiki.bio.uniprot import uniprot_acc_for_entrez_id
+from genewiki.common import upstream, resilience
 from raven.contrib.django.raven_compat.models import client
 
-import re, mygene
+import re, sys, json, time, hashlib, threading, mygene
+
+GENE_FIELDS = 'name,summary,entrezgene,uniprot,pdb,HGNC,symbol,alias,MIM,ec,homologene,ensembl,refseq,genomic_pos,go'
+
+# mygene.info metadata is only rebuilt with each data release, so it is cached
+# for this many seconds instead of being re-requested for every gene.
+METADATA_TTL = 300
+_metadata_cache = {}
+# httplib2 connections are not thread safe, so each thread keeps its own client
+_clients = threading.local()
 
 
 def parse_go_category(entry):
@@ -86,26 +96,129 @@ def get_homolog(json_res):
            return None
 
 
+class MyGeneError(IOError):
+    '''
+      Raised for a mygene.info request answered with a status other than 200,
+      in place of the bare AssertionError the client library raises. It keeps
+      the response, so 429 and 5xx answers are retried and slow the calls down
+      as they do for the other upstream clients (see genewiki.common.resilience
+      and genewiki.common.concurrency).
+    '''
+
+    def __init__(self, url, response):
+        self.url = url
+        self.response = response
+        super(MyGeneError, self).__init__('mygene.info responded with HTTP {0} for {1}'.format(response.status, url))
+
+
+class MyGeneClient(mygene.MyGeneInfo):
+    '''
+      mygene.info client raising MyGeneError for failed requests.
+    '''
+
+    def _checked(self, request, url, params):
+        try:
+            return request(self, url, params)
+        except AssertionError as e:
+            # mygene asserts the status with (url, response, content) as message
+            if e.args and isinstance(e.args[0], tuple) and len(e.args[0]) == 3:
+                raise MyGeneError(e.args[0][0], e.args[0][1]), None, sys.exc_info()[2]
+            raise
+
+    # MyGeneInfo is an old-style class, so its methods are called unbound
+    def _get(self, url, params={}):
+        return self._checked(mygene.MyGeneInfo._get, url, params)
+
+    def _post(self, url, params):
+        return self._checked(mygene.MyGeneInfo._post, url, params)
+
+
+def mygene_client():
+    '''
+      Returns this thread's mygene.info client, which keeps its connection
+      alive between calls and times out after UPSTREAM_TIMEOUTS['mygene'] seconds.
+    '''
+    mg = getattr(_clients, 'mygene', None)
+    if mg is None:
+        mg = MyGeneClient()
+        mg.h.timeout = resilience.timeout_for('mygene')
+        _clients.mygene = mg
+    return mg
+
+
 def get_response(entrez):
-    mg = mygene.MyGeneInfo()
+    '''
+      Returns the mygene.info documents for a gene and its mouse homolog, its
+      Entrez id and reviewed UniProt accession. Raises ValueError if mygene.info
+      does not know the gene; other errors are reported to Sentry and re-raised.
+    '''
+    mg = mygene_client()
     try:
-        root = mg.getgene(entrez, 'name,summary,entrezgene,uniprot,pdb,HGNC,symbol,alias,MIM,ec,homologene,ensembl,refseq,genomic_pos,go', species='human')
-        meta = mg.metadata
+        root = upstream.call('mygene', 'mygene.getgene', mg.getgene, entrez, GENE_FIELDS, species='human')
+        if not root:
+            raise ValueError('Unknown Entrez gene {0}'.format(entrez))
+        meta = get_metadata()
         homolog = get_homolog(root)
-        homolog = mg.getgene(homolog, 'name,summary,entrezgene,uniprot,pdb,HGNC,symbol,alias,MIM,ec,homologene,ensembl,refseq,genomic_pos,go') if homolog else None
+        if homolog:
+            homolog = upstream.call('mygene', 'mygene.getgene', mg.getgene, homolog, GENE_FIELDS)
         entrez = root.get('entrezgene')
         uniprot = findReviewedUniprotEntry(root.get('uniprot'), entrez)
         return root, meta, homolog, entrez, uniprot
-    except Exception as e:
+    except ValueError:
+        raise
+    except Exception:
         client.captureException()
-        return e
+        raise
+
+def get_metadata():
+    '''
+      Returns the (briefly cached) mygene.info metadata document.
+    '''
+    if _metadata_cache.get('expires', 0) < time.time():
+        _metadata_cache['meta'] = upstream.call('mygene', 'mygene.metadata', getattr, mygene_client(), 'metadata')
+        _metadata_cache['expires'] = time.time() + METADATA_TTL
+    return _metadata_cache['meta']
+
+
+def get_build_date(meta=None):
+    '''
+      Returns the build date of the mygene.info data release, or None if the
+      metadata does not report one.
+    '''
+    meta = meta or get_metadata()
+    return meta.get('build_date') or meta.get('timestamp')
+
+
+def normalize(doc):
+    '''
+      Returns a copy of a mygene.info document without its volatile bookkeeping
+      keys (_id, _score, _timestamp, ...) so that equal data compares equal.
+    '''
+    if isinstance(doc, dict):
+        return dict((k, normalize(v)) for k, v in doc.iteritems() if not k.startswith('_'))
+    elif isinstance(doc, list):
+        return [normalize(x) for x in doc]
+    return doc
+
+
+def fingerprint(response):
+    '''
+      Returns a hex digest of the upstream data a ProteinBox is built from: the
+      human document, the mouse homolog document and the chosen UniProt entry.
+    '''
+    root, meta, homolog, entrez, uniprot = response
+    normalized = json.dumps([normalize(root), normalize(homolog), uniprot], sort_keys=True)
+    return hashlib.sha1(normalized).hexdigest()
+
 
-def generate_protein_box_for_entrez(entrez):
+def generate_protein_box_for_entrez(entrez, response=None):
     '''
       Returns a ProteinBox based on the provided JSON documents.
 
+      If the documents have already been fetched with get_response(), they can be
+      passed as `response` to avoid requesting them again.
     '''
-    root, meta, homolog, entrez, uniprot = get_response(entrez)
+    root, meta, homolog, entrez, uniprot = response or get_response(entrez)
     box = ProteinBox()
 
     name = root.get('name')
@@ -0,0 +1,129 @@
+'''
+    Batched resolution of the upstream data behind ProteinBoxes.
+
+    get_response() resolves one gene with a chain of blocking calls: the human
+    mygene.info document, the mouse homolog's, a UniProt mapping and a UniProt
+    reviewed check per candidate accession. resolve_many() produces the same
+    response for each of a list of genes, but makes every step one request per
+    batch of genes instead of per gene -- mygene.info's POST /gene takes up to
+    RESOLVER_BATCH_SIZE ids and UniProt's mapping and search endpoints take
+    RESOLVER_UNIPROT_BATCH_SIZE -- and runs the batches of each step in parallel
+    on RESOLVER_WORKERS threads. A few hundred genes cost a handful of requests.
+
+    resolve(entrez) is the synchronous single gene façade, a drop in for
+    get_response().
+'''
+
+from django.conf import settings
+
+from genewiki.bio.mygeneinfo import GENE_FIELDS, mygene_client, get_metadata, get_homolog, findReviewedUniprotEntry
+from genewiki.bio.uniprot import uniprot_accs_for_entrez_ids, reviewed_accessions
+from genewiki.common import upstream, instrumentation
+
+from multiprocessing.pool import ThreadPool
+import logging
+logger = logging.getLogger(__name__)
+
+
+def chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def fetch_genes(entrez_ids, **kwargs):
+    '''
+        Returns a dict of Entrez id (as a string) to mygene.info document for the
+        ids mygene.info knows.
+    '''
+    docs = upstream.call('mygene', 'mygene.getgenes', mygene_client().getgenes,
+                         entrez_ids, GENE_FIELDS, verbose=False, **kwargs)
+    found = {}
+    for doc in docs:
+        query = str(doc.pop('query', ''))
+        if not doc.get('notfound') and query not in found:
+            found[query] = doc
+    return found
+
+
+def reviewed_for_entrez(entrez_ids):
+    '''
+        Returns a dict of Entrez id (as a string) to its first reviewed UniProt
+        accession, for the ids that have one.
+    '''
+    accns = uniprot_accs_for_entrez_ids(entrez_ids)
+    candidates = [acc for accs in accns.values() for acc in accs]
+    reviewed = set()
+    for batch in chunks(candidates, settings.RESOLVER_UNIPROT_BATCH_SIZE):
+        reviewed.update(reviewed_accessions(batch))
+    return dict((entrez, next(acc for acc in accs if acc in reviewed))
+                for entrez, accs in accns.items() if reviewed.intersection(accs))
+
+
+def _in_parallel(pool, func, batches, **kwargs):
+    '''
+        Starts func(batch, **kwargs) for every batch on the pool and returns a
+        function that waits for them all and merges their dicts.
+    '''
+    func = instrumentation.bound(func)
+    results = [pool.apply_async(func, (batch,), kwargs) for batch in batches]
+
+    def merged():
+        found = {}
+        for result in results:
+            found.update(result.get())
+        return found
+    return merged
+
+
+def resolve_many(entrez_ids):
+    '''
+        Returns a dict of each Entrez id to the same (root, meta, homolog, entrez,
+        uniprot) response get_response() would return for it, or to a ValueError
+        if mygene.info does not know the gene. Upstream failures are raised.
+    '''
+    ids = dict((str(entrez), entrez) for entrez in entrez_ids)
+    if not ids:
+        return {}
+    batch_size = settings.RESOLVER_BATCH_SIZE
+    pool = ThreadPool(settings.RESOLVER_WORKERS)
+    try:
+        meta = pool.apply_async(instrumentation.bound(get_metadata))
+        # the UniProt mapping is keyed on the requested ids, so it runs
+        # alongside the human documents rather than after them
+        uniprot = _in_parallel(pool, reviewed_for_entrez, chunks(ids, settings.RESOLVER_UNIPROT_BATCH_SIZE))
+        roots = _in_parallel(pool, fetch_genes, chunks(ids, batch_size), species='human')()
+
+        homolog_ids = dict((key, get_homolog(root)) for key, root in roots.items())
+        wanted = set(str(h) for h in homolog_ids.values() if h)
+        homologs = _in_parallel(pool, fetch_genes, chunks(wanted, batch_size))()
+        meta, uniprot = meta.get(), uniprot()
+    finally:
+        pool.close()
+        pool.join()
+
+    responses = {}
+    for key, entrez in ids.items():
+        root = roots.get(key)
+        if not root:
+            responses[entrez] = ValueError('Unknown Entrez gene {0}'.format(entrez))
+            continue
+        homolog = homolog_ids[key]
+        homolog = homologs.get(str(homolog)) if homolog else homolog
+        gene = root.get('entrezgene')
+        if str(gene) == key:
+            accession = uniprot.get(key)
+        else:
+            # mygene.info answered for a different id (e.g. a replaced gene)
+            accession = findReviewedUniprotEntry(root.get('uniprot'), gene)
+        responses[entrez] = (root, meta, homolog, gene, accession)
+    return responses
+
+
+def resolve(entrez):
+    '''
+        Returns the response for a single gene, raising like get_response().
+    '''
+    response = resolve_many([entrez])[entrez]
+    if isinstance(response, Exception):
+        raise response
+    return response
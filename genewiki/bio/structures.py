@@ -0,0 +1,170 @@
+'''
+    Local index of the best PDB structure for each UniProt entry.
+
+    get_image() used to ask a development server at EBI for the best structure
+    of every gene. Instead, build_index() ranks every structure mapped to each
+    UniProt accession from three bulk files, and stores the winner per accession
+    in a Redis hash, so choosing a structure is a local lookup:
+
+    - SIFTS pdb_chain_uniprot, mapping PDB chains to UniProt residue ranges,
+      gives the number of the entry's residues a structure covers;
+    - the wwPDB entry type index gives the experimental method;
+    - the wwPDB resolution index gives the resolution.
+
+    Structures are ranked by method (X-ray diffraction, then electron
+    microscopy, then NMR), then by residues covered, then by resolution. The
+    index is rebuilt weekly by genewiki.bio.tasks.update_structure_index; the
+    EBI service remains as a fallback for genes missing from it.
+'''
+
+from django.conf import settings
+
+from genewiki.common import upstream, http
+
+import re, zlib, logging, redis
+logger = logging.getLogger(__name__)
+
+SIFTS_URL = 'https://ftp.ebi.ac.uk/pub/databases/msd/sifts/flatfiles/tsv/pdb_chain_uniprot.tsv.gz'
+ENTRY_TYPE_URL = 'https://files.wwpdb.org/pub/pdb/derived_data/pdb_entry_type.txt'
+RESOLUTION_URL = 'https://files.wwpdb.org/pub/pdb/derived_data/index/resolu.idx'
+
+# A dev server at EBI that provides 'chosen' PDB structures based on homologene ID
+ebiserver = 'http://wwwdev.ebi.ac.uk/pdbe-apps/jsonizer/homologene/{}/'
+
+INDEX_KEY = 'structures:best'
+
+METHOD_RANK = {'diffraction': 0, 'EM': 1, 'NMR': 2}
+
+
+def _connection():
+    return redis.StrictRedis(**settings.STRUCTURE_INDEX_REDIS)
+
+
+def stream_lines(url, name, compressed=False):
+    '''
+        Yields the lines of a remote text file as it downloads.
+    '''
+    response = upstream.call('ebi', name, http.session('ebi').get, url, stream=True)
+    response.raise_for_status()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compressed else None
+    pending = ''
+    try:
+        for chunk in response.iter_content(64 * 1024):
+            pending += decompressor.decompress(chunk) if decompressor else chunk
+            lines = pending.split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+    finally:
+        response.close()
+
+
+def entry_methods():
+    '''
+        Returns a dict of PDB id to experimental method.
+    '''
+    methods = {}
+    for line in stream_lines(ENTRY_TYPE_URL, 'wwpdb.entry_type'):
+        parts = line.split()
+        if len(parts) == 3:
+            methods[parts[0].upper()] = parts[2]
+    return methods
+
+
+def entry_resolutions():
+    '''
+        Returns a dict of PDB id to resolution in angstroms, for entries that
+        report one.
+    '''
+    resolutions = {}
+    for line in stream_lines(RESOLUTION_URL, 'wwpdb.resolution'):
+        match = re.match(r'^(\w{4})\s*;\s*([\d.]+)', line)
+        if match and float(match.group(2)) > 0:
+            resolutions[match.group(1).upper()] = float(match.group(2))
+    return resolutions
+
+
+def coverage():
+    '''
+        Returns a dict of UniProt accession to a dict of PDB id to the number of
+        the accession's residues the structure's chains cover.
+    '''
+    covered = {}
+    for line in stream_lines(SIFTS_URL, 'sifts.pdb_chain_uniprot', compressed=True):
+        parts = line.split('\t')
+        if len(parts) < 9 or not parts[8].strip().isdigit() or not parts[7].isdigit():
+            # the version comment and column header
+            continue
+        pdb_id, accession = parts[0].upper(), parts[2]
+        residues = int(parts[8]) - int(parts[7]) + 1
+        structures = covered.setdefault(accession, {})
+        structures[pdb_id] = structures.get(pdb_id, 0) + residues
+    return covered
+
+
+def rank(pdb_id, residues, methods, resolutions):
+    '''
+        Returns the sort key of a structure; lower is better.
+    '''
+    return (METHOD_RANK.get(methods.get(pdb_id), len(METHOD_RANK)), -residues, resolutions.get(pdb_id, 99.0), pdb_id)
+
+
+def build_index():
+    '''
+        Rebuilds the index from the bulk files and returns the number of UniProt
+        accessions in it. The new index replaces the old one atomically.
+    '''
+    methods = entry_methods()
+    resolutions = entry_resolutions()
+    best = {}
+    for accession, structures in coverage().iteritems():
+        best[accession] = min(structures.iteritems(), key=lambda s: rank(s[0], s[1], methods, resolutions))[0]
+
+    connection = _connection()
+    building = INDEX_KEY + ':building'
+    connection.delete(building)
+    items = best.items()
+    for i in range(0, len(items), 10000):
+        connection.hmset(building, dict(items[i:i + 10000]))
+    if items:
+        connection.rename(building, INDEX_KEY)
+    logger.info('Indexed the best structure of {0} UniProt entries'.format(len(best)))
+    return len(best)
+
+
+def best_structure(uniprot):
+    '''
+        Returns the PDB id of the best structure of a UniProt entry from the
+        index, or None.
+    '''
+    if not uniprot:
+        return None
+    try:
+        return _connection().hget(INDEX_KEY, uniprot)
+    except redis.RedisError:
+        logger.warn('Structure index unavailable', exc_info=True)
+        return None
+
+
+def ebi_best_structure(homologene):
+    '''
+        Asks EBI for the best structure of a homologene group. Returns the PDB
+        id or None.
+    '''
+    if not homologene:
+        return None
+    response = upstream.call('ebi', 'ebi.best_structure', http.session('ebi').get, ebiserver.format(homologene))
+    info = response.json()
+    if 'best_structure' in info:
+        return info['best_structure']['pdbid']
+    return None
+
+
+def choose_structure(uniprot, homologene):
+    '''
+        Returns the PDB id of the best structure for a gene: from the local
+        index if it has the gene's UniProt entry, otherwise from EBI.
+    '''
+    return best_structure(uniprot) or ebi_best_structure(homologene)
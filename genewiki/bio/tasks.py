@@ -1,17 +1,49 @@
 from __future__ import absolute_import
 
-from genewiki.bio.g2p_redis import init_redis, import_to_redis, download_g2p
+from genewiki.bio.g2p_redis import download_g2p, mark_loaded
+from genewiki.bio.g2p import load
+from genewiki.bio.images import PDB, cached_render
+from genewiki.bio.structures import build_index
 
 from celery import task
 
+import time, logging
+logger = logging.getLogger(__name__)
+
 
 @task()
 def update_gene2pubmed():
     '''
-        Downloads the most recent gene2pubmed file and imports into redis.
-        Returns a connection to the redis server used (uses default options).
+        Downloads the most recent gene2pubmed file and loads it into the
+        G2P_BACKEND store, unless it has not changed since the last run.
+    '''
+    filename = download_g2p()
+    if filename is None:
+        logger.info('gene2pubmed has not changed')
+        return
+    load(filename)
+    mark_loaded(filename)
+
+
+@task()
+def update_structure_index():
+    '''
+        Rebuilds the index of the best structure per UniProt entry.
     '''
+    return build_index()
 
-    r = init_redis()
-    import_to_redis(download_g2p(), r)
 
+@task(queue='render')
+def render_structure(pdb_id, symbol):
+    '''
+        Renders a structure into the render cache, unless it is already there.
+        Runs on the 'render' queue, served by its own pool of worker processes.
+        Returns the PDB id, whether it was cached and the render time.
+    '''
+    start = time.time()
+    if cached_render(pdb_id):
+        return {'pdb': pdb_id, 'cached': True, 'seconds': 0.0}
+    rendered = PDB(pdb_id, symbol).render()
+    seconds = time.time() - start
+    logger.info('Rendered PDB {0} for {1} in {2:.1f}s'.format(pdb_id, symbol, seconds))
+    return {'pdb': pdb_id, 'cached': False, 'seconds': seconds, 'failed': rendered is None}
@@ -0,0 +1,251 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from genewiki.bio.mygeneinfo import MyGeneClient, MyGeneError
+from genewiki.bio.g2p_snapshot import compile_snapshot, Snapshot
+from genewiki.bio import g2p_snapshot, g2p_redis
+from genewiki.common import upstream, resilience, concurrency, http
+from genewiki.common.testing import RedisTestCase
+
+import os, gzip, shutil, tempfile, httplib2
+
+
+class StubHttp(object):
+    '''
+      Stands in for the httplib2 connection of a mygene.info client, answering
+      every request with `status` and recording how many were made.
+    '''
+
+    def __init__(self, status, content='{}'):
+        self.status = status
+        self.content = content
+        self.requests = 0
+
+    def request(self, url, method='GET', body=None, headers=None):
+        self.requests += 1
+        return httplib2.Response({'status': str(self.status)}), self.content
+
+
+class MyGeneErrorTest(TestCase):
+
+    def mygene(self, status, content='{}'):
+        mg = MyGeneClient()
+        mg.h = StubHttp(status, content)
+        return mg
+
+    def test_success(self):
+        self.assertEqual(self.mygene(200, '{"symbol": "CDK2"}').getgene(1017), {'symbol': 'CDK2'})
+
+    def test_overload_is_transient_congestion(self):
+        with self.assertRaises(MyGeneError) as raised:
+            self.mygene(503).getgene(1017)
+        self.assertEqual(raised.exception.response.status, 503)
+        self.assertTrue(resilience.is_transient(raised.exception))
+        self.assertTrue(concurrency.is_congestion(error=raised.exception))
+
+    def test_rate_limited_post_is_transient(self):
+        with self.assertRaises(MyGeneError) as raised:
+            self.mygene(429).getgenes([1017, 1018])
+        self.assertTrue(resilience.is_transient(raised.exception))
+        self.assertTrue(concurrency.is_congestion(error=raised.exception))
+
+    def test_not_found_is_not_retried(self):
+        with self.assertRaises(MyGeneError) as raised:
+            self.mygene(404).getgene(1017)
+        self.assertFalse(resilience.is_transient(raised.exception))
+        self.assertFalse(concurrency.is_congestion(error=raised.exception))
+
+    @override_settings(UPSTREAM_RETRY={'attempts': 3, 'base_delay': 0, 'max_delay': 0, 'budget_ratio': 1.0})
+    def test_upstream_call_retries_then_gives_up(self):
+        mg = self.mygene(502)
+        with self.assertRaises(resilience.RetriesExhausted) as raised:
+            upstream.call('mygene_test', 'mygene.getgene', mg.getgene, 1017)
+        self.assertIsInstance(raised.exception.cause, MyGeneError)
+        self.assertEqual(mg.h.requests, 3)
+
+
+def write_gene2pubmed(path, rows):
+    with gzip.open(path, 'wb') as out:
+        out.write('#tax_id\tGeneID\tPubMed_ID\n')
+        for row in rows:
+            out.write('{0}\t{1}\t{2}\n'.format(*row))
+    return path
+
+
+@override_settings(G2P_RANKED_MAX_GENES=3)
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.link = os.path.join(self.path, 'current')
+        rows = [(9606, 1, 10), (9606, 1, 20), (9606, 1, 30),
+                (9606, 2, 20), (9606, 2, 30), (9606, 3, 30),
+                (10090, 1, 40)]
+        compile_snapshot(write_gene2pubmed(os.path.join(self.path, 'first.gz'), rows), self.link, chatty=False)
+
+    def tearDown(self):
+        g2p_snapshot._state.clear()
+        shutil.rmtree(self.path)
+
+    def test_pmids_most_specific_first(self):
+        snapshot = Snapshot(self.link)
+        self.assertEqual(snapshot.get_pmids(1), ['10', '20', '30'])
+        self.assertEqual(snapshot.get_pmids('g:2'), ['20', '30'])
+        self.assertEqual(snapshot.get_pmids(4), [])
+
+    def test_limit_and_ranking(self):
+        snapshot = Snapshot(self.link)
+        self.assertEqual(snapshot.get_pmids(1, limit=2), ['10'])
+        self.assertEqual(snapshot.get_ranked_pmids(1), ['10', '20'])
+        self.assertEqual(snapshot.get_ranked_pmids(1, count=1), ['10'])
+        self.assertEqual(snapshot.get_ranked_pmids(3), [])
+
+    def test_recompiling_switches_readers(self):
+        with self.settings(G2P_SNAPSHOT_PATH=self.link):
+            first = g2p_snapshot.get_snapshot()
+            self.assertEqual(first.get_pmids(1), ['10', '20', '30'])
+
+            compile_snapshot(write_gene2pubmed(os.path.join(self.path, 'second.gz'), [(9606, 1, 50)]), self.link, chatty=False)
+            self.assertEqual(g2p_snapshot.get_snapshot().get_pmids(1), ['50'])
+            self.assertFalse(os.path.exists(first.path))
+
+
+class StubResponse(object):
+
+    def __init__(self, status_code, content='', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+    def iter_content(self, size):
+        yield self.content
+
+    def close(self):
+        pass
+
+
+class StubSession(object):
+    '''
+      Stands in for the shared ncbi Session, answering 304 to requests carrying
+      the validators of the last response and recording the headers sent.
+    '''
+
+    def __init__(self):
+        self.sent = []
+
+    def get(self, url, headers=None, stream=False):
+        self.sent.append(headers)
+        if headers.get('If-None-Match') == 'v1':
+            return StubResponse(304)
+        return StubResponse(200, 'gene2pubmed', {'ETag': 'v1'})
+
+
+class DownloadTest(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'gene2pubmed.gz')
+        self.session = http._sessions.get('ncbi')
+        http._sessions['ncbi'] = StubSession()
+
+    def tearDown(self):
+        if self.session is None:
+            http._sessions.pop('ncbi')
+        else:
+            http._sessions['ncbi'] = self.session
+        shutil.rmtree(self.path)
+
+    def test_validators_kept_once_loaded(self):
+        self.assertEqual(g2p_redis.download_g2p(self.filename), self.filename)
+        # not loaded yet, so the file is fetched again
+        self.assertEqual(g2p_redis.download_g2p(self.filename), self.filename)
+        g2p_redis.mark_loaded(self.filename)
+        self.assertEqual(g2p_redis.download_g2p(self.filename), None)
+        self.assertEqual(http._sessions['ncbi'].sent, [{}, {}, {'If-None-Match': 'v1'}])
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'gene2pubmed')
+
+
+class DiffTest(TestCase):
+
+    def test_diff_sorted(self):
+        old = [(1, 10), (1, 20), (2, 20), (3, 30)]
+        new = [(1, 10), (1, 30), (2, 20), (4, 40)]
+        self.assertEqual(list(g2p_redis.diff_sorted(old, new)),
+                         [('-', (1, 20)), ('+', (1, 30)), ('-', (3, 30)), ('+', (4, 40))])
+        self.assertEqual(list(g2p_redis.diff_sorted([], new)), [('+', pair) for pair in new])
+        self.assertEqual(list(g2p_redis.diff_sorted(old, old)), [])
+
+    def test_sort_pairs_spills_runs(self):
+        pairs = [(3, 1), (1, 2), (2, 2), (1, 2), (1, 1), (3, 1), (2, 1)]
+        self.assertEqual(list(g2p_redis.sort_pairs(iter(pairs), chunk_size=2)),
+                         [(1, 1), (1, 2), (2, 1), (2, 2), (3, 1)])
+
+
+@override_settings(G2P_RANKED_MAX_GENES=3, G2P_RANKED_SIZE=2)
+class G2PRedisTest(RedisTestCase):
+
+    def setUp(self):
+        super(G2PRedisTest, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.state = os.path.join(self.path, 'state.tsv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(G2PRedisTest, self).tearDown()
+
+    def update(self, name, rows):
+        filename = write_gene2pubmed(os.path.join(self.path, name), rows)
+        return g2p_redis.update_redis(filename, self.redis, self.state)
+
+    def test_apply_diff_is_idempotent(self):
+        changes = [('+', (1, 10)), ('+', (2, 10)), ('+', (1, 20))]
+        self.assertEqual(g2p_redis.apply_diff(changes, self.redis, batch_size=2), (3, 0))
+        # applied again, as after an interrupted update
+        self.assertEqual(g2p_redis.apply_diff(changes, self.redis), (0, 0))
+        self.assertEqual(self.redis.get('p:10'), '2')
+
+        removals = [('-', (1, 20)), ('-', (2, 10))]
+        self.assertEqual(g2p_redis.apply_diff(removals, self.redis), (0, 2))
+        self.assertEqual(g2p_redis.apply_diff(removals, self.redis), (0, 0))
+        self.assertEqual(self.redis.get('p:10'), '1')
+        self.assertFalse(self.redis.exists('p:20'))
+        self.assertEqual(self.redis.smembers('g:1'), set(['p:10']))
+
+    def test_update_applies_changes_and_ranks(self):
+        self.assertEqual(self.update('first.gz', [(9606, 1, 10), (9606, 1, 20), (9606, 1, 30), (9606, 2, 20),
+                                                  (9606, 3, 20), (9606, 3, 40), (10090, 1, 50)]), (6, 0))
+        self.assertEqual(sorted(g2p_redis.get_pmids(1, self.redis, limit=3)), ['10', '30'])
+        self.assertEqual(g2p_redis.get_ranked_pmids(1, self.redis), ['30', '10'])
+        self.assertEqual(g2p_redis.get_ranked_pmids(3, self.redis), ['40'])
+        self.assertEqual(g2p_redis.get_ranked_pmids(2, self.redis), None)
+
+        # pmid 20 now cites two genes, so gene 3's ranking changes too
+        self.assertEqual(self.update('second.gz', [(9606, 1, 10), (9606, 1, 20), (9606, 1, 30), (9606, 2, 20),
+                                                   (9606, 3, 40), (9606, 3, 50)]), (1, 1))
+        self.assertEqual(self.redis.get('p:20'), '2')
+        self.assertEqual(g2p_redis.get_ranked_pmids(1, self.redis), ['30', '10'])
+        self.assertEqual(g2p_redis.get_ranked_pmids(2, self.redis), ['20'])
+        self.assertEqual(g2p_redis.get_ranked_pmids(3, self.redis), ['50', '40'])
+        self.assertEqual(list(g2p_redis.read_state(self.state))[-1], (3, 50))
+
+    def test_rankings_marker(self):
+        rows = [(9606, 1, 10), (9606, 2, 20)]
+        self.update('first.gz', rows)
+        self.assertTrue(self.redis.exists(g2p_redis.RANKINGS_KEY))
+
+        # an update that changes nothing ranks no gene
+        self.redis.delete('r:1', 'r:2')
+        self.update('second.gz', rows)
+        self.assertEqual(g2p_redis.get_ranked_pmids(1, self.redis), None)
+
+        # without the marker every gene is ranked again
+        self.redis.delete(g2p_redis.RANKINGS_KEY)
+        self.update('third.gz', rows)
+        self.assertEqual(g2p_redis.get_ranked_pmids(1, self.redis), ['10'])
+        self.assertEqual(g2p_redis.get_ranked_pmids(2, self.redis), ['20'])
+        self.assertTrue(self.redis.exists(g2p_redis.RANKINGS_KEY))
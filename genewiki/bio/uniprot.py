@@ -1,4 +1,4 @@
-import requests
+from genewiki.common import upstream, http
 
 
 def uniprot_acc_for_entrez_id(entrez):
@@ -12,7 +12,8 @@ def uniprot_acc_for_entrez_id(entrez):
         'reviewed': '',
         'query': entrez
     }
-    response = requests.get('http://www.uniprot.org/mapping/', params=payload)
+    response = upstream.call('uniprot', 'uniprot.mapping', http.session('uniprot').get,
+                             'http://www.uniprot.org/mapping/', params=payload)
     accns = response.text.split('\n')
     for acc in filter(None, accns):
         if is_reviewed(acc):
@@ -22,5 +23,41 @@ def uniprot_acc_for_entrez_id(entrez):
 
 def is_reviewed(uniprot):
     url = 'http://www.uniprot.org/uniprot/?query=reviewed:yes+AND+accession:{}&format=list'.format(uniprot)
-    return bool(requests.get(url).text.strip('\n'))
+    return bool(upstream.call('uniprot', 'uniprot.is_reviewed', http.session('uniprot').get, url).text.strip('\n'))
 
+
+def uniprot_accs_for_entrez_ids(entrez_ids):
+    '''
+        Returns a dict of each Entrez id (as a string) to the list of UniProt
+        accessions mapped to it, in the order UniProt returns them, using a
+        single mapping request.
+    '''
+    payload = {
+        'from': 'P_ENTREZGENEID',
+        'to': 'ACC',
+        'format': 'tab',
+        'reviewed': '',
+        'query': ' '.join(str(entrez) for entrez in entrez_ids)
+    }
+    response = upstream.call('uniprot', 'uniprot.mapping', http.session('uniprot').get,
+                             'http://www.uniprot.org/mapping/', params=payload)
+    accns = {}
+    # the first line is the From/To header
+    for line in response.text.split('\n')[1:]:
+        if '\t' in line:
+            entrez, acc = line.split('\t', 1)
+            accns.setdefault(entrez, []).append(acc.strip())
+    return accns
+
+
+def reviewed_accessions(accns):
+    '''
+        Returns the set of the given UniProt accessions that are reviewed, using
+        a single search request.
+    '''
+    if not accns:
+        return set()
+    query = 'reviewed:yes AND ({})'.format(' OR '.join('accession:' + acc for acc in accns))
+    response = upstream.call('uniprot', 'uniprot.is_reviewed', http.session('uniprot').get,
+                             'http://www.uniprot.org/uniprot/', params={'query': query, 'format': 'list'})
+    return set(filter(None, response.text.split('\n')))
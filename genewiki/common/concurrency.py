@@ -0,0 +1,164 @@
+'''
+    Adaptive limits on concurrent requests to each upstream service.
+
+    A fixed number of workers either leaves a fast upstream underused or piles
+    onto a slow one. Instead, each service named in ADAPTIVE_CONCURRENCY gets an
+    AIMD (additive increase, multiplicative decrease) controller, like TCP
+    congestion control: every call that completes within the service's target
+    latency raises the number of calls allowed in flight by about one per round
+    of calls, and a slow call, a timeout, an HTTP 429/503 or a MediaWiki
+    maxlag/ratelimited error cuts it by a constant factor (at most once per
+    target latency, so a burst of failures from one episode counts once).
+
+    Calls wait in slot() while their service is at its limit. The update
+    pipeline can then run more fetch workers than any upstream should normally
+    see, and the controllers decide how many are actually talking to each
+    service at a time. Limits are per process.
+'''
+
+from django.conf import settings
+
+from genewiki.common import instrumentation
+
+import time, socket, threading, logging
+logger = logging.getLogger(__name__)
+
+CONGESTION_STATUSES = (429, 503)
+CONGESTION_CODES = ('maxlag', 'ratelimited')
+
+
+def is_congestion(result=None, error=None):
+    '''
+        Returns True if the result of a call, or the exception it raised, shows
+        that the upstream is overloaded or asking us to slow down.
+    '''
+    response = getattr(error, 'response', None) if error is not None else result
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    if status in CONGESTION_STATUSES:
+        return True
+    if getattr(error, 'code', None) in CONGESTION_CODES:
+        return True
+    if isinstance(error, socket.timeout):
+        return True
+    try:
+        import requests
+        return isinstance(error, requests.exceptions.Timeout)
+    except ImportError:
+        return False
+
+
+class AIMDController(object):
+    '''
+      Limits the calls in flight to one service, adjusting the limit from the
+      latency and outcome of each completed call. Thread safe.
+    '''
+
+    def __init__(self, service, initial=4, minimum=1, maximum=32, target_latency=2.0, decrease=0.5):
+        self.service = service
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, congested=False):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.time()
+            if congested or latency > self.target_latency:
+                if now - self._last_decrease > self.target_latency:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+                    instrumentation.count('concurrency.{0}.decrease'.format(self.service))
+                    logger.info('Reduced {0} concurrency to {1:.1f}'.format(self.service, self.limit))
+            else:
+                # roughly +1 for every `limit` successful calls
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def slot(self):
+        return _Slot(self)
+
+    def state(self):
+        return {'limit': self.limit, 'in_flight': self.in_flight}
+
+
+class _Slot(object):
+    '''
+      Context manager holding one of a controller's slots for the duration of a
+      call. Exceptions are classified and re-raised; use report() to pass a
+      result that should count as congestion without raising.
+    '''
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.congested = False
+
+    def report(self, result):
+        self.congested = is_congestion(result=result)
+        return result
+
+    def __enter__(self):
+        self.controller.acquire()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        congested = self.congested or (exc is not None and is_congestion(error=exc))
+        self.controller.release(time.time() - self.start, congested)
+        return False
+
+
+class _NullSlot(object):
+
+    def report(self, result):
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_slot = _NullSlot()
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def controller_for(service):
+    '''
+        Returns the service's controller, or None if it is not adaptively limited.
+    '''
+    options = settings.ADAPTIVE_CONCURRENCY.get(service)
+    if options is None:
+        return None
+    with _controllers_lock:
+        if service not in _controllers:
+            _controllers[service] = AIMDController(service, **options)
+    return _controllers[service]
+
+
+def slot(service):
+    '''
+        Context manager waiting for, and holding, a slot for a call to `service`.
+    '''
+    controller = controller_for(service)
+    return controller.slot() if controller else _null_slot
+
+
+def snapshot():
+    '''
+        Returns the current limit and calls in flight of every controller.
+    '''
+    with _controllers_lock:
+        return dict((service, c.state()) for service, c in _controllers.items())
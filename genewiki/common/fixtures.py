@@ -0,0 +1,204 @@
+'''
+    Record and replay of upstream HTTP traffic.
+
+    The bio clients and the wiki code reach mygene.info, UniProt, EBI, RCSB,
+    Wikidata and Wikipedia through three HTTP stacks: requests (UniProt, the
+    Wikidata SPARQL client and mwclient), httplib2 (mygene) and urllib. With
+    UPSTREAM_FIXTURE_MODE set, install() patches all three at their lowest
+    common entry point:
+
+    - 'record' passes every request through and saves the response in the
+      fixture store at UPSTREAM_FIXTURE_PATH.
+    - 'replay' serves every request from the fixture store and never touches
+      the network; a request that was not recorded raises FixtureMissing.
+
+    Fixtures are keyed on the method, the URL and the request body with their
+    query parameters sorted, minus UPSTREAM_FIXTURE_IGNORE_PARAMS (session
+    tokens, timestamps and passwords), which are never written to disk.
+    Neither are the response headers in SECRET_HEADERS, such as the session
+    cookies set by the Wikipedia login.
+'''
+
+from django.conf import settings
+
+import os, json, base64, hashlib, threading, urllib, urlparse, mimetools, StringIO, logging
+logger = logging.getLogger(__name__)
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Response headers left out of fixtures (compared in lower case)
+SECRET_HEADERS = ('set-cookie', 'set-cookie2', 'cookie', 'authorization', 'proxy-authorization')
+
+_installed = {}
+_install_lock = threading.Lock()
+
+
+class FixtureMissing(IOError):
+    '''
+      Raised in replay mode for a request that has no recorded response.
+    '''
+    pass
+
+
+def _strip_params(encoded):
+    pairs = urlparse.parse_qsl(encoded, keep_blank_values=True)
+    pairs = [(k, v) for k, v in pairs if k not in settings.UPSTREAM_FIXTURE_IGNORE_PARAMS]
+    return urllib.urlencode(sorted(pairs))
+
+
+def request_key(method, url, body=None):
+    '''
+      Returns the fixture key of a request.
+    '''
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    url = urlparse.urlunsplit((scheme, netloc, path, _strip_params(query), ''))
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    if isinstance(body, str) and '=' in body:
+        body = _strip_params(body)
+    elif not isinstance(body, str):
+        # streamed or multipart bodies (uploads) are keyed on the URL alone
+        body = ''
+    return url, hashlib.sha1('{0} {1}\n{2}'.format(method.upper(), url, body)).hexdigest()
+
+
+class FixtureStore(object):
+    '''
+      Directory of recorded responses, one JSON file per request grouped in a
+      subdirectory per host.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _filename(self, url, key):
+        host = urlparse.urlsplit(url).netloc or 'local'
+        return os.path.join(self.path, host, key + '.json')
+
+    def get(self, method, url, body=None):
+        '''
+          Returns the recorded (status, headers, content) of a request, or
+          raises FixtureMissing.
+        '''
+        url, key = request_key(method, url, body)
+        filename = self._filename(url, key)
+        if not os.path.exists(filename):
+            with self._lock:
+                self.misses += 1
+            raise FixtureMissing('No fixture recorded for {0} {1}'.format(method, url))
+        with open(filename) as f:
+            fixture = json.load(f)
+        with self._lock:
+            self.hits += 1
+        return fixture['status'], fixture['headers'], base64.b64decode(fixture['content'])
+
+    def put(self, method, url, body, status, headers, content):
+        url, key = request_key(method, url, body)
+        filename = self._filename(url, key)
+        fixture = {'method': method.upper(),
+                   'url': url,
+                   'status': status,
+                   'headers': dict((k, v) for k, v in dict(headers).items() if k.lower() not in SECRET_HEADERS),
+                   'content': base64.b64encode(content or '')}
+        with self._lock:
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as f:
+                json.dump(fixture, f, indent=1, sort_keys=True)
+
+
+def _patch_requests(store, mode):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    original = requests.Session.send
+
+    def send(session, request, **kwargs):
+        if mode == REPLAY:
+            status, headers, content = store.get(request.method, request.url, request.body)
+            response = requests.models.Response()
+            response.status_code = status
+            response.headers = CaseInsensitiveDict(headers)
+            response._content = content
+            response._content_consumed = True
+            response.url = request.url
+            response.request = request
+            response.connection = session.get_adapter(request.url)
+            return response
+
+        response = original(session, request, **kwargs)
+        store.put(request.method, request.url, request.body, response.status_code, response.headers, response.content)
+        return response
+
+    requests.Session.send = send
+
+
+def _patch_httplib2(store, mode):
+    import httplib2
+
+    original = httplib2.Http.request
+
+    def request(http, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        if mode == REPLAY:
+            status, recorded, content = store.get(method, uri, body)
+            info = dict(recorded, status=str(status))
+            return httplib2.Response(info), content
+
+        response, content = original(http, uri, method, body, headers, *args, **kwargs)
+        store.put(method, uri, body, response.status, response, content)
+        return response, content
+
+    httplib2.Http.request = request
+
+
+def _patch_urllib(store, mode):
+    original = urllib.urlopen
+
+    def urlopen(url, data=None, *args, **kwargs):
+        method = 'POST' if data is not None else 'GET'
+        if mode == REPLAY:
+            status, headers, content = store.get(method, url, data)
+        else:
+            remote = original(url, data, *args, **kwargs)
+            content = remote.read()
+            status = remote.getcode() or 200
+            headers = dict(remote.info().items())
+            remote.close()
+            store.put(method, url, data, status, headers, content)
+        header_text = ''.join('{0}: {1}\r\n'.format(k, v) for k, v in headers.items())
+        message = mimetools.Message(StringIO.StringIO(header_text))
+        return urllib.addinfourl(StringIO.StringIO(content), message, url, status)
+
+    urllib.urlopen = urlopen
+
+
+def install():
+    '''
+      Patches the HTTP clients according to UPSTREAM_FIXTURE_MODE. Safe to call
+      more than once; does nothing when the mode is unset. Returns the active
+      FixtureStore, or None.
+    '''
+    mode = getattr(settings, 'UPSTREAM_FIXTURE_MODE', None)
+    if mode not in (RECORD, REPLAY):
+        return None
+
+    with _install_lock:
+        if 'store' not in _installed:
+            store = FixtureStore(settings.UPSTREAM_FIXTURE_PATH)
+            _patch_requests(store, mode)
+            _patch_httplib2(store, mode)
+            _patch_urllib(store, mode)
+            _installed['store'] = store
+            logger.info('Upstream fixtures installed in {0} mode from {1}'.format(mode, store.path))
+    return _installed['store']
+
+
+def active_store():
+    '''
+      Returns the installed FixtureStore, or None if fixtures are not in use.
+    '''
+    return _installed.get('store')
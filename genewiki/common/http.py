@@ -0,0 +1,69 @@
+'''
+    Pooled HTTP sessions for upstream services.
+
+    session(service) returns the process wide requests Session for one upstream
+    service, created on first use. Its connection pool keeps up to
+    HTTP_POOL_SIZES[service] (default HTTP_POOL_SIZE) keep-alive connections per
+    host, so repeated small API calls skip the TCP and TLS handshakes, and the
+    pipeline's fetch workers share the pool safely: when every connection is in
+    use a request waits for one rather than opening more. Requests made without
+    a timeout get the service's UPSTREAM_TIMEOUTS entry, and responses are
+    requested gzip or deflate compressed.
+
+    Clients that keep state on their session, such as the login cookies of an
+    mwclient Site, take a private one from new_session(service) instead.
+'''
+
+from django.conf import settings
+
+from genewiki.common import resilience
+
+from requests.adapters import HTTPAdapter
+import threading, requests
+
+USER_AGENT = 'Protein Box Bot, Run by The Scripps Research Institute: nanis@scripps.edu'
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class TimeoutAdapter(HTTPAdapter):
+    '''
+      Transport adapter applying a default timeout to requests made without one.
+    '''
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super(TimeoutAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(TimeoutAdapter, self).send(request, **kwargs)
+
+
+def pool_size(service):
+    return settings.HTTP_POOL_SIZES.get(service, settings.HTTP_POOL_SIZE)
+
+
+def new_session(service):
+    '''
+        Returns a new Session configured for `service`.
+    '''
+    size = pool_size(service)
+    adapter = TimeoutAdapter(resilience.timeout_for(service), pool_connections=size, pool_maxsize=size, pool_block=True)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+def session(service):
+    '''
+        Returns the shared Session for `service`.
+    '''
+    with _sessions_lock:
+        if service not in _sessions:
+            _sessions[service] = new_session(service)
+        return _sessions[service]
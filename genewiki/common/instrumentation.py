@@ -0,0 +1,232 @@
+'''
+    Lightweight timers and counters for refresh runs.
+
+    Code that does something worth measuring wraps it in a timer:
+
+        with instrumentation.timer('uniprot.mapping'):
+            ...
+
+    or decorates a function with @instrumentation.timed('name'). While a run is
+    active (between start_run() and finish_run()) these record durations and
+    call counts, attributed to the gene set with instrumentation.gene(entrez)
+    when there is one. finish_run() aggregates them into percentiles per timer
+    and distributions of calls per gene.
+
+    Outside a run, or with INSTRUMENTATION_ENABLED off, timer() returns a shared
+    no-op context manager, so instrumented code pays a single lookup.
+
+    A run's recorder belongs to the thread that started it, so runs made at
+    the same time (by web threads, or a single article update during a full
+    refresh) keep their numbers apart. Threads doing work for a run, such as
+    the pipeline's workers, report to it by running through bound().
+'''
+
+from django.conf import settings
+from django.utils import timezone
+
+from collections import defaultdict
+from functools import wraps
+import time, threading
+
+_local = threading.local()
+
+
+def percentile(ordered, p):
+    '''
+        Returns the p-th percentile (0-100) of an already sorted list, using the
+        nearest-rank method.
+    '''
+    if not ordered:
+        return None
+    rank = int(round(p / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize(values):
+    '''
+        Returns the count, total, mean, throughput, p50/p95/p99 and maximum of a
+        list of durations (or any other numbers).
+    '''
+    ordered = sorted(values)
+    total = sum(ordered)
+    return {'count': len(ordered),
+            'total': total,
+            'mean': total / float(len(ordered)) if ordered else None,
+            'throughput': len(ordered) / total if total else None,
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+            'max': ordered[-1] if ordered else None}
+
+
+class Recorder(object):
+    '''
+      Collects the timings and counts of one run. Thread safe.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.started = timezone.now()
+        self.timings = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.per_gene = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def add_timing(self, name, seconds):
+        gene = getattr(_local, 'gene', None)
+        with self._lock:
+            self.timings[name].append(seconds)
+            self.counts[name] += 1
+            if gene is not None:
+                self.per_gene[name][gene] += 1
+
+    def add_count(self, name, n=1):
+        gene = getattr(_local, 'gene', None)
+        with self._lock:
+            self.counts[name] += n
+            if gene is not None:
+                self.per_gene[name][gene] += n
+
+    def snapshot(self):
+        with self._lock:
+            return {'name': self.name,
+                    'started': self.started.isoformat(),
+                    'finished': timezone.now().isoformat(),
+                    'timings': dict((name, summarize(t)) for name, t in self.timings.items()),
+                    'counts': dict(self.counts),
+                    'calls_per_gene': dict((name, summarize(genes.values())) for name, genes in self.per_gene.items())}
+
+
+class _Timer(object):
+
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add_timing(self.name, time.time() - self.start)
+        return False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+
+def active():
+    '''
+      Returns the Recorder of the run this thread reports to, or None.
+    '''
+    return getattr(_local, 'recorder', None)
+
+
+def start_run(name):
+    '''
+      Starts recording a run in this thread and returns its Recorder, or None
+      if instrumentation is disabled.
+    '''
+    if not settings.INSTRUMENTATION_ENABLED:
+        return None
+    _local.recorder = Recorder(name)
+    return _local.recorder
+
+
+def finish_run(recorder=None):
+    '''
+      Stops recording `recorder` (default: this thread's) and returns the
+      aggregated snapshot of its run, or None if no run was being recorded.
+    '''
+    recorder = recorder or active()
+    if recorder is not None and active() is recorder:
+        _local.recorder = None
+    return recorder.snapshot() if recorder else None
+
+
+def bound(func):
+    '''
+      Returns a wrapper of `func` that reports to the calling thread's current
+      run whichever thread it is eventually called from.
+    '''
+    recorder = active()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = active()
+        _local.recorder = recorder
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.recorder = previous
+    return wrapper
+
+
+def timer(name):
+    '''
+      Context manager timing the enclosed block under `name`.
+    '''
+    recorder = active()
+    if recorder is None:
+        return _null_timer
+    return _Timer(recorder, name)
+
+
+def timed(name):
+    '''
+      Decorator timing every call of the function under `name`.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    '''
+      Adds an already measured duration to the timer `name`.
+    '''
+    recorder = active()
+    if recorder is not None:
+        recorder.add_timing(name, seconds)
+
+
+def count(name, n=1):
+    '''
+      Adds `n` to the counter `name`.
+    '''
+    recorder = active()
+    if recorder is not None:
+        recorder.add_count(name, n)
+
+
+class gene(object):
+    '''
+      Context manager attributing the timers and counts recorded by this thread
+      to the gene `entrez`.
+    '''
+
+    def __init__(self, entrez):
+        self.entrez = entrez
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'gene', None)
+        _local.gene = self.entrez
+        return self
+
+    def __exit__(self, *exc):
+        _local.gene = self.previous
+        return False
@@ -0,0 +1,108 @@
+'''
+    Cluster wide rate limiting of upstream services.
+
+    Each service named in RATE_LIMITS gets a token bucket stored in Redis, so
+    every Celery worker (and the web process) draws from the same budget. A
+    bucket holds at most `burst` tokens and refills at `rate` tokens per second;
+    each request takes one token. The refill and take happen in a single Lua
+    script, so concurrent workers cannot overdraw a bucket.
+
+    acquire() blocks until a token is available (or a timeout passes); with
+    blocking=False it returns immediately whether or not it got one. Time spent
+    waiting is reported to the instrumentation as 'ratelimit.<service>'.
+
+    Services without a configured limit are not limited. If Redis cannot be
+    reached, requests are let through rather than stalling every worker.
+'''
+
+from django.conf import settings
+
+from genewiki.common import instrumentation
+
+import time, threading, logging, redis
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: bucket key. ARGV: rate (tokens/s), burst, now (s), tokens requested.
+# Takes the tokens if available and returns 0, otherwise takes nothing and
+# returns the number of seconds until enough will have accumulated.
+TOKEN_BUCKET = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+'''
+
+_state = {}
+_state_lock = threading.Lock()
+
+
+def _script():
+    with _state_lock:
+        if 'script' not in _state:
+            connection = redis.StrictRedis(**settings.RATE_LIMIT_REDIS)
+            _state['script'] = connection.register_script(TOKEN_BUCKET)
+    return _state['script']
+
+
+def limit_for(service):
+    '''
+        Returns the (rate, burst) configured for a service, or None.
+    '''
+    return settings.RATE_LIMITS.get(service)
+
+
+def try_acquire(service, tokens=1, limit=None):
+    '''
+        Attempts to take `tokens` from the service's bucket. Returns 0 on success,
+        or the number of seconds to wait before trying again. A (rate, burst)
+        `limit` overrides the configured one.
+    '''
+    limit = limit or limit_for(service)
+    if not limit:
+        return 0
+    rate, burst = limit
+    try:
+        wait = _script()(keys=['ratelimit:' + service], args=[rate, burst, time.time(), tokens])
+    except redis.RedisError:
+        logger.warn('Rate limiter unavailable; not limiting {0}'.format(service), exc_info=True)
+        return 0
+    return float(wait)
+
+
+def acquire(service, tokens=1, blocking=True, timeout=None, limit=None):
+    '''
+        Takes `tokens` from the service's bucket. Blocks until they are available
+        unless `blocking` is False, or until `timeout` seconds have passed.
+        Returns True if the tokens were taken.
+    '''
+    start = time.time()
+    wait = try_acquire(service, tokens, limit)
+    while wait:
+        if not blocking:
+            return False
+        if timeout is not None:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                instrumentation.record('ratelimit.' + service, time.time() - start)
+                return False
+            wait = min(wait, remaining)
+        time.sleep(wait)
+        wait = try_acquire(service, tokens, limit)
+
+    waited = time.time() - start
+    if waited > 0.001:
+        instrumentation.record('ratelimit.' + service, waited)
+    return True
@@ -0,0 +1,237 @@
+'''
+    Timeouts, retries and circuit breakers for upstream calls.
+
+    upstream.call() runs every attempt at a call through the service's circuit
+    breaker and retries transient failures:
+
+    - A failure is a connection error, a timeout, an HTTP 429 or 5xx response
+      or a MediaWiki maxlag/ratelimited error. Anything else (a 404, a parse
+      error, an edit conflict) is the caller's business and is raised at once.
+    - Failures are retried up to UPSTREAM_RETRY['attempts'] times in all, after
+      an exponentially growing, fully jittered delay. Retries also draw on a
+      per-service budget refilled by UPSTREAM_RETRY['budget_ratio'] per call,
+      so a struggling upstream sees at most that fraction of extra traffic.
+      Once retries run out the last failure is raised as RetriesExhausted.
+    - After CIRCUIT_BREAKER['failure_threshold'] consecutive failures the
+      service's breaker opens and calls fail immediately with CircuitOpen
+      instead of tying up a worker. After CIRCUIT_BREAKER['reset_timeout']
+      seconds one trial call is let through; its success closes the breaker.
+
+    Every client gets a timeout from UPSTREAM_TIMEOUTS, through timeout_for() or
+    the sessions of genewiki.common.http, so a dead upstream cannot hold a
+    socket open forever.
+'''
+
+from django.conf import settings
+
+from genewiki.common import instrumentation
+
+import sys, time, random, socket, threading, logging, requests
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_CODES = ('maxlag', 'ratelimited', 'readonly')
+
+
+class UpstreamUnavailable(IOError):
+    '''
+      Raised when an upstream service could not be reached or kept failing. An
+      IOError, so code already handling network errors handles it too.
+    '''
+    pass
+
+
+class CircuitOpen(UpstreamUnavailable):
+    '''
+      Raised without calling the upstream while its circuit breaker is open.
+    '''
+    pass
+
+
+class UpstreamError(UpstreamUnavailable):
+    '''
+      Raised for a response whose status shows a transient upstream failure.
+    '''
+
+    def __init__(self, service, response):
+        self.response = response
+        status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+        super(UpstreamError, self).__init__('{0} responded with HTTP {1}'.format(service, status))
+
+
+class RetriesExhausted(UpstreamUnavailable):
+    '''
+      Raised when a transient failure persisted through every retry allowed.
+      The last underlying error is kept as `cause`.
+    '''
+
+    def __init__(self, service, cause):
+        self.cause = cause
+        super(RetriesExhausted, self).__init__('{0} kept failing: {1}: {2}'.format(service, type(cause).__name__, cause))
+
+
+def timeout_for(service):
+    return settings.UPSTREAM_TIMEOUTS.get(service)
+
+
+def failed_response(result):
+    '''
+        Returns True if `result` is an HTTP response with a retryable status.
+    '''
+    status = getattr(result, 'status_code', None) or getattr(result, 'status', None)
+    return status in RETRY_STATUSES
+
+
+def is_transient(error):
+    '''
+        Returns True if an exception raised by an upstream call is worth retrying.
+    '''
+    if isinstance(error, (UpstreamError, socket.error, socket.timeout)):
+        return True
+    if getattr(error, 'code', None) in RETRY_CODES:
+        return True
+    if failed_response(getattr(error, 'response', None)):
+        return True
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    try:
+        import httplib2
+        return isinstance(error, httplib2.HttpLib2Error)
+    except ImportError:
+        return False
+
+
+class CircuitBreaker(object):
+    '''
+      Tracks consecutive failures of one service. Thread safe.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, service, failure_threshold=5, reset_timeout=60):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        '''
+          Raises CircuitOpen unless a call may be made now.
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.time() - self.opened >= self.reset_timeout:
+                # let a single trial call through
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpen('{0} is unavailable; circuit open'.format(self.service))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warn('Circuit opened for {0} after {1} failures'.format(self.service, self.failures))
+                    instrumentation.count('circuit.{0}.opened'.format(self.service))
+                self.state = self.OPEN
+                self.opened = time.time()
+
+
+class RetryBudget(object):
+    '''
+      Allows retries only while they stay within a fraction of the calls made.
+    '''
+
+    def __init__(self, ratio=0.2, minimum=3):
+        self.ratio = ratio
+        self.maximum = max(minimum, 10)
+        self.tokens = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+_breakers = {}
+_budgets = {}
+_lock = threading.Lock()
+
+
+def breaker_for(service):
+    with _lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service, **settings.CIRCUIT_BREAKER)
+        return _breakers[service]
+
+
+def budget_for(service):
+    with _lock:
+        if service not in _budgets:
+            _budgets[service] = RetryBudget(settings.UPSTREAM_RETRY['budget_ratio'])
+        return _budgets[service]
+
+
+def backoff(attempt):
+    '''
+        Returns the delay before retry number `attempt` (1 based): uniformly
+        random up to base_delay * 2 ** (attempt - 1), capped at max_delay.
+    '''
+    options = settings.UPSTREAM_RETRY
+    return random.uniform(0, min(options['max_delay'], options['base_delay'] * 2 ** (attempt - 1)))
+
+
+def resilient(service, attempt):
+    '''
+        Calls attempt() through the service's circuit breaker, retrying
+        transient failures. Returns its result or raises its last error.
+    '''
+    breaker = breaker_for(service)
+    budget = budget_for(service)
+    budget.deposit()
+    attempts = settings.UPSTREAM_RETRY['attempts']
+    for number in range(1, attempts + 1):
+        breaker.before_call()
+        try:
+            result = attempt()
+            if failed_response(result):
+                raise UpstreamError(service, result)
+        except Exception as e:
+            if not is_transient(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if number == attempts or not budget.withdraw():
+                if isinstance(e, UpstreamUnavailable):
+                    raise
+                raise RetriesExhausted(service, e), None, sys.exc_info()[2]
+            instrumentation.count('retry.' + service)
+            time.sleep(backoff(number))
+        else:
+            breaker.record_success()
+            return result
+
+
+def state():
+    '''
+        Returns the state of every circuit breaker.
+    '''
+    with _lock:
+        return dict((service, {'state': b.state, 'failures': b.failures}) for service, b in _breakers.items())
@@ -0,0 +1,30 @@
+'''
+    Helpers for tests.
+
+    RedisTestCase runs against TEST_REDIS, a scratch database emptied before
+    and after each test, and is skipped when no Redis server can be reached.
+'''
+
+from django.test import TestCase
+
+import unittest, redis
+
+TEST_REDIS = {'host': '127.0.0.1', 'port': 6379, 'db': 15}
+
+
+def redis_available():
+    try:
+        return redis.StrictRedis(socket_timeout=1, **TEST_REDIS).ping()
+    except redis.RedisError:
+        return False
+
+
+@unittest.skipUnless(redis_available(), 'needs a Redis server')
+class RedisTestCase(TestCase):
+
+    def setUp(self):
+        self.redis = redis.StrictRedis(**TEST_REDIS)
+        self.redis.flushdb()
+
+    def tearDown(self):
+        self.redis.flushdb()
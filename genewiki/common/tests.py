@@ -0,0 +1,55 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from genewiki.common import ratelimit
+from genewiki.common.testing import RedisTestCase, TEST_REDIS
+
+
+@override_settings(RATE_LIMIT_REDIS=TEST_REDIS, RATE_LIMITS={'mygene': (1, 2)})
+class RateLimitTest(RedisTestCase):
+
+    def setUp(self):
+        super(RateLimitTest, self).setUp()
+        ratelimit._state.clear()
+
+    def tearDown(self):
+        ratelimit._state.clear()
+        super(RateLimitTest, self).tearDown()
+
+    def test_bucket_allows_burst_then_waits(self):
+        self.assertEqual(ratelimit.try_acquire('mygene'), 0)
+        self.assertEqual(ratelimit.try_acquire('mygene'), 0)
+        wait = ratelimit.try_acquire('mygene')
+        self.assertGreater(wait, 0.5)
+        self.assertLessEqual(wait, 1.0)
+
+    def test_refused_request_takes_no_tokens(self):
+        ratelimit.try_acquire('mygene', tokens=2)
+        self.assertFalse(ratelimit.acquire('mygene', blocking=False))
+        self.assertFalse(ratelimit.acquire('mygene', blocking=False))
+        tokens = float(self.redis.hget('ratelimit:mygene', 'tokens'))
+        self.assertLess(tokens, 1)
+        self.assertGreaterEqual(tokens, 0)
+
+    def test_acquire_gives_up_after_timeout(self):
+        ratelimit.try_acquire('mygene', tokens=2)
+        self.assertFalse(ratelimit.acquire('mygene', timeout=0.05))
+
+    def test_unlimited_service(self):
+        for _ in range(5):
+            self.assertTrue(ratelimit.acquire('rcsb', blocking=False))
+        self.assertFalse(self.redis.exists('ratelimit:rcsb'))
+
+
+class RateLimitUnavailableTest(TestCase):
+
+    def setUp(self):
+        ratelimit._state.clear()
+
+    def tearDown(self):
+        ratelimit._state.clear()
+
+    @override_settings(RATE_LIMIT_REDIS={'host': '127.0.0.1', 'port': 1, 'db': 0}, RATE_LIMITS={'mygene': (1, 1)})
+    def test_requests_pass_without_redis(self):
+        self.assertTrue(ratelimit.acquire('mygene', blocking=False))
+        self.assertTrue(ratelimit.acquire('mygene', blocking=False))
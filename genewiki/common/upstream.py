@@ -0,0 +1,29 @@
+'''
+    Single entry point for calls to upstream services.
+
+    Every request the bio clients and the wiki code make to mygene.info,
+    UniProt, EBI, RCSB, Wikidata or Wikipedia goes through call(), which makes
+    each attempt through the service's circuit breaker and retries transient
+    failures (see genewiki.common.resilience). Every attempt takes a token from
+    the service's rate limit (see genewiki.common.ratelimit), waits for a slot
+    under the service's adaptive concurrency limit (see
+    genewiki.common.concurrency) and is timed under `name` (see
+    genewiki.common.instrumentation).
+
+    Service names are the keys of RATE_LIMITS: 'mygene', 'uniprot', 'ebi',
+    'rcsb', 'wikidata', 'commons', 'wikipedia' and 'wikipedia_write'.
+'''
+
+from genewiki.common import instrumentation, ratelimit, concurrency, resilience
+
+
+def call(service, name, func, *args, **kwargs):
+    '''
+        Calls func(*args, **kwargs) on behalf of `service`, returning its result.
+        Raises resilience.UpstreamUnavailable if the service is failing.
+    '''
+    def attempt():
+        ratelimit.acquire(service)
+        with concurrency.slot(service) as slot, instrumentation.timer(name):
+            return slot.report(func(*args, **kwargs))
+    return resilience.resilient(service, attempt)
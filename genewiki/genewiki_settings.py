@@ -18,10 +18,260 @@ TEMPLATE_NAME = 'GNF_Protein_box'
 '''
 PYMOL = '/usr/bin/pymol'
 
+'''
+    Structure Rendering:
+    Image size and PyMOL script (under PROJECT_PATH) used to render structures.
+    Rendered PNGs are cached under RENDER_CACHE_PATH, keyed on the PDB id, these
+    settings and the script's contents, so a structure is only rendered again
+    when one of them changes. Renders run as Celery tasks on the 'render' queue
+    (see config/genewiki_render.conf).
+'''
+PYMOL_RENDER = {'width': 1200, 'height': 1000, 'script': 'commands.pml'}
+RENDER_CACHE_PATH = 'renders/'
+# Downloaded structures and rendered images awaiting upload
+PDB_PATH = 'pdb/'
+
+'''
+    Structure Cache:
+    Structures downloaded from RCSB are kept in PDB_PATH, gzipped if
+    PDB_CACHE_COMPRESS, and revalidated with a conditional request once they are
+    PDB_CACHE_REVALIDATE_HOURS old. The least recently used are removed once the
+    cache exceeds PDB_CACHE_MAX_BYTES (see genewiki.bio.images.StructureCache).
+'''
+PDB_CACHE_COMPRESS = True
+PDB_CACHE_REVALIDATE_HOURS = 24 * 7
+PDB_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+'''
+    Commons Image Cache:
+    Whether a structure image exists on Wikimedia Commons is cached in Redis,
+    for COMMONS_HIT_TTL seconds if it does and COMMONS_MISS_TTL seconds if it
+    does not, so later runs only re-check the misses, and those only daily.
+'''
+COMMONS_CACHE_REDIS = {'host': '127.0.0.1', 'port': 6379, 'db': 3}
+COMMONS_HIT_TTL = 30 * 24 * 3600
+COMMONS_MISS_TTL = 24 * 3600
+
+'''
+    Structure Index:
+    Redis database holding the best PDB structure of each UniProt entry, ranked
+    from SIFTS and wwPDB bulk data and rebuilt weekly (see
+    genewiki.bio.structures).
+'''
+STRUCTURE_INDEX_REDIS = {'host': '127.0.0.1', 'port': 6379, 'db': 3}
+
 MOUSE_TAXON_ID = 10090
 
 G2P_DATABASE = 'g2p.db'  # change this if different
 
+'''
+    Gene2PubMed Backend:
+    Where citation lookups are served from: 'redis' (the g2p redis database) or
+    'snapshot', a memory-mapped NumPy snapshot compiled by update_gene2pubmed
+    and reached through the G2P_SNAPSHOT_PATH symlink (see
+    genewiki.bio.g2p_snapshot).
+'''
+G2P_BACKEND = 'redis'
+G2P_SNAPSHOT_PATH = 'g2p/current'
+# The sorted gene/pmid pairs last loaded into redis, diffed against on refresh
+G2P_STATE_PATH = 'g2p/human_pairs.tsv'
+# Pairs sorted in memory at a time when sorting a gene2pubmed file; larger runs
+# are merged from temporary files
+G2P_SORT_CHUNK_SIZE = 1000000
+# Each gene's best citations are precomputed on load: up to G2P_RANKED_SIZE pmids
+# citing fewer than G2P_RANKED_MAX_GENES genes, fewest genes then newest first
+G2P_RANKED_SIZE = 25
+G2P_RANKED_MAX_GENES = 100
+
+'''
+    Refresh Scheduling:
+    Infobox refreshes are dispatched hourly in priority order rather than cycling
+    through every article. An article's priority grows with the hours since it was
+    last refreshed (relative to REFRESH_TARGET_AGE_HOURS), the number of redirects
+    served for its gene through the mapping Lookup table in the last
+    REFRESH_TRAFFIC_WINDOW_DAYS, and how often past refreshes actually changed it.
+    At most REFRESH_BUDGET_PER_HOUR articles are queued each hour, in batches of
+    REFRESH_BATCH_SIZE spread across the hour.
+'''
+REFRESH_BUDGET_PER_HOUR = 250
+REFRESH_BATCH_SIZE = 25
+REFRESH_TARGET_AGE_HOURS = 48
+REFRESH_TRAFFIC_WINDOW_DAYS = 30
+REFRESH_WEIGHT_TRAFFIC = 1.0
+REFRESH_WEIGHT_CHANGE = 2.0
+
+'''
+    Update Pipeline:
+    Number of worker threads for each stage of the infobox update pipeline
+    (genewiki.wiki.pipeline), and the maximum number of articles waiting between
+    two stages. Fetching and image lookups are bound by upstream latency, the
+    other stages are not;
+    how many fetches actually reach each upstream at once is decided by
+    ADAPTIVE_CONCURRENCY below.
+'''
+PIPELINE_CONCURRENCY = {
+    'fetch': 16,
+    'parse': 1,
+    'merge': 1,
+    'image': 4,
+    'diff': 1,
+    'write': 1,
+}
+PIPELINE_QUEUE_SIZE = 20
+# Articles fetched per query when streaming through all of them (see
+# ArticleManager.stream)
+ARTICLE_CHUNK_SIZE = 500
+
+'''
+    Upstream Fixtures:
+    Set UPSTREAM_FIXTURE_MODE to 'record' to save every upstream HTTP response
+    (mygene.info, UniProt, EBI, Wikidata, Wikipedia) under UPSTREAM_FIXTURE_PATH,
+    or to 'replay' to serve them from there without network access
+    (see genewiki.common.fixtures). Leave as None in production.
+    Parameters listed in UPSTREAM_FIXTURE_IGNORE_PARAMS vary between sessions or
+    are secret; they are left out of fixture keys and never written to disk.
+'''
+UPSTREAM_FIXTURE_MODE = None
+UPSTREAM_FIXTURE_PATH = 'fixtures/upstream/'
+UPSTREAM_FIXTURE_IGNORE_PARAMS = ('lgpassword', 'lgtoken', 'token', 'starttimestamp', 'basetimestamp', 'assert')
+
+'''
+    Instrumentation:
+    When enabled, every refresh run records per-stage and per-upstream-call timings
+    (genewiki.common.instrumentation) and saves them as RunMetrics, viewable in the
+    admin and as JSON under /wiki/metrics/.
+'''
+INSTRUMENTATION_ENABLED = True
+
+'''
+    Update Ledger:
+    Each refresh run is recorded as an UpdateRun with one ArticleResult per
+    article, inserted LEDGER_BATCH_SIZE rows at a time or every
+    LEDGER_FLUSH_SECONDS, whichever comes first.
+'''
+LEDGER_BATCH_SIZE = 100
+LEDGER_FLUSH_SECONDS = 30
+
+'''
+    Write Outbox:
+    Articles saved with force_update are written to Wikipedia by the
+    drain_outbox task, up to OUTBOX_BATCH_SIZE per run. Transient failures are
+    retried up to `attempts` times, `base_delay` seconds later doubling each
+    time up to `max_delay`. Entries still being sent after
+    OUTBOX_CLAIM_TIMEOUT seconds are assumed lost and queued again (see
+    genewiki.wiki.outbox).
+'''
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_RETRY = {'attempts': 8, 'base_delay': 60, 'max_delay': 6 * 3600}
+OUTBOX_CLAIM_TIMEOUT = 600
+
+'''
+    Rate Limits:
+    Requests per second and burst size allowed to each upstream service, shared by
+    all workers through token buckets kept in the Redis database RATE_LIMIT_REDIS
+    (see genewiki.common.ratelimit). Services missing here are not limited.
+    Page saves are paced by WIKI_WRITES below instead.
+'''
+RATE_LIMIT_REDIS = {'host': '127.0.0.1', 'port': 6379, 'db': 2}
+RATE_LIMITS = {
+    'mygene': (10, 20),
+    'uniprot': (5, 10),
+    'ebi': (2, 5),
+    'rcsb': (5, 10),
+    'wikidata': (2, 5),
+    'commons': (10, 20),
+    'wikipedia': (10, 20),
+}
+
+'''
+    Wiki Writes:
+    Edits to Wikipedia are made at most `edits_per_minute` (keep it within the
+    bot's approved edit rate) and send `maxlag` seconds. When MediaWiki reports
+    lag or rate limiting, all writers pause for `pause` seconds and the rate is
+    multiplied by `decrease`, down to `minimum`; each successful edit raises it
+    by `increase` again. The achieved rate is measured over the last `window`
+    seconds (see genewiki.wiki.writes, and /wiki/writes/ for the status).
+'''
+WIKI_WRITES = {
+    'edits_per_minute': 12,
+    'minimum': 1,
+    'increase': 0.5,
+    'decrease': 0.5,
+    'maxlag': 5,
+    'pause': 60,
+    'window': 600,
+}
+
+'''
+    Adaptive Concurrency:
+    Bounds on the number of calls in flight to each upstream service from one
+    process. Within [minimum, maximum] the limit grows while calls complete within
+    target_latency seconds and is multiplied by `decrease` on slow calls, timeouts,
+    HTTP 429/503 or MediaWiki maxlag errors (see genewiki.common.concurrency).
+'''
+ADAPTIVE_CONCURRENCY = {
+    'mygene': {'initial': 4, 'minimum': 1, 'maximum': 16, 'target_latency': 2.0},
+    'uniprot': {'initial': 2, 'minimum': 1, 'maximum': 8, 'target_latency': 3.0},
+    'ebi': {'initial': 1, 'minimum': 1, 'maximum': 4, 'target_latency': 5.0},
+    'wikidata': {'initial': 2, 'minimum': 1, 'maximum': 4, 'target_latency': 5.0},
+    'wikipedia': {'initial': 4, 'minimum': 1, 'maximum': 8, 'target_latency': 2.0},
+    'wikipedia_write': {'initial': 1, 'minimum': 1, 'maximum': 2, 'target_latency': 5.0},
+}
+
+'''
+    Timeouts and Retries:
+    Seconds before a request to each upstream service times out. Connection
+    errors, timeouts, HTTP 429/5xx and MediaWiki maxlag errors are retried up to
+    `attempts` times in all with jittered exponential backoff, while retries stay
+    within `budget_ratio` of calls made. After `failure_threshold` consecutive
+    failures a service's circuit opens and calls fail fast for `reset_timeout`
+    seconds (see genewiki.common.resilience).
+'''
+UPSTREAM_TIMEOUTS = {
+    'mygene': 10,
+    'uniprot': 15,
+    'ebi': 10,
+    'rcsb': 60,
+    'wikidata': 30,
+    'commons': 15,
+    'wikipedia': 30,
+    'wikipedia_write': 60,
+    'ncbi': 120,
+}
+UPSTREAM_RETRY = {'attempts': 3, 'base_delay': 0.5, 'max_delay': 10, 'budget_ratio': 0.2}
+CIRCUIT_BREAKER = {'failure_threshold': 5, 'reset_timeout': 60}
+
+'''
+    HTTP Pools:
+    Keep-alive connections kept per host by each service's shared requests
+    session (see genewiki.common.http). Size them to the service's
+    ADAPTIVE_CONCURRENCY maximum; requests beyond the pool wait for a connection.
+'''
+HTTP_POOL_SIZE = 10
+HTTP_POOL_SIZES = {
+    'mygene': 16,
+    'uniprot': 8,
+    'wikipedia': 8,
+}
+
+'''
+    Batched Resolution:
+    Genes per mygene.info request and per UniProt request when resolving many
+    genes at once, and the threads running those requests in parallel (see
+    genewiki.bio.resolver).
+'''
+RESOLVER_BATCH_SIZE = 200
+RESOLVER_UNIPROT_BATCH_SIZE = 100
+RESOLVER_WORKERS = 4
+
+'''
+    Article Creation:
+    Threads running the independent upstream requests of article creation
+    pages, shared by all of the process's requests (see
+    genewiki.wiki.textutils.create). Each page uses up to four at once.
+'''
+CREATE_WORKERS = 8
+
 # An unfortunate collision between the {} system used for Python's str.format()
 # and Mediawiki's template syntax requires all {{templates}} to be escaped like
 # so: {{{{templates}}}} (single {'s => {{).
@@ -1,5 +1,56 @@
 from django.contrib import admin
-from genewiki.wiki.models import Bot, Article
+from django.utils.html import format_html, format_html_join
+from genewiki.wiki.models import Bot, Article, UpstreamFingerprint, RunMetrics, UpdateRun, ArticleResult, OutboxEntry
+
+
+class RunMetricsAdmin(admin.ModelAdmin):
+    list_display = ('name', 'started', 'finished', 'duration')
+    list_filter = ('name',)
+    readonly_fields = ('name', 'started', 'finished', 'timings', 'calls_per_gene')
+    exclude = ('data',)
+
+    def _table(self, rows):
+        header = format_html('<tr><th>{0}</th><th>count</th><th>p50</th><th>p95</th><th>p99</th><th>max</th></tr>', 'name')
+        # format_html_join escapes its arguments to strings first, so the
+        # seconds are formatted here
+        body = format_html_join('', '<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td></tr>',
+                                ((name, s['count']) + tuple('%.3f' % s[key] for key in ('p50', 'p95', 'p99', 'max'))
+                                 for name, s in sorted(rows.items()) if s['count']))
+        return format_html('<table>{0}{1}</table>', header, body)
+
+    def timings(self, obj):
+        return self._table(obj.metrics()['timings'])
+
+    def calls_per_gene(self, obj):
+        return self._table(obj.metrics()['calls_per_gene'])
+
+    def has_add_permission(self, request):
+        return False
+
+
+class UpdateRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'started', 'finished', 'checked', 'changed', 'written', 'failed', 'throughput')
+    list_filter = ('name',)
+
+
+class ArticleResultAdmin(admin.ModelAdmin):
+    list_display = ('title', 'run', 'outcome', 'detail', 'duration', 'error_class')
+    list_filter = ('outcome', 'error_class')
+    search_fields = ('title',)
+    raw_id_fields = ('run', 'article')
+
+
+class OutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('title', 'status', 'attempts', 'next_attempt', 'created', 'finished', 'error')
+    list_filter = ('status',)
+    search_fields = ('title',)
+    raw_id_fields = ('article',)
+
 
 admin.site.register(Bot)
 admin.site.register(Article)
+admin.site.register(UpstreamFingerprint)
+admin.site.register(RunMetrics, RunMetricsAdmin)
+admin.site.register(UpdateRun, UpdateRunAdmin)
+admin.site.register(ArticleResult, ArticleResultAdmin)
+admin.site.register(OutboxEntry, OutboxEntryAdmin)
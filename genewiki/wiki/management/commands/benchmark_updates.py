@@ -0,0 +1,250 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import reset_queries
+
+from genewiki.wiki.models import Article
+from genewiki.wiki.textutils import generate_protein_box_for_existing_article
+from genewiki.bio import mygeneinfo
+from genewiki.bio.g2p import get_pmids
+from genewiki.common.instrumentation import summarize
+
+from contextlib import contextmanager
+from optparse import make_option
+import os, sys, json, time, random, platform, resource, subprocess
+
+STAGES = ('parse', 'build', 'merge', 'render', 'g2p')
+MEMORY_MODES = ('stream', 'queryset')
+
+
+@contextmanager
+def quiet():
+    '''
+        Discards the parser's debugging prints so they neither corrupt the JSON
+        report nor dominate the timings through a terminal.
+    '''
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+@contextmanager
+def stubbed_uniprot(accession=u'Q9QXS1'):
+    '''
+        Building a box looks up the mouse homolog's UniProt entry; for synthetic
+        genes it is answered locally instead of by uniprot.org.
+    '''
+    original = mygeneinfo.uniprot_acc_for_entrez_id
+    mygeneinfo.uniprot_acc_for_entrez_id = lambda entrez: accession
+    try:
+        yield
+    finally:
+        mygeneinfo.uniprot_acc_for_entrez_id = original
+
+
+def synthetic_gene(rng, entrez, revision=0):
+    '''
+        Returns a get_response() style tuple for a made up gene. Later revisions
+        of the same gene differ in a few fields, like a real mygene.info update.
+    '''
+    mouse = entrez + 100000
+    symbol = 'SYN{0}'.format(entrez)
+
+    def go_terms(prefix, count):
+        return [{'id': 'GO:{0:07d}'.format(rng.randint(1, 9999999)),
+                 'term': '{0} term {1}'.format(prefix, i)} for i in range(count)]
+
+    def doc(gene, taxon):
+        return {'name': 'synthetic protein {0} r{1}'.format(gene, revision),
+                'summary': 'A synthetic gene used for benchmarking.',
+                'entrezgene': gene,
+                'uniprot': {'Swiss-Prot': 'P{0:05d}'.format(gene % 100000)},
+                'pdb': ['{0}{1}'.format(rng.randint(1, 9), ''.join(rng.choice('ABCDEFGH') for _ in range(3))) for _ in range(rng.randint(0, 6))],
+                'HGNC': str(gene % 50000),
+                'symbol': symbol,
+                'alias': ['{0}A{1}'.format(symbol, i) for i in range(rng.randint(0, 4))],
+                'MIM': '{0:06d}'.format(100000 + gene % 900000),
+                'ec': ['3.4.21.{0}'.format(rng.randint(1, 99))],
+                'homologene': {'id': gene % 70000, 'genes': [[9606, entrez], [10090, mouse]]},
+                'ensembl': {'gene': 'ENS{0}G{1:011d}'.format('' if taxon == 9606 else 'MUS', gene)},
+                'refseq': {'protein': ['NP_{0:06d}.{1}'.format(gene, revision + 1)], 'rna': ['NM_{0:06d}.{1}'.format(gene, revision + 1)]},
+                'genomic_pos': {'chr': str(rng.randint(1, 22)), 'start': rng.randint(1, 10 ** 8), 'end': rng.randint(10 ** 8, 2 * 10 ** 8)},
+                'go': {'CC': go_terms('component', rng.randint(1, 6)),
+                       'MF': go_terms('function', rng.randint(1, 10)),
+                       'BP': go_terms('process', rng.randint(1, 20))}}
+
+    meta = {'genome_assembly': {'human': 'hg38', 'mouse': 'mm10'}}
+    root = doc(entrez, 9606)
+    return root, meta, doc(mouse, 10090), entrez, root['uniprot']['Swiss-Prot']
+
+
+def synthetic_corpus(size, seed):
+    '''
+        Returns a list of (entrez, page text, upstream response) for `size` made
+        up genes, where the page holds an older revision of the gene's infobox.
+    '''
+    rng = random.Random(seed)
+    corpus = []
+    with stubbed_uniprot():
+        for i in range(size):
+            entrez = 1000 + i
+            old = mygeneinfo.generate_protein_box_for_entrez(entrez, synthetic_gene(random.Random(seed + i), entrez, 0))
+            text = u'{{{{Template doc}}}}\n{0}\n<noinclude>[[Category:Gene templates]]</noinclude>'.format(old.wikitext())
+            corpus.append((entrez, text, synthetic_gene(rng, entrez, 1)))
+    return corpus
+
+
+def recorded_corpus(size):
+    '''
+        Returns a list of (entrez, page text, upstream response) from stored
+        infobox articles. Upstream documents are fetched with get_response(), so
+        this should be run with UPSTREAM_FIXTURE_MODE = 'replay' to be repeatable.
+    '''
+    corpus = []
+    for article in Article.objects.stream_infoboxes(with_text=True):
+        if len(corpus) == size:
+            break
+        entrez = article.get_entrez()
+        corpus.append((entrez, article.text, mygeneinfo.get_response(entrez)))
+    return corpus
+
+
+def rss_bytes():
+    '''
+        Returns this process's resident set size, from /proc where available,
+        otherwise its peak as reported by getrusage.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_profile(mode, every):
+    '''
+        Iterates over every stored infobox the way a full refresh does, either
+        streamed in chunks without the text ('stream') or through a plain
+        queryset ('queryset'), sampling the RSS every `every` articles.
+    '''
+    if mode == 'stream':
+        articles = Article.objects.stream_infoboxes()
+    else:
+        articles = Article.objects.all_infoboxes()
+    start = rss_bytes()
+    samples = []
+    count = 0
+    for article in articles:
+        article.get_entrez()
+        count += 1
+        if count % every == 0:
+            # with DEBUG on, every query would otherwise be kept
+            reset_queries()
+            samples.append((count, rss_bytes()))
+    samples.append((count, rss_bytes()))
+    return {'mode': mode,
+            'articles': count,
+            'rss_start': start,
+            'rss_peak': max(rss for _, rss in samples),
+            'rss_end': samples[-1][1],
+            'samples': samples}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks parsing, building, merging and rendering ProteinBoxes and gene2pubmed lookups; prints JSON results.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--corpus', dest='corpus', default='synthetic',
+                    help='"synthetic" (default) or "recorded" (stored infoboxes and upstream fixtures).'),
+        make_option('--size', dest='size', type='int', default=200,
+                    help='Number of genes in the corpus.'),
+        make_option('--repeat', dest='repeat', type='int', default=3,
+                    help='Number of passes over the corpus.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='Random seed for the synthetic corpus.'),
+        make_option('--stages', dest='stages', default=','.join(STAGES),
+                    help='Comma separated stages to measure.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the JSON results to this file instead of stdout.'),
+        make_option('--memory', dest='memory', default=None, metavar='MODE',
+                    help='Instead of timing stages, measure RSS while iterating over every stored infobox, '
+                         '"stream" or "queryset". Run each mode in its own process.'),
+        make_option('--sample-every', dest='sample_every', type='int', default=1000,
+                    help='Articles between RSS samples in --memory mode.'),
+    )
+
+    def write(self, results, options):
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def handle(self, *args, **options):
+        if options['memory']:
+            if options['memory'] not in MEMORY_MODES:
+                raise CommandError('Memory mode must be "stream" or "queryset".')
+            results = {'revision': git_revision(),
+                       'python': platform.python_version(),
+                       'chunk_size': settings.ARTICLE_CHUNK_SIZE,
+                       'memory': memory_profile(options['memory'], options['sample_every'])}
+            return self.write(results, options)
+
+        stages = [s for s in options['stages'].split(',') if s]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError('Unknown stages: {0}'.format(', '.join(sorted(unknown))))
+
+        if options['corpus'] not in ('synthetic', 'recorded'):
+            raise CommandError('Corpus must be "synthetic" or "recorded".')
+        with quiet():
+            if options['corpus'] == 'synthetic':
+                corpus = synthetic_corpus(options['size'], options['seed'])
+            else:
+                corpus = recorded_corpus(options['size'])
+
+        timings = dict((stage, []) for stage in stages)
+        notes = {}
+        g2p = 'g2p' in stages
+
+        def timed(stage, func, *args):
+            start = time.time()
+            result = func(*args)
+            if stage in timings:
+                timings[stage].append(time.time() - start)
+            return result
+
+        with quiet(), stubbed_uniprot():
+            for _ in range(options['repeat']):
+                for entrez, text, response in corpus:
+                    current = timed('parse', generate_protein_box_for_existing_article, text)
+                    built = timed('build', mygeneinfo.generate_protein_box_for_entrez, entrez, response)
+                    merged = timed('merge', current.updateWith, built)[0]
+                    timed('render', merged.wikitext)
+                    if g2p:
+                        try:
+                            timed('g2p', get_pmids, entrez, 100)
+                        except Exception as e:
+                            notes['g2p'] = 'skipped: {0}'.format(e)
+                            g2p = False
+
+        results = {'revision': git_revision(),
+                   'python': platform.python_version(),
+                   'g2p_backend': settings.G2P_BACKEND,
+                   'corpus': options['corpus'],
+                   'size': len(corpus),
+                   'repeat': options['repeat'],
+                   'stages': dict((stage, summarize(t)) for stage, t in timings.items() if t),
+                   'notes': notes}
+        self.write(results, options)
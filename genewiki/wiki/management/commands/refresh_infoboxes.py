@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from genewiki.wiki.models import Article
+from genewiki.wiki.pipeline import refresh, DryRunSink
+
+from optparse import make_option
+from itertools import islice
+import json
+
+
+class Command(BaseCommand):
+    help = 'Refreshes infoboxes through the update pipeline, optionally writing to a directory instead of Wikipedia.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', dest='dry_run', default=None, metavar='DIR',
+                    help='Write rendered infoboxes to DIR instead of Wikipedia.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+                    help='Only refresh the first LIMIT infoboxes.'),
+        make_option('--force', dest='force', action='store_true', default=False,
+                    help='Rebuild infoboxes even if their upstream data is unchanged.'),
+    ) + tuple(
+        make_option('--{0}-workers'.format(stage), dest='{0}_workers'.format(stage), type='int', default=None,
+                    help='Worker threads for the {0} stage.'.format(stage))
+        for stage in sorted(settings.PIPELINE_CONCURRENCY)
+    )
+
+    def handle(self, *args, **options):
+        articles = Article.objects.stream_infoboxes()
+        if options['limit']:
+            articles = islice(articles, options['limit'])
+
+        concurrency = {}
+        for stage in settings.PIPELINE_CONCURRENCY:
+            if options['{0}_workers'.format(stage)]:
+                concurrency[stage] = options['{0}_workers'.format(stage)]
+
+        sink = DryRunSink(options['dry_run']) if options['dry_run'] else None
+        report = refresh(articles, sink=sink, force=options['force'], concurrency=concurrency,
+                         name='refresh_infoboxes', ledger=sink is None)
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -1,4 +1,10 @@
-from django.db import models
+from django.db import models, connection, transaction
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from datetime import timedelta
+import json
 
 
 class BotManager(models.Manager):
@@ -19,6 +25,50 @@ class ArticleManager(models.Manager):
     def all_infoboxes(self):
         return self.filter(article_type=self.model.INFOBOX).all()
 
+    def stream(self, queryset=None, chunk_size=None, with_text=False):
+        '''
+          Yields the articles of `queryset` (default: all) in primary key order,
+          fetching ARTICLE_CHUNK_SIZE rows per query after the last key seen,
+          so only one chunk is held in memory however many rows there are.
+          Unless `with_text` is set the text column is deferred; it is loaded
+          per article if accessed.
+        '''
+        queryset = self.all() if queryset is None else queryset
+        chunk_size = chunk_size or settings.ARTICLE_CHUNK_SIZE
+        if not with_text:
+            queryset = queryset.defer('text')
+        queryset = queryset.order_by('pk')
+        last = None
+        while True:
+            chunk = queryset if last is None else queryset.filter(pk__gt=last)
+            chunk = list(chunk[:chunk_size])
+            for article in chunk:
+                yield article
+            if len(chunk) < chunk_size:
+                break
+            last = chunk[-1].pk
+
+    def in_order(self, pks, with_text=False):
+        '''
+          Returns the articles with the given primary keys, in the order given,
+          fetched in one query. Unless `with_text` is set the text is deferred.
+        '''
+        queryset = self.filter(pk__in=pks)
+        if not with_text:
+            queryset = queryset.defer('text')
+        articles = dict((article.pk, article) for article in queryset)
+        return [articles[pk] for pk in pks if pk in articles]
+
+    def stream_infoboxes(self, chunk_size=None, with_text=False):
+        return self.stream(self.all_infoboxes(), chunk_size, with_text)
+
+    def listing(self):
+        '''
+          Infoboxes with only the columns needed to list them, most recently
+          changed first.
+        '''
+        return self.all_infoboxes().only('title', 'content_changed').order_by('-content_changed')
+
     def get_infobox_for_entrez(self, entrez):
         title = 'Template:PBB/{0}'.format(entrez)
         return self.filter(title=title).first()
@@ -26,3 +76,157 @@ class ArticleManager(models.Manager):
     def get_talk_for_entrez(self, entrez):
         pass
 
+    def publish(self, title, text, article_type):
+        '''
+          Stores the text of an article, creating it if needed, and queues the
+          text for writing to Wikipedia.
+        '''
+        article, created = self.get_or_create(title=title, defaults={'text': text, 'article_type': article_type, 'force_update': True})
+        if not created:
+            article.text = text
+            article.article_type = article_type
+            article.force_update = True
+            article.save()
+        return article
+
+    def upsert(self, pages, article_type, batch_size=500):
+        '''
+          Stores the text of many articles, given as (title, text) pairs, in a
+          few queries per `batch_size` pages: the existing rows are fetched in
+          one query, missing titles are inserted with bulk_create and existing
+          ones updated in one statement, only where the text differs. The
+          others only have last_fetched set. Nothing is written to Wikipedia.
+
+          Returns the lists of created and updated titles.
+        '''
+        created, updated = [], []
+        pages = dict(pages).items()
+        for i in range(0, len(pages), batch_size):
+            batch = dict(pages[i:i + batch_size])
+            existing = dict((title, (pk, text)) for pk, title, text in self.filter(title__in=batch.keys()).values_list('pk', 'title', 'text'))
+            new = [title for title in batch if title not in existing]
+            changed = dict((existing[title][0], batch[title]) for title in batch if title in existing and existing[title][1] != batch[title])
+            unchanged = [pk for pk, text in existing.values() if pk not in changed]
+
+            now = timezone.now()
+            with transaction.atomic():
+                self.bulk_create([self.model(title=title, text=batch[title], article_type=article_type,
+                                             last_fetched=now, content_changed=now) for title in new])
+                if changed:
+                    self._update_text(changed, now)
+                if unchanged:
+                    self.filter(pk__in=unchanged).update(last_fetched=now)
+            created.extend(new)
+            updated.extend(title for title in batch if title in existing and existing[title][0] in changed)
+        return created, updated
+
+    def _update_text(self, texts, now):
+        '''
+          Sets the text of many articles, given as a dict of pk => text, in one
+          UPDATE (this version of Django has no bulk_update).
+        '''
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        pks = texts.keys()
+        cases = ' '.join(['WHEN %s THEN %s'] * len(pks))
+        params = [value for pk in pks for value in (pk, texts[pk])]
+        params += [now] * 3 + pks
+        stamps = ', '.join('{0} = %s'.format(qn(name)) for name in ('updated', 'last_fetched', 'content_changed'))
+        sql = 'UPDATE {0} SET {1} = CASE {2} {3} END, {4} WHERE {2} IN ({5})'.format(
+            table, qn('text'), qn('id'), cases, stamps, ', '.join(['%s'] * len(pks)))
+        connection.cursor().execute(sql, params)
+
+
+class UpstreamFingerprintManager(models.Manager):
+
+    def get_for_entrez(self, entrez):
+        return self.filter(entrez_id=entrez).first()
+
+    def record(self, entrez, digest, build_date):
+        '''
+          Stores the digest of the upstream data for a gene, noting when it last
+          changed. Returns True if the digest differs from the stored one.
+        '''
+        now = timezone.now()
+        fingerprint, created = self.get_or_create(entrez_id=entrez, defaults={'digest': digest, 'build_date': build_date or '', 'changed': now})
+        changed = created or fingerprint.digest != digest
+        if changed:
+            fingerprint.changed = now
+        fingerprint.digest = digest
+        fingerprint.build_date = build_date or ''
+        fingerprint.save()
+        return changed
+
+
+class RunMetricsManager(models.Manager):
+
+    def record(self, snapshot):
+        '''
+          Saves a snapshot returned by genewiki.common.instrumentation.finish_run().
+        '''
+        return self.create(name=snapshot['name'],
+                           started=parse_datetime(snapshot['started']),
+                           finished=parse_datetime(snapshot['finished']),
+                           data=json.dumps(snapshot))
+
+
+class OutboxEntryManager(models.Manager):
+
+    def enqueue(self, article, summary=''):
+        return self.create(article=article, title=article.title, text=article.text, summary=summary)
+
+    def due(self, limit):
+        '''
+          Pending entries whose next attempt is due, oldest first.
+        '''
+        return self.filter(status=self.model.PENDING, next_attempt__lte=timezone.now()).order_by('id')[:limit]
+
+    def claim(self, entry):
+        '''
+          Marks a pending entry as being sent. Returns False if another worker
+          claimed it first.
+        '''
+        entry.status = self.model.SENDING
+        entry.claimed = timezone.now()
+        return self.filter(pk=entry.pk, status=self.model.PENDING).update(status=entry.status, claimed=entry.claimed) == 1
+
+    def release_stale(self, seconds):
+        '''
+          Returns entries claimed more than `seconds` ago, by a worker that
+          must have died while sending them, to the queue.
+        '''
+        cutoff = timezone.now() - timedelta(seconds=seconds)
+        return self.filter(status=self.model.SENDING, claimed__lt=cutoff).update(status=self.model.PENDING)
+
+    def depth(self):
+        '''
+          Returns the number of entries waiting to be sent, of those due now
+          and of those being sent.
+        '''
+        pending = self.filter(status=self.model.PENDING)
+        return {
+            'pending': pending.count(),
+            'due': pending.filter(next_attempt__lte=timezone.now()).count(),
+            'sending': self.filter(status=self.model.SENDING).count(),
+        }
+
+    def superseded(self, entry):
+        '''
+          Returns True if a later write of the same title is queued, being sent
+          or already written, so `entry` need not be sent.
+        '''
+        live = (self.model.PENDING, self.model.SENDING, self.model.WRITTEN)
+        return self.filter(title=entry.title, pk__gt=entry.pk, status__in=live).exists()
+
+    def requeue_superseded(self, entry):
+        '''
+          Returns the latest entry superseded by `entry`, which failed, to the
+          queue so that the write is not lost. Returns the entry, or None.
+        '''
+        superseded = self.filter(title=entry.title, pk__lt=entry.pk, status=self.model.SUPERSEDED).order_by('-pk').first()
+        if superseded:
+            superseded.status = self.model.PENDING
+            superseded.finished = None
+            superseded.next_attempt = timezone.now()
+            superseded.save()
+        return superseded
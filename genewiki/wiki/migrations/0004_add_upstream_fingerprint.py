@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'UpstreamFingerprint'
+        db.create_table(u'wiki_upstreamfingerprint', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('entrez_id', self.gf('django.db.models.fields.IntegerField')(unique=True)),
+            ('digest', self.gf('django.db.models.fields.CharField')(max_length=40)),
+            ('build_date', self.gf('django.db.models.fields.CharField')(max_length=50, blank=True)),
+            ('checked', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+            ('changed', self.gf('django.db.models.fields.DateTimeField')()),
+        ))
+        db.send_create_signal(u'wiki', ['UpstreamFingerprint'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'UpstreamFingerprint'
+        db.delete_table(u'wiki_upstreamfingerprint')
+
+
+    models = {
+        u'wiki.article': {
+            'Meta': {'ordering': "('-updated',)", 'object_name': 'Article'},
+            'article_type': ('django.db.models.fields.IntegerField', [], {'default': '0', 'max_length': '1', 'blank': 'True'}),
+            'change_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'force_update': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'refresh_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'refreshed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        u'wiki.bot': {
+            'Meta': {'object_name': 'Bot'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'service_type': ('django.db.models.fields.CharField', [], {'default': "'wiki'", 'max_length': '10', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.upstreamfingerprint': {
+            'Meta': {'object_name': 'UpstreamFingerprint'},
+            'build_date': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'changed': ('django.db.models.fields.DateTimeField', [], {}),
+            'checked': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'digest': ('django.db.models.fields.CharField', [], {'max_length': '40'}),
+            'entrez_id': ('django.db.models.fields.IntegerField', [], {'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        }
+    }
+
+    complete_apps = ['wiki']
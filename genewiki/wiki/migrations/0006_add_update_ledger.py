@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'UpdateRun'
+        db.create_table(u'wiki_updaterun', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('started', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('finished', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('checked', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('changed', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('written', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('failed', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('metrics', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['wiki.RunMetrics'], null=True, on_delete=models.SET_NULL, blank=True)),
+        ))
+        db.send_create_signal(u'wiki', ['UpdateRun'])
+
+        # Adding model 'ArticleResult'
+        db.create_table(u'wiki_articleresult', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('run', self.gf('django.db.models.fields.related.ForeignKey')(related_name='results', to=orm['wiki.UpdateRun'])),
+            ('article', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['wiki.Article'], null=True, on_delete=models.SET_NULL)),
+            ('title', self.gf('django.db.models.fields.CharField')(max_length=200)),
+            ('outcome', self.gf('django.db.models.fields.CharField')(max_length=10)),
+            ('detail', self.gf('django.db.models.fields.CharField')(max_length=200, blank=True)),
+            ('changed_fields', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('duration', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('error_class', self.gf('django.db.models.fields.CharField')(max_length=100, blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+        ))
+        db.send_create_signal(u'wiki', ['ArticleResult'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'ArticleResult'
+        db.delete_table(u'wiki_articleresult')
+
+        # Deleting model 'UpdateRun'
+        db.delete_table(u'wiki_updaterun')
+
+
+    models = {
+        u'wiki.article': {
+            'Meta': {'ordering': "('-updated',)", 'object_name': 'Article'},
+            'article_type': ('django.db.models.fields.IntegerField', [], {'default': '0', 'max_length': '1', 'blank': 'True'}),
+            'change_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'force_update': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'refresh_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'refreshed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        u'wiki.articleresult': {
+            'Meta': {'object_name': 'ArticleResult'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.Article']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'changed_fields': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'detail': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'error_class': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'outcome': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'run': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'results'", 'to': u"orm['wiki.UpdateRun']"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.bot': {
+            'Meta': {'object_name': 'Bot'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'service_type': ('django.db.models.fields.CharField', [], {'default': "'wiki'", 'max_length': '10', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.runmetrics': {
+            'Meta': {'ordering': "('-started',)", 'object_name': 'RunMetrics'},
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'wiki.updaterun': {
+            'Meta': {'ordering': "('-started',)", 'object_name': 'UpdateRun'},
+            'changed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'checked': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'failed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'metrics': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.RunMetrics']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'written': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'wiki.upstreamfingerprint': {
+            'Meta': {'object_name': 'UpstreamFingerprint'},
+            'build_date': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'changed': ('django.db.models.fields.DateTimeField', [], {}),
+            'checked': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'digest': ('django.db.models.fields.CharField', [], {'max_length': '40'}),
+            'entrez_id': ('django.db.models.fields.IntegerField', [], {'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        }
+    }
+
+    complete_apps = ['wiki']
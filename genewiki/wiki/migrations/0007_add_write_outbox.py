@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'OutboxEntry'
+        db.create_table(u'wiki_outboxentry', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('article', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['wiki.Article'], null=True, on_delete=models.SET_NULL)),
+            ('title', self.gf('django.db.models.fields.CharField')(max_length=200, db_index=True)),
+            ('text', self.gf('django.db.models.fields.TextField')()),
+            ('summary', self.gf('django.db.models.fields.CharField')(max_length=200, blank=True)),
+            ('status', self.gf('django.db.models.fields.CharField')(default='pending', max_length=10, db_index=True)),
+            ('attempts', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('next_attempt', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('claimed', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('error', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('finished', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+        ))
+        db.send_create_signal(u'wiki', ['OutboxEntry'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'OutboxEntry'
+        db.delete_table(u'wiki_outboxentry')
+
+
+    models = {
+        u'wiki.article': {
+            'Meta': {'ordering': "('-updated',)", 'object_name': 'Article'},
+            'article_type': ('django.db.models.fields.IntegerField', [], {'default': '0', 'max_length': '1', 'blank': 'True'}),
+            'change_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'force_update': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'refresh_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'refreshed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        u'wiki.articleresult': {
+            'Meta': {'object_name': 'ArticleResult'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.Article']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'changed_fields': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'detail': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'error_class': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'outcome': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'run': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'results'", 'to': u"orm['wiki.UpdateRun']"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.bot': {
+            'Meta': {'object_name': 'Bot'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'service_type': ('django.db.models.fields.CharField', [], {'default': "'wiki'", 'max_length': '10', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.outboxentry': {
+            'Meta': {'ordering': "('id',)", 'object_name': 'OutboxEntry'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.Article']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'attempts': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'claimed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'pending'", 'max_length': '10', 'db_index': 'True'}),
+            'summary': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        },
+        u'wiki.runmetrics': {
+            'Meta': {'ordering': "('-started',)", 'object_name': 'RunMetrics'},
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'wiki.updaterun': {
+            'Meta': {'ordering': "('-started',)", 'object_name': 'UpdateRun'},
+            'changed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'checked': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'failed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'metrics': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.RunMetrics']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'written': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'wiki.upstreamfingerprint': {
+            'Meta': {'object_name': 'UpstreamFingerprint'},
+            'build_date': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'changed': ('django.db.models.fields.DateTimeField', [], {}),
+            'checked': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'digest': ('django.db.models.fields.CharField', [], {'max_length': '40'}),
+            'entrez_id': ('django.db.models.fields.IntegerField', [], {'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        }
+    }
+
+    complete_apps = ['wiki']
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from django.db.models import Count
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Merges articles sharing a title into the most recently updated one, so titles can be made unique."
+        duplicates = orm['wiki.Article'].objects.values('title').annotate(n=Count('id')).filter(n__gt=1)
+        for row in duplicates:
+            articles = list(orm['wiki.Article'].objects.filter(title=row['title']).order_by('-updated', '-id'))
+            keep, others = articles[0], [a.pk for a in articles[1:]]
+            orm['wiki.ArticleResult'].objects.filter(article__in=others).update(article=keep)
+            orm['wiki.OutboxEntry'].objects.filter(article__in=others).update(article=keep)
+            orm['wiki.Article'].objects.filter(pk__in=others).delete()
+
+    def backwards(self, orm):
+        "Merged duplicates cannot be restored."
+        pass
+
+    models = {
+        u'wiki.article': {
+            'Meta': {'ordering': "('-updated',)", 'object_name': 'Article'},
+            'article_type': ('django.db.models.fields.IntegerField', [], {'default': '0', 'max_length': '1', 'blank': 'True'}),
+            'change_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'force_update': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'refresh_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'refreshed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        u'wiki.articleresult': {
+            'Meta': {'object_name': 'ArticleResult'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.Article']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'changed_fields': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'detail': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'error_class': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'outcome': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'run': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'results'", 'to': u"orm['wiki.UpdateRun']"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.bot': {
+            'Meta': {'object_name': 'Bot'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'service_type': ('django.db.models.fields.CharField', [], {'default': "'wiki'", 'max_length': '10', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'wiki.outboxentry': {
+            'Meta': {'ordering': "('id',)", 'object_name': 'OutboxEntry'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.Article']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'attempts': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'claimed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'pending'", 'max_length': '10', 'db_index': 'True'}),
+            'summary': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200', 'db_index': 'True'})
+        },
+        u'wiki.runmetrics': {
+            'Meta': {'ordering': "('-started',)", 'object_name': 'RunMetrics'},
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'wiki.updaterun': {
+            'Meta': {'ordering': "('-started',)", 'object_name': 'UpdateRun'},
+            'changed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'checked': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'failed': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'metrics': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['wiki.RunMetrics']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'written': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'wiki.upstreamfingerprint': {
+            'Meta': {'object_name': 'UpstreamFingerprint'},
+            'build_date': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'changed': ('django.db.models.fields.DateTimeField', [], {}),
+            'checked': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'digest': ('django.db.models.fields.CharField', [], {'max_length': '40'}),
+            'entrez_id': ('django.db.models.fields.IntegerField', [], {'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        }
+    }
+
+    complete_apps = ['wiki']
+    symmetrical = True
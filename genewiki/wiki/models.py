@@ -1,14 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.conf import settings
+from django.utils import timezone
 
-from genewiki.wiki.managers import BotManager, ArticleManager
-from genewiki.wiki.textutils import generate_protein_box_for_existing_article
+from genewiki.wiki.managers import BotManager, ArticleManager, UpstreamFingerprintManager, RunMetricsManager, OutboxEntryManager
 from genewiki.bio.mygeneinfo import generate_protein_box_for_entrez
+from genewiki.wiki import writes
+from genewiki.common import upstream, http
 
-
-from raven.contrib.django.raven_compat.models import client
-
-import mwclient, re, logging, PBB_login
+import mwclient, re, json, logging, PBB_login
 from mwclient.errors import *
 logger = logging.getLogger(__name__)
 
@@ -30,10 +30,11 @@ class Bot(models.Model):
     objects = BotManager()
 
     def connection(self):
-        useragent = 'Protein Box Bot, Run by The Scripps Research Institute: nanis@scripps.edu'
-        connection = mwclient.Site(('https', settings.BASE_SITE),clients_useragent=useragent)
+        connection = upstream.call('wikipedia', 'wikipedia.connect', mwclient.Site, ('https', settings.BASE_SITE),
+                                   clients_useragent=http.USER_AGENT, pool=http.new_session('wikipedia'),
+                                   max_lag=settings.WIKI_WRITES['maxlag'], wait_callback=writes.waited)
 
-        connection.login(self.username, self.password)
+        upstream.call('wikipedia', 'wikipedia.login', connection.login, self.username, self.password)
         return connection
 
     def previous_actions(self, limit=500):
@@ -45,22 +46,32 @@ class Bot(models.Model):
         for item in lists:
             print item['title']
 
-    def fetch_update_articles(self):
+    def fetch_update_articles(self, batch_size=500):
+        '''
+          Stores the current text of every PBB template, upserting
+          `batch_size` of them at a time.
+        '''
         connection = self.connection()
         gpb = connection.Pages['Template:GNF_Protein_box']
+        pages = []
         for page in gpb.embeddedin('10'):
             if 'Template:PBB/' in page.name:
-                article, created = Article.objects.get_or_create(title=page.name, article_type=Article.INFOBOX)
-                article.text = page.edit()
-                article.save()
-                if created:
-                    logger.info('Article Added', exc_info=True, extra={'article': article, 'title': page.name})
+                pages.append((page.name, page.edit()))
+            if len(pages) == batch_size:
+                self._store_templates(pages)
+                pages = []
+        self._store_templates(pages)
+
+    def _store_templates(self, pages):
+        created, updated = Article.objects.upsert(pages, Article.INFOBOX)
+        for title in created:
+            logger.info('Article Added', extra={'title': title})
 
     def __unicode__(self):
         return u'{0} ({1})'.format(self.username, self.service_type)
 
 class Article(models.Model):
-    title = models.CharField(max_length=200, blank=False)
+    title = models.CharField(max_length=200, blank=False, unique=True)
     text = models.TextField()
 
     PAGE = 0
@@ -79,14 +90,66 @@ class Article(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     force_update = models.BooleanField(default=False)
 
+    # Bookkeeping for the refresh scheduler (see genewiki.wiki.priority)
+    refreshed = models.DateTimeField(null=True, blank=True)
+    refresh_count = models.IntegerField(default=0)
+    change_count = models.IntegerField(default=0)
+
+    # When the text was last fetched from Wikipedia, last changed, and last
+    # written back to Wikipedia. Unlike `updated` these only move when that
+    # actually happens.
+    last_fetched = models.DateTimeField(null=True, blank=True)
+    content_changed = models.DateTimeField(null=True, blank=True)
+    last_pushed = models.DateTimeField(null=True, blank=True)
+
     objects = ArticleManager()
 
+    def __init__(self, *args, **kwargs):
+        super(Article, self).__init__(*args, **kwargs)
+        self._stored = self._values()
+
     def __unicode__(self):
         return u'{0}'.format(self.title)
 
     class Meta:
         ordering = ('-updated',)
 
+    def _values(self):
+        '''
+          The loaded field values, other than `updated`, to tell whether a save
+          would change anything.
+        '''
+        return dict((f.attname, self.__dict__[f.attname]) for f in self._meta.concrete_fields
+                    if f.attname in self.__dict__ and f.attname != 'updated')
+
+    def save(self, *args, **kwargs):
+        '''
+          Saves the article, unless no field changed since it was loaded or
+          last saved. content_changed is set when the text changes.
+
+          If force_update is set, the text is also queued for writing to
+          Wikipedia in the same transaction and the flag is cleared; the write
+          itself is made by the drain_outbox task (see genewiki.wiki.outbox).
+        '''
+        if self.pk is not None and not self.force_update and self._values() == self._stored:
+            return
+        if self.pk is None or ('text' in self._stored and self.text != self._stored['text']):
+            self.content_changed = timezone.now()
+
+        if not self.force_update:
+            super(Article, self).save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                self.force_update = False
+                super(Article, self).save(*args, **kwargs)
+                OutboxEntry.objects.enqueue(self)
+
+            # Entries committed by an enclosing transaction after this point
+            # are picked up by the periodic drain instead
+            from genewiki.wiki.tasks import drain_outbox
+            drain_outbox.delay()
+        self._stored = self._values()
+
     def url_for_article(self):
         return u'http://{0}/wiki/{1}'.format(settings.BASE_SITE, self.title)
 
@@ -98,14 +161,14 @@ class Article(models.Model):
         else:
             return None
 
-    def get_page(self):
-        bot = Bot.objects.get_pbb()
-        connection = bot.connection()
-        return connection.Pages[self.title]
+    def get_page(self, connection=None):
+        if connection is None:
+            connection = Bot.objects.get_pbb().connection()
+        return upstream.call('wikipedia', 'wikipedia.page_info', connection.Pages.__getitem__, self.title)
 
     def generate_protein_box(self):
         entrez = self.get_entrez()
-        return get_protein_box_for_entrez(entrez)
+        return generate_protein_box_for_entrez(entrez)
 
     def bots_allowed(self):
         '''
@@ -115,53 +178,231 @@ class Article(models.Model):
                               "ProteinBoxBot" + r'.*?|optout=all|deny=all))\}\}',
                               self.text))
 
-    def update(self):
+    def update(self, force=False):
         '''
-          Returns an updated infobox and summary from data gathered from the
-          specified page.
-        '''
-        page = self.get_page()
-        text = page.text()
-        # Dictionary of fields to build a ProteinBox from
-        mgibox = generate_protein_box_for_entrez(self.get_entrez())
-        # Returns processed ProteinBox object
-        current_box = generate_protein_box_for_existing_article(text)
+          Refreshes this infobox from mygene.info through the update pipeline
+          (see genewiki.wiki.pipeline), which fetches the page and upstream data,
+          merges them and writes the result back.
 
-        # Run the comparision between the current box online
-        # and the dictionary just generated from mygene
-        try:
-            updated, summary, updatedfields = current_box.updateWith(mgibox)
-        except Exception:
-            client.captureException()
+          Unless `force` is set, the refresh is skipped when the upstream data is
+          unchanged since the last one. Returns True if the upstream data changed.
+        '''
+        from genewiki.wiki.pipeline import refresh
+        # a single article is not worth an UpdateRun or a RunMetrics row
+        report = refresh([self], force=force, name='article_update', ledger=False, metrics=False)
+        return report['changed'] > 0
 
-        self.write(updated, summary)
-        logger.info('Page Updated', exc_info=True, extra={'updated': updated, 'summary': summary, 'updatedfields': updatedfields})
+    def record_refresh(self, changed):
+        '''
+          Records that this article was checked against upstream data, and whether
+          that check changed any fields. Uses a queryset update so the article's
+          other fields are not saved again.
+        '''
+        fields = {'refreshed': timezone.now(), 'refresh_count': F('refresh_count') + 1}
+        if changed:
+            fields['change_count'] = F('change_count') + 1
+        Article.objects.filter(pk=self.pk).update(**fields)
 
-    def write(self, proteinbox=None, summary=None):
+    def write(self, proteinbox=None, summary=None, page=None):
         '''
           Writes the wikitext representation of the protein box to MediaWiki.
 
-          Returns (result, None) if successful, or (None, Error) if not.
+          Returns mwclient's result. A failed save raises, so callers (the
+          pipeline records the error on its item) never mistake it for a
+          successful one.
 
           Arguments:
           - `proteinbox`: an updated proteinbox to write
+          - `page`: the already loaded mwclient page, if any
         '''
-        page = self.get_page()
+        page = page or self.get_page()
 
         if not self.bots_allowed():
             logger.warn('Bots Blocked', exc_info=True, extra={'page': page, 'bot': self})
 
-        try:
-            if proteinbox:
-                result = page.save(str(proteinbox), summary, minor=True)
-                self.text = page.edit()
-            else:
-                result = page.save(self.text, summary, minor=True)
-                self.force_update = False
+        if proteinbox:
+            result = writes.save(page, str(proteinbox), summary)
+            self.text = upstream.call('wikipedia', 'wikipedia.page_edit', page.edit)
+            # The text may not have been loaded to compare against
+            self.last_fetched = self.content_changed = timezone.now()
+        else:
+            result = writes.save(page, self.text, summary)
+            self.force_update = False
+
+        self.last_pushed = timezone.now()
+        self.save()
+        return result
+
+
+class OutboxEntry(models.Model):
+    '''
+      A write of an article's text to Wikipedia, queued when the article is
+      saved with force_update set and sent by the drain_outbox task, which
+      retries failures and records the outcome here (see genewiki.wiki.outbox).
+    '''
+    PENDING = 'pending'
+    SENDING = 'sending'
+    WRITTEN = 'written'
+    SUPERSEDED = 'superseded'
+    FAILED = 'failed'
+    STATUS_CHOICE = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (WRITTEN, 'Written'),
+        (SUPERSEDED, 'Superseded'),
+        (FAILED, 'Failed'),
+    )
+
+    article = models.ForeignKey(Article, null=True, on_delete=models.SET_NULL)
+    title = models.CharField(max_length=200, db_index=True)
+    text = models.TextField()
+    summary = models.CharField(max_length=200, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICE, default=PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    claimed = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboxEntryManager()
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name_plural = 'outbox entries'
+
+    def __unicode__(self):
+        return u'{0}: {1}'.format(self.title, self.status)
+
 
-            self.save()
+class UpstreamFingerprint(models.Model):
+    '''
+      Digest of the upstream documents (human, mouse homolog and UniProt entry)
+      an infobox was last built from, used to skip genes whose data is unchanged.
+    '''
+    entrez_id = models.IntegerField(unique=True)
+    digest = models.CharField(max_length=40)
+    build_date = models.CharField(max_length=50, blank=True)
 
-        except MwClientError:
-            client.captureException()
+    checked = models.DateTimeField(auto_now=True)
+    changed = models.DateTimeField()
 
+    objects = UpstreamFingerprintManager()
 
+    def __unicode__(self):
+        return u'{0} ({1})'.format(self.entrez_id, self.digest)
+
+
+class RunMetrics(models.Model):
+    '''
+      Timings and upstream call counts aggregated over one refresh run
+      (see genewiki.common.instrumentation).
+    '''
+    name = models.CharField(max_length=100)
+    started = models.DateTimeField()
+    finished = models.DateTimeField()
+    data = models.TextField()
+
+    objects = RunMetricsManager()
+
+    class Meta:
+        ordering = ('-started',)
+        verbose_name_plural = 'run metrics'
+
+    def __unicode__(self):
+        return u'{0} ({1})'.format(self.name, self.started)
+
+    def duration(self):
+        return (self.finished - self.started).total_seconds()
+
+    def metrics(self):
+        return json.loads(self.data)
+
+
+class UpdateRun(models.Model):
+    '''
+      One run of the refresh pipeline, with its totals once it has finished.
+      The outcome of each article is kept in its ArticleResults.
+    '''
+    name = models.CharField(max_length=100)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    checked = models.IntegerField(default=0)
+    changed = models.IntegerField(default=0)
+    written = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+    metrics = models.ForeignKey(RunMetrics, null=True, blank=True, on_delete=models.SET_NULL)
+    # The interrupted run this one resumed, if any
+    resumed_from = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='resumes')
+
+    class Meta:
+        ordering = ('-started',)
+
+    def __unicode__(self):
+        return u'{0} ({1})'.format(self.name, self.started)
+
+    def duration(self):
+        if not self.finished:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+    def throughput(self):
+        '''
+          Articles checked per hour, or None while the run is in progress.
+        '''
+        duration = self.duration()
+        return self.checked * 3600.0 / duration if duration else None
+
+    def failed_articles(self):
+        return Article.objects.filter(pk__in=self.results.filter(outcome=ArticleResult.FAILED).values('article'))
+
+    def chain(self):
+        '''
+          This run and the runs it resumed, back to the original one.
+        '''
+        runs, run = [], self
+        while run is not None and run not in runs:
+            runs.append(run)
+            run = run.resumed_from
+        return runs
+
+    def unprocessed_infoboxes(self):
+        '''
+          Infoboxes that have no result in this run or the runs it resumed,
+          i.e. what is left to do if a full run was interrupted.
+        '''
+        done = ArticleResult.objects.filter(run__in=self.chain()).values('article')
+        return Article.objects.all_infoboxes().exclude(pk__in=done)
+
+
+class ArticleResult(models.Model):
+    '''
+      The outcome of refreshing one article during an UpdateRun.
+    '''
+    WRITTEN = 'written'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    OUTCOME_CHOICE = (
+        (WRITTEN, 'Written'),
+        (SKIPPED, 'Skipped'),
+        (FAILED, 'Failed'),
+    )
+
+    run = models.ForeignKey(UpdateRun, related_name='results')
+    article = models.ForeignKey(Article, null=True, on_delete=models.SET_NULL)
+    title = models.CharField(max_length=200)
+
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICE)
+    detail = models.CharField(max_length=200, blank=True)
+    changed_fields = models.TextField(blank=True)
+    duration = models.FloatField(default=0)
+    error_class = models.CharField(max_length=100, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'{0}: {1}'.format(self.title, self.outcome)
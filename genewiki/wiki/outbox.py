@@ -0,0 +1,109 @@
+'''
+    Durable queue of writes to Wikipedia.
+
+    Saving an Article with force_update set no longer edits Wikipedia from
+    the saving request. The article and an OutboxEntry holding the text to
+    write are committed in one transaction, and the drain_outbox task sends
+    the entries later:
+
+    - Entries are claimed one at a time with a conditional update, so several
+      drains can run at once without sending anything twice. Entries claimed
+      by a worker that died are returned to the queue after
+      OUTBOX_CLAIM_TIMEOUT seconds.
+    - Writes are coalesced per title: an entry with a later write of the same
+      title queued or done is marked superseded instead of being sent. If
+      that later write fails, the latest entry it superseded is queued again.
+    - Transient failures (upstream unavailable, maxlag, timeouts) are retried
+      after an exponentially growing delay, up to OUTBOX_RETRY['attempts']
+      times; anything else fails the entry at once. Either way the last error
+      is kept on the entry.
+'''
+
+from django.conf import settings
+from django.utils import timezone
+
+from genewiki.wiki.models import Bot, Article, OutboxEntry
+from genewiki.wiki import writes
+from genewiki.common import upstream, resilience, instrumentation
+
+from raven.contrib.django.raven_compat.models import client
+
+from datetime import timedelta
+from collections import Counter
+import logging
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    '''
+        Returns the seconds to wait before sending an entry again after its
+        `attempts`-th failed attempt.
+    '''
+    options = settings.OUTBOX_RETRY
+    return min(options['max_delay'], options['base_delay'] * 2 ** (attempts - 1))
+
+
+def send(entry, connection):
+    page = upstream.call('wikipedia', 'wikipedia.page_info', connection.Pages.__getitem__, entry.title)
+    writes.save(page, entry.text, entry.summary or None)
+
+
+def finish(entry, status, error=''):
+    entry.status = status
+    entry.error = error
+    entry.finished = timezone.now()
+    entry.save()
+    instrumentation.count('outbox.' + status)
+
+
+def fail(entry, error):
+    '''
+        Records a failed attempt, scheduling a retry if the error is transient
+        and attempts remain.
+    '''
+    entry.attempts += 1
+    message = u'{0}: {1}'.format(error.__class__.__name__, error)
+    transient = isinstance(error, resilience.UpstreamUnavailable) or resilience.is_transient(error)
+    if transient and entry.attempts < settings.OUTBOX_RETRY['attempts']:
+        entry.status = OutboxEntry.PENDING
+        entry.error = message
+        entry.next_attempt = timezone.now() + timedelta(seconds=retry_delay(entry.attempts))
+        entry.save()
+        instrumentation.count('outbox.retry')
+    else:
+        client.captureException()
+        finish(entry, OutboxEntry.FAILED, message)
+        OutboxEntry.objects.requeue_superseded(entry)
+
+
+def drain(limit=None):
+    '''
+        Sends up to `limit` (default OUTBOX_BATCH_SIZE) due entries, oldest
+        first. Returns the number of entries with each outcome.
+    '''
+    limit = limit or settings.OUTBOX_BATCH_SIZE
+    OutboxEntry.objects.release_stale(settings.OUTBOX_CLAIM_TIMEOUT)
+    outcomes = Counter()
+    connection = None
+
+    for entry in OutboxEntry.objects.due(limit):
+        if not OutboxEntry.objects.claim(entry):
+            continue
+        if OutboxEntry.objects.superseded(entry):
+            finish(entry, OutboxEntry.SUPERSEDED)
+            outcomes[OutboxEntry.SUPERSEDED] += 1
+            continue
+
+        try:
+            connection = connection or Bot.objects.get_pbb().connection()
+            send(entry, connection)
+        except Exception as e:
+            logger.warn(u'Writing {0} failed'.format(entry.title), exc_info=True)
+            fail(entry, e)
+            outcomes[entry.status] += 1
+        else:
+            finish(entry, OutboxEntry.WRITTEN)
+            Article.objects.filter(pk=entry.article_id).update(last_pushed=entry.finished)
+            outcomes[OutboxEntry.WRITTEN] += 1
+
+    return dict(outcomes)
@@ -0,0 +1,537 @@
+'''
+    Staged pipeline for refreshing infoboxes.
+
+    A refresh is broken into explicit stages -- fetch, parse, merge, image, diff
+    and write -- connected by bounded queues. Each stage runs its own pool of worker
+    threads so the slow, network bound stages can be widened independently of
+    the CPU bound ones, and each keeps timing counters so a run can report where
+    its time went. When instrumentation is enabled the run's timers and upstream
+    call counts are also saved as RunMetrics, and unless disabled the outcome of
+    every article is recorded in an UpdateRun ledger.
+
+    Articles enter the pipeline in batches of RESOLVER_BATCH_SIZE, whose
+    upstream documents the fetch stage resolves together (see
+    genewiki.bio.resolver) before its workers take the items one by one.
+
+    Articles flow through the pipeline wrapped in an UpdateItem. A stage that
+    fails or decides no further work is needed marks the item as errored or
+    skipped, and the remaining stages pass it straight through. What the write
+    stage does is decided by the sink: WikiSink saves to Wikipedia and records
+    the refresh, DryRunSink writes the rendered wikitext to a local directory.
+'''
+
+from django.conf import settings
+from django.db import connection as db_connection
+from django.utils import timezone
+
+from genewiki.wiki.models import Bot, UpstreamFingerprint, RunMetrics, UpdateRun, ArticleResult
+from genewiki.wiki.textutils import generate_protein_box_for_existing_article
+from genewiki.bio.mygeneinfo import generate_protein_box_for_entrez, get_response, get_build_date, fingerprint
+from genewiki.bio.resolver import resolve_many
+from genewiki.common import instrumentation, upstream, concurrency as adaptive
+
+from raven.contrib.django.raven_compat.models import client
+
+import os, codecs, threading, time, Queue, logging
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream on a queue
+_DONE = object()
+
+
+def thread_connection(local):
+    '''
+      Returns the calling thread's logged in mwclient Site, kept on the
+      threading.local `local`.
+    '''
+    if not hasattr(local, 'connection'):
+        local.connection = Bot.objects.get_pbb().connection()
+    return local.connection
+
+
+class UpdateItem(object):
+    '''
+      The state of a single article as it moves through the pipeline.
+    '''
+
+    def __init__(self, article):
+        self.article = article
+        self.entrez = article.get_entrez()
+        self.build_date = None
+        self.previous = None
+        self.prefetched = False
+        self.response = None
+        self.digest = None
+        self.page = None
+        self.text = None
+        self.current_box = None
+        self.mgibox = None
+        self.updated = None
+        self.summary = None
+        self.updatedfields = {}
+        self.skipped = None
+        self.error = None
+        self.seconds = 0.0
+
+    @property
+    def done(self):
+        return bool(self.skipped or self.error)
+
+    @property
+    def changed(self):
+        '''
+          True if the upstream data differed from the last refresh.
+        '''
+        return self.digest is not None and self.skipped != 'upstream unchanged'
+
+
+class Stage(object):
+    '''
+      A step of the pipeline. Subclasses implement process(item), which updates
+      the item in place. Calling the stage times process() and records any
+      exception on the item rather than letting it stop the run.
+    '''
+    name = None
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def process(self, item):
+        raise NotImplementedError
+
+    def __call__(self, item):
+        if item.done:
+            return item
+        start = time.time()
+        try:
+            with instrumentation.gene(item.entrez), instrumentation.timer('stage.' + self.name):
+                self.process(item)
+        except Exception as e:
+            item.error = e
+            client.captureException()
+        elapsed = time.time() - start
+        item.seconds += elapsed
+        with self._lock:
+            self.items += 1
+            self.seconds += elapsed
+            if item.error:
+                self.errors += 1
+        return item
+
+    def stats(self):
+        return {'workers': self.workers,
+                'items': self.items,
+                'errors': self.errors,
+                'seconds': self.seconds,
+                'mean': self.seconds / self.items if self.items else 0.0}
+
+
+class FetchStage(Stage):
+    '''
+      Fetches the upstream documents and the current page text. Items whose
+      upstream data has not changed since the last refresh are skipped unless
+      `force` is set (see UpstreamFingerprint).
+    '''
+    name = 'fetch'
+
+    def __init__(self, force=False, workers=1):
+        super(FetchStage, self).__init__(workers)
+        self.force = force
+        self._local = threading.local()
+
+    def connection(self):
+        # mwclient sites are not shared between threads; log in once per worker
+        return thread_connection(self._local)
+
+    def check_build(self, item):
+        '''
+          Loads the item's last fingerprint and skips the item if the upstream
+          data release has not changed since.
+        '''
+        item.build_date = get_build_date()
+        item.previous = UpstreamFingerprint.objects.get_for_entrez(item.entrez)
+        if not self.force and item.previous and item.build_date and item.previous.build_date == item.build_date:
+            item.skipped = 'upstream build unchanged'
+
+    def prefetch(self, items):
+        '''
+          Checks a batch of items and resolves the upstream documents of those
+          still needing them in one go. Items the batch leaves unresolved are
+          fetched one at a time by process().
+        '''
+        with instrumentation.timer('stage.prefetch'):
+            for item in items:
+                self.check_build(item)
+                item.prefetched = True
+            pending = [item for item in items if not item.done and item.entrez is not None]
+            try:
+                responses = resolve_many([item.entrez for item in pending])
+            except Exception:
+                logger.warn('Batch resolution failed; resolving genes one at a time', exc_info=True)
+                return
+            for item in pending:
+                response = responses.get(item.entrez)
+                if isinstance(response, Exception):
+                    item.error = response
+                else:
+                    item.response = response
+
+    def process(self, item):
+        if not item.prefetched:
+            self.check_build(item)
+            if item.skipped:
+                return
+
+        item.response = item.response or get_response(item.entrez)
+        item.digest = fingerprint(item.response)
+        if not self.force and item.previous and item.previous.digest == item.digest:
+            item.skipped = 'upstream unchanged'
+            return
+
+        item.page = item.article.get_page(self.connection())
+        item.text = upstream.call('wikipedia', 'wikipedia.page_text', item.page.text)
+
+
+class ParseStage(Stage):
+    '''
+      Builds a ProteinBox from the upstream documents and parses the one
+      currently on the page.
+    '''
+    name = 'parse'
+
+    def process(self, item):
+        item.mgibox = generate_protein_box_for_entrez(item.entrez, item.response)
+        item.current_box = generate_protein_box_for_existing_article(item.text)
+
+
+class MergeStage(Stage):
+    '''
+      Merges the upstream ProteinBox into the current one.
+    '''
+    name = 'merge'
+
+    def process(self, item):
+        item.updated, item.summary, item.updatedfields = item.current_box.updateWith(item.mgibox)
+
+
+class ImageStage(Stage):
+    '''
+      Links a structure image into merged infoboxes that list PDB structures
+      but have no image: an existing one on Commons, or a rendering from the
+      render cache, which is uploaded when `upload` is set. Nothing is rendered
+      here; render_missing_images fills the cache. Failing to find an image
+      does not fail the article.
+    '''
+    name = 'image'
+
+    def __init__(self, upload=True, workers=1):
+        super(ImageStage, self).__init__(workers)
+        self.upload = upload
+
+    def process(self, item):
+        try:
+            linked = item.updated.linkImage(render=False, upload=self.upload)
+        except Exception:
+            logger.warn('Linking an image for {0} failed'.format(item.entrez), exc_info=True)
+            return
+        if linked:
+            item.updatedfields['image'] = (item.current_box.fieldsdict['image'], item.updated.fieldsdict['image'])
+            item.summary = 'Updated {0} fields: {1}'.format(len(item.updatedfields), ', '.join(item.updatedfields))
+
+
+class DiffStage(Stage):
+    '''
+      Skips the write when the merged infobox renders to the text already on
+      the page.
+    '''
+    name = 'diff'
+
+    def process(self, item):
+        if item.updated.wikitext().strip() == item.text.strip():
+            item.skipped = 'no difference'
+
+
+class WriteStage(Stage):
+    '''
+      Hands merged infoboxes to the sink.
+    '''
+    name = 'write'
+
+    def __init__(self, sink, workers=1):
+        super(WriteStage, self).__init__(workers)
+        self.sink = sink
+
+    def process(self, item):
+        self.sink.write(item)
+
+
+class WikiSink(object):
+    '''
+      Writes updated infoboxes to Wikipedia and records each refresh. The page
+      is loaded again on the writing thread's own connection, as the fetched
+      one belongs to the fetch worker's.
+    '''
+    uploads = True
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def write(self, item):
+        page = item.article.get_page(thread_connection(self._local))
+        item.article.write(item.updated, item.summary, page=page)
+        logger.info('Page Updated', extra={'updated': item.updated, 'summary': item.summary, 'updatedfields': item.updatedfields})
+
+    def complete(self, item):
+        if item.error:
+            return
+        if item.digest:
+            UpstreamFingerprint.objects.record(item.entrez, item.digest, item.build_date)
+        item.article.record_refresh(bool(item.updatedfields))
+
+
+class DryRunSink(object):
+    '''
+      Writes the rendered wikitext of each updated infobox to `path` instead of
+      Wikipedia, along with a tab separated log of edit summaries. Nothing is
+      recorded in the database, so a rehearsal does not affect later runs.
+      Nor are images uploaded to Commons.
+    '''
+    uploads = False
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._lock = threading.Lock()
+
+    def write(self, item):
+        filename = os.path.join(self.path, '{0}.wiki'.format(item.entrez))
+        with codecs.open(filename, 'w', 'utf-8') as out:
+            out.write(item.updated.wikitext())
+        with self._lock:
+            with codecs.open(os.path.join(self.path, 'summaries.tsv'), 'a', 'utf-8') as log:
+                log.write(u'{0}\t{1}\n'.format(item.article.title, item.summary))
+
+    def complete(self, item):
+        pass
+
+
+class ResultBuffer(object):
+    '''
+      Collects the ArticleResults of a run and inserts them with bulk_create in
+      batches of LEDGER_BATCH_SIZE rather than one row at a time, and at least
+      every LEDGER_FLUSH_SECONDS so a killed run loses few results.
+    '''
+
+    def __init__(self, run, size=None, interval=None):
+        self.run = run
+        self.size = size or settings.LEDGER_BATCH_SIZE
+        self.interval = interval or settings.LEDGER_FLUSH_SECONDS
+        self.pending = []
+        self.flushed = time.time()
+
+    def add(self, item):
+        if item.error:
+            outcome, detail = ArticleResult.FAILED, unicode(item.error)[:200]
+        elif item.skipped:
+            outcome, detail = ArticleResult.SKIPPED, item.skipped
+        else:
+            outcome, detail = ArticleResult.WRITTEN, item.summary or ''
+        self.pending.append(ArticleResult(run=self.run,
+                                          article_id=item.article.pk,
+                                          title=item.article.title,
+                                          outcome=outcome,
+                                          detail=detail,
+                                          changed_fields=u', '.join(sorted(item.updatedfields)),
+                                          duration=item.seconds,
+                                          error_class=type(item.error).__name__ if item.error else ''))
+        if len(self.pending) >= self.size or time.time() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            ArticleResult.objects.bulk_create(self.pending)
+            self.pending = []
+        self.flushed = time.time()
+
+
+class Pipeline(object):
+    '''
+      Runs items through a sequence of stages, each with its own worker threads,
+      connected by queues holding at most `queue_size` items. Items are made in
+      batches of `batch_size`, each passed to `prepare` before entering the
+      first stage. If the consumer of run() stops early, the workers are told
+      to stop and the queues are drained so none is left blocked.
+    '''
+
+    def __init__(self, stages, queue_size=None, prepare=None, batch_size=1):
+        self.stages = stages
+        self.queue_size = queue_size or settings.PIPELINE_QUEUE_SIZE
+        self.prepare = prepare
+        self.batch_size = batch_size
+
+    def _put(self, queue, item, stop):
+        '''
+          Puts `item` on a bounded queue, giving up once `stop` is set.
+        '''
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _put_batch(self, batch, outbound, stop):
+        if self.prepare:
+            self.prepare(batch)
+        for item in batch:
+            self._put(outbound, item, stop)
+
+    def _feed(self, source, outbound, stop):
+        try:
+            batch = []
+            for article in source:
+                if stop.is_set():
+                    break
+                batch.append(UpdateItem(article))
+                if len(batch) >= self.batch_size:
+                    self._put_batch(batch, outbound, stop)
+                    batch = []
+            if batch and not stop.is_set():
+                self._put_batch(batch, outbound, stop)
+        except Exception:
+            client.captureException()
+        finally:
+            self._put(outbound, _DONE, stop)
+            db_connection.close()
+
+    def _work(self, stage, inbound, outbound, remaining, stop):
+        try:
+            while not stop.is_set():
+                try:
+                    item = inbound.get(timeout=0.5)
+                except Queue.Empty:
+                    continue
+                if item is _DONE:
+                    # let the other workers of this stage see the end too
+                    self._put(inbound, _DONE, stop)
+                    break
+                self._put(outbound, stage(item), stop)
+        finally:
+            db_connection.close()
+            with remaining['lock']:
+                remaining['count'] -= 1
+                if remaining['count'] == 0:
+                    self._put(outbound, _DONE, stop)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=instrumentation.bound(target), args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run(self, source):
+        '''
+          Generator yielding each UpdateItem once it has passed every stage.
+          `source` is any iterable of Articles.
+        '''
+        stop = threading.Event()
+        queues = [Queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [self._start(self._feed, source, queues[0], stop)]
+        for i, stage in enumerate(self.stages):
+            remaining = {'count': stage.workers, 'lock': threading.Lock()}
+            for _ in range(stage.workers):
+                threads.append(self._start(self._work, stage, queues[i], queues[i + 1], remaining, stop))
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(1.0)
+            for queue in queues:
+                try:
+                    while True:
+                        queue.get_nowait()
+                except Queue.Empty:
+                    pass
+
+    def stats(self):
+        return dict((stage.name, stage.stats()) for stage in self.stages)
+
+
+def build_pipeline(sink, force=False, concurrency=None):
+    '''
+      Returns the standard refresh pipeline writing to `sink`. Worker counts per
+      stage default to PIPELINE_CONCURRENCY and can be overridden by name.
+    '''
+    workers = dict(settings.PIPELINE_CONCURRENCY, **(concurrency or {}))
+    fetch = FetchStage(force, workers=workers['fetch'])
+    return Pipeline([fetch,
+                     ParseStage(workers=workers['parse']),
+                     MergeStage(workers=workers['merge']),
+                     ImageStage(getattr(sink, 'uploads', True), workers=workers['image']),
+                     DiffStage(workers=workers['diff']),
+                     WriteStage(sink, workers=workers['write'])],
+                    prepare=fetch.prefetch, batch_size=settings.RESOLVER_BATCH_SIZE)
+
+
+def refresh(articles, sink=None, force=False, concurrency=None, name='refresh', ledger=True, metrics=True, resumed_from=None):
+    '''
+      Refreshes the infoboxes of the given articles and returns a report of the
+      run: counts of articles checked, changed upstream, written and failed,
+      plus per-stage timings. Failures are recorded per article and do not stop
+      the run. With `ledger` set, the run and each article's outcome are saved
+      as an UpdateRun and its ArticleResults. With `metrics` set (and
+      instrumentation enabled), the run's timings are saved as RunMetrics.
+      `resumed_from` is the UpdateRun this one resumes.
+    '''
+    sink = sink or WikiSink()
+    pipeline = build_pipeline(sink, force, concurrency)
+    run = UpdateRun.objects.create(name=name, resumed_from=resumed_from) if ledger else None
+    results = ResultBuffer(run) if ledger else None
+    recorder = instrumentation.start_run(name) if metrics else None
+    report = {'checked': 0, 'changed': 0, 'written': 0, 'failed': 0}
+    try:
+        items = pipeline.run(articles)
+        try:
+            for item in items:
+                sink.complete(item)
+                report['checked'] += 1
+                if item.error:
+                    report['failed'] += 1
+                elif item.changed:
+                    report['changed'] += 1
+                if not item.done:
+                    report['written'] += 1
+                if results:
+                    results.add(item)
+        finally:
+            # stops the workers if this loop did not run to the end
+            items.close()
+        report['stages'] = pipeline.stats()
+        report['concurrency'] = adaptive.snapshot()
+    finally:
+        metrics = instrumentation.finish_run(recorder) if recorder else None
+        if results:
+            results.flush()
+
+    if metrics:
+        metrics = RunMetrics.objects.record(metrics)
+        report['metrics'] = metrics.pk
+
+    if run:
+        UpdateRun.objects.filter(pk=run.pk).update(finished=timezone.now(), metrics=metrics,
+                                                   checked=report['checked'], changed=report['changed'],
+                                                   written=report['written'], failed=report['failed'])
+        report['run'] = run.pk
+    return report
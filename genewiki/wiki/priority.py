@@ -0,0 +1,70 @@
+'''
+    Priority ordering of infobox refreshes.
+
+    Rather than cycling through every infobox on a fixed interval, each infobox is
+    scored by how long it has been since it was last checked against mygene.info,
+    how often readers are redirected to its gene through the mapping service, and
+    how often previous refreshes actually changed it. The highest scoring
+    infoboxes are refreshed first, within an hourly budget.
+'''
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from genewiki.mapping.models import Lookup
+from genewiki.wiki.models import Article
+
+from datetime import timedelta
+import math
+
+
+def traffic_by_entrez(window_days=None):
+    '''
+        Returns a dict of entrez id => number of mapping redirects served for
+        that gene in the last `window_days` days.
+    '''
+    window_days = window_days or settings.REFRESH_TRAFFIC_WINDOW_DAYS
+    since = timezone.now() - timedelta(days=window_days)
+    hits = Lookup.objects.filter(created__gt=since) \
+                         .values('relationship__entrez_id') \
+                         .annotate(hits=Count('id'))
+    return dict((row['relationship__entrez_id'], row['hits']) for row in hits)
+
+
+def score(age_hours, hits, refresh_count, change_count):
+    '''
+        Returns the refresh priority of an article.
+
+        Age is measured in multiples of REFRESH_TARGET_AGE_HOURS so that an article
+        that has never changed nor been visited still works its way to the front of
+        the queue. The change rate is smoothed so that articles with no history are
+        treated as changing half of the time.
+    '''
+    age = age_hours / float(settings.REFRESH_TARGET_AGE_HOURS)
+    change_rate = (change_count + 1.0) / (refresh_count + 2.0)
+    traffic = math.log1p(hits)
+    return age * (1 + settings.REFRESH_WEIGHT_CHANGE * change_rate) \
+               * (1 + settings.REFRESH_WEIGHT_TRAFFIC * traffic)
+
+
+def refresh_queue(limit=None):
+    '''
+        Returns the primary keys of infoboxes in descending order of refresh
+        priority, truncated to `limit` entries if given.
+    '''
+    now = timezone.now()
+    traffic = traffic_by_entrez()
+    rows = Article.objects.filter(article_type=Article.INFOBOX) \
+                          .values_list('pk', 'title', 'created', 'refreshed',
+                                       'refresh_count', 'change_count')
+    scored = []
+    for pk, title, created, refreshed, refresh_count, change_count in rows:
+        age = now - (refreshed or created)
+        age_hours = age.days * 24 + age.seconds / 3600.0
+        entrez = Article(title=title).get_entrez()
+        scored.append((score(age_hours, traffic.get(entrez, 0), refresh_count, change_count), pk))
+
+    scored.sort(reverse=True)
+    queue = [pk for _, pk in scored]
+    return queue[:limit] if limit else queue
@@ -1,11 +1,20 @@
 from __future__ import absolute_import
 
-from raven.contrib.django.raven_compat.models import client
+from django.conf import settings
 
-from genewiki.wiki.models import Bot, Article
+from genewiki.wiki.models import Bot, Article, UpdateRun
+from genewiki.wiki.pipeline import refresh
+from genewiki.wiki.priority import refresh_queue
+from genewiki.wiki import outbox
+from genewiki.wiki.textutils import generate_protein_box_for_existing_article
+from genewiki.bio.tasks import render_structure
+from genewiki.bio.images import find_commons_images, structure_for
 
 from celery import task
 
+import logging
+logger = logging.getLogger(__name__)
+
 
 @task()
 def collect_template_pages():
@@ -13,18 +22,92 @@ def collect_template_pages():
     bot.fetch_update_articles()
 
 
+def report_changes(report):
+    logger.info('Refresh finished: {changed} of {checked} genes changed upstream, {written} written, {failed} failed'.format(**report), extra={'report': report})
+    return report
+
+
 @task()
 def update_all_infoboxes():
-    for infobox in Article.objects.all_infoboxes():
-        infobox.update()
+    return report_changes(refresh(Article.objects.stream_infoboxes(), name='update_all_infoboxes'))
 
 
 @task()
 def update_articles(update_list):
-    for pk in update_list:
+    # refreshed in the priority order refresh_queue() gave them
+    return report_changes(refresh(Article.objects.in_order(update_list), name='update_articles'))
+
+
+@task()
+def retry_failed_articles(run_id):
+    '''
+        Refreshes again only the articles that failed in the given run.
+    '''
+    run = UpdateRun.objects.get(pk=run_id)
+    return report_changes(refresh(Article.objects.stream(run.failed_articles()), name='retry_failed'))
+
+
+@task()
+def resume_run(run_id):
+    '''
+        Refreshes the infoboxes an interrupted full run did not get to.
+    '''
+    run = UpdateRun.objects.get(pk=run_id)
+    return report_changes(refresh(Article.objects.stream(run.unprocessed_infoboxes()), name='resume', resumed_from=run))
+
+
+@task()
+def schedule_infobox_updates():
+    '''
+        Queues the highest priority infoboxes for refreshing, up to the hourly
+        budget, spreading the batches evenly over the hour.
+    '''
+    queue = refresh_queue(settings.REFRESH_BUDGET_PER_HOUR)
+    size = settings.REFRESH_BATCH_SIZE
+    batches = [queue[i:i + size] for i in range(0, len(queue), size)]
+    for i, batch in enumerate(batches):
+        update_articles.apply_async(args=[batch, ], countdown=i * 3600 / len(batches))
+
+
+@task()
+def drain_outbox():
+    '''
+        Sends the queued wiki writes that are due (see genewiki.wiki.outbox).
+    '''
+    outcomes = outbox.drain()
+    if outcomes:
+        logger.info('Outbox drained: {0}'.format(outcomes), extra={'outcomes': outcomes})
+    return outcomes
+
+
+@task()
+def render_missing_images(limit=None):
+    '''
+        Queues a render of the chosen structure (see structure_for) of every
+        infobox that has PDB structures but no image and no existing image on
+        Commons, so the renders run in parallel on the render workers. The next
+        refresh of each article uploads the cached rendering and links it (see
+        genewiki.wiki.pipeline.ImageStage).
+    '''
+    genes = []
+    for article in Article.objects.stream_infoboxes(with_text=True):
         try:
-            article = Article.objects.get(pk=pk)
-            article.update()
+            box = generate_protein_box_for_existing_article(article.text)
         except Exception:
-            client.captureException()
+            continue
+        fields = box.fieldsdict
+        if fields.get('PDB') and fields.get('Symbol') and not fields.get('image'):
+            pdb_id = structure_for(fields)
+            genes.append((fields['Symbol'], [pdb_id] + [other for other in fields['PDB'] if other != pdb_id]))
 
+    on_commons = find_commons_images(genes)
+    queued = 0
+    for symbol, pdb_ids in genes:
+        if symbol in on_commons:
+            continue
+        render_structure.delay(pdb_ids[0], symbol)
+        queued += 1
+        if limit and queued >= limit:
+            break
+    logger.info('{0} genes already have a Commons image; queued {1} structure renders'.format(len(on_commons), queued))
+    return queued
@@ -0,0 +1,258 @@
+from django.contrib import admin
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from genewiki.wiki.models import Article, UpstreamFingerprint, RunMetrics, UpdateRun, ArticleResult, OutboxEntry
+from genewiki.wiki.admin import RunMetricsAdmin
+from genewiki.wiki import pipeline, outbox, writes
+from genewiki.common import resilience, ratelimit
+from genewiki.common.testing import RedisTestCase, TEST_REDIS
+
+from mwclient.errors import APIError
+
+from datetime import timedelta
+import shutil, tempfile
+
+
+class RefreshTest(TestCase):
+    '''
+      Runs refresh() end to end without touching the network: upstream
+      lookups are replaced by ones that fail as for an unknown gene, and
+      output goes to a DryRunSink.
+    '''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.originals = dict((name, getattr(pipeline, name)) for name in ('get_build_date', 'resolve_many', 'get_response'))
+
+        def unknown(entrez):
+            raise ValueError('Unknown Entrez gene {0}'.format(entrez))
+        pipeline.get_build_date = lambda: None
+        pipeline.resolve_many = lambda ids: dict((entrez, ValueError('Unknown')) for entrez in ids)
+        pipeline.get_response = unknown
+
+        self.article = Article.objects.create(title='Template:PBB/1017', text='', article_type=Article.INFOBOX)
+
+    def tearDown(self):
+        for name, value in self.originals.items():
+            setattr(pipeline, name, value)
+        shutil.rmtree(self.path)
+
+    def test_refresh_reports_and_records_run(self):
+        report = pipeline.refresh([self.article], sink=pipeline.DryRunSink(self.path), name='test')
+
+        self.assertEqual(report['checked'], 1)
+        self.assertEqual(report['failed'], 1)
+        self.assertIn('concurrency', report)
+        self.assertIn('fetch', report['stages'])
+
+        run = UpdateRun.objects.get(pk=report['run'])
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(run.failed, 1)
+        self.assertEqual(run.results.get().outcome, ArticleResult.FAILED)
+
+    def test_article_update_is_not_recorded(self):
+        self.assertFalse(self.article.update())
+        self.assertFalse(UpdateRun.objects.exists())
+        self.assertFalse(RunMetrics.objects.exists())
+
+
+class RunMetricsAdminTest(TestCase):
+
+    def test_timings_table(self):
+        metrics = RunMetrics(data='{"timings": {"stage.fetch": {"count": 2, "p50": 0.5, "p95": 1.25, "p99": 1.5, "max": 2}}}')
+        table = RunMetricsAdmin(RunMetrics, admin.site).timings(metrics)
+        self.assertIn('<td>stage.fetch</td><td>2</td><td>0.500</td><td>1.250</td><td>1.500</td><td>2.000</td>', table)
+
+
+class UpsertTest(TestCase):
+
+    def setUp(self):
+        self.changed = Article.objects.create(title='Template:PBB/1', text='old', article_type=Article.INFOBOX)
+        self.unchanged = Article.objects.create(title='Template:PBB/2', text='same', article_type=Article.INFOBOX)
+        Article.objects.filter(pk__in=[self.changed.pk, self.unchanged.pk]).update(content_changed=None, last_fetched=None)
+
+    def test_upsert_creates_updates_and_touches(self):
+        pages = [('Template:PBB/1', 'new'), ('Template:PBB/2', 'same'), ('Template:PBB/3', 'created')]
+        created, updated = Article.objects.upsert(pages, Article.INFOBOX, batch_size=2)
+
+        self.assertEqual(created, ['Template:PBB/3'])
+        self.assertEqual(updated, ['Template:PBB/1'])
+        changed = Article.objects.get(pk=self.changed.pk)
+        self.assertEqual(changed.text, 'new')
+        self.assertIsNotNone(changed.content_changed)
+        unchanged = Article.objects.get(pk=self.unchanged.pk)
+        self.assertIsNone(unchanged.content_changed)
+        self.assertIsNotNone(unchanged.last_fetched)
+        self.assertEqual(Article.objects.get(title='Template:PBB/3').article_type, Article.INFOBOX)
+
+    def test_update_text_sets_each_row(self):
+        now = timezone.now()
+        Article.objects._update_text({self.changed.pk: u'first \u2013 one', self.unchanged.pk: 'second'}, now)
+
+        self.assertEqual(Article.objects.get(pk=self.changed.pk).text, u'first \u2013 one')
+        self.assertEqual(Article.objects.get(pk=self.unchanged.pk).text, 'second')
+        self.assertEqual(Article.objects.filter(content_changed=now, last_fetched=now).count(), 2)
+
+
+class UpstreamFingerprintTest(TestCase):
+
+    def test_record_reports_changes(self):
+        self.assertTrue(UpstreamFingerprint.objects.record(1017, 'a', '20150101'))
+        first = UpstreamFingerprint.objects.get_for_entrez(1017).changed
+        self.assertFalse(UpstreamFingerprint.objects.record(1017, 'a', '20150108'))
+        self.assertEqual(UpstreamFingerprint.objects.get_for_entrez(1017).changed, first)
+        self.assertTrue(UpstreamFingerprint.objects.record(1017, 'b', '20150115'))
+
+
+class StubBot(object):
+    '''
+      Stands in for the Bot model in genewiki.wiki.outbox, so that no login is
+      attempted.
+    '''
+
+    class objects(object):
+
+        @staticmethod
+        def get_pbb():
+            return StubBot()
+
+    def connection(self):
+        return None
+
+
+class OutboxTest(TestCase):
+    '''
+      Drains the outbox with send() replaced by one that records the entries
+      sent, or raises `self.error` if it is set.
+    '''
+
+    def setUp(self):
+        self.originals = {'send': outbox.send, 'Bot': outbox.Bot}
+        self.sent, self.error = [], None
+
+        def send(entry, connection):
+            if self.error:
+                raise self.error
+            self.sent.append(entry.text)
+        outbox.send = send
+        outbox.Bot = StubBot
+
+    def tearDown(self):
+        for name, value in self.originals.items():
+            setattr(outbox, name, value)
+
+    def entry(self, text, title='PBB/1017', **kwargs):
+        return OutboxEntry.objects.create(title=title, text=text, **kwargs)
+
+    def status(self, entry):
+        return OutboxEntry.objects.get(pk=entry.pk).status
+
+    def test_claim_once(self):
+        entry = self.entry('a')
+        self.assertTrue(OutboxEntry.objects.claim(OutboxEntry.objects.get(pk=entry.pk)))
+        self.assertFalse(OutboxEntry.objects.claim(OutboxEntry.objects.get(pk=entry.pk)))
+        self.assertEqual(self.status(entry), OutboxEntry.SENDING)
+
+    def test_stale_claims_are_released(self):
+        entry = self.entry('a', status=OutboxEntry.SENDING, claimed=timezone.now() - timedelta(seconds=60))
+        self.assertEqual(OutboxEntry.objects.release_stale(120), 0)
+        self.assertEqual(OutboxEntry.objects.release_stale(30), 1)
+        self.assertEqual(self.status(entry), OutboxEntry.PENDING)
+
+    def test_later_write_supersedes(self):
+        first, second, other = self.entry('a'), self.entry('b'), self.entry('c', title='PBB/1018')
+        self.assertEqual(outbox.drain(), {OutboxEntry.SUPERSEDED: 1, OutboxEntry.WRITTEN: 2})
+        self.assertEqual(self.sent, ['b', 'c'])
+        self.assertEqual(self.status(first), OutboxEntry.SUPERSEDED)
+        self.assertEqual(self.status(second), OutboxEntry.WRITTEN)
+        self.assertEqual(self.status(other), OutboxEntry.WRITTEN)
+
+    def test_transient_failure_is_retried(self):
+        entry = self.entry('a')
+        self.error = resilience.UpstreamUnavailable('wikipedia')
+        self.assertEqual(outbox.drain(), {OutboxEntry.PENDING: 1})
+        entry = OutboxEntry.objects.get(pk=entry.pk)
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt, timezone.now())
+        self.assertIn('UpstreamUnavailable', entry.error)
+        # not due again yet
+        self.assertEqual(outbox.drain(), {})
+
+    def test_failed_write_requeues_superseded(self):
+        first, second = self.entry('a'), self.entry('b')
+        self.error = ValueError('rejected')
+        self.assertEqual(outbox.drain(), {OutboxEntry.SUPERSEDED: 1, OutboxEntry.FAILED: 1})
+        self.assertEqual(self.status(first), OutboxEntry.PENDING)
+        self.assertEqual(self.status(second), OutboxEntry.FAILED)
+
+        self.error = None
+        self.assertEqual(outbox.drain(), {OutboxEntry.WRITTEN: 1})
+        self.assertEqual(self.sent, ['a'])
+
+
+class StubPage(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.saved = []
+
+    def save(self, text, summary=None, minor=False, maxlag=None):
+        if self.error:
+            raise self.error
+        self.saved.append((text, maxlag))
+        return {'result': 'Success'}
+
+
+@override_settings(RATE_LIMIT_REDIS=TEST_REDIS, UPSTREAM_RETRY={'attempts': 1, 'base_delay': 0, 'max_delay': 0, 'budget_ratio': 1.0},
+                   WIKI_WRITES={'edits_per_minute': 12, 'minimum': 1, 'increase': 0.5, 'decrease': 0.5,
+                                'maxlag': 5, 'pause': 30, 'window': 600})
+class WritesTest(RedisTestCase):
+
+    def setUp(self):
+        super(WritesTest, self).setUp()
+        writes._state.clear()
+        ratelimit._state.clear()
+
+    def tearDown(self):
+        writes._state.clear()
+        ratelimit._state.clear()
+        super(WritesTest, self).tearDown()
+
+    def test_congestion_slows_and_pauses(self):
+        writes.congested()
+        self.assertEqual(writes.current_rate(), 6)
+        self.assertGreater(writes.paused_for(), 29)
+        writes.congested()
+        self.assertEqual(writes.current_rate(), 3)
+
+        writes.succeeded()
+        self.assertEqual(writes.current_rate(), 3.5)
+
+    def test_rate_stays_within_bounds(self):
+        writes.succeeded()
+        self.assertEqual(writes.current_rate(), 12)
+        for _ in range(6):
+            writes.congested()
+        self.assertEqual(writes.current_rate(), 1)
+
+    def test_waited_backs_off_edits_only(self):
+        writes.waited(None, 'token', 1, None)
+        writes.waited(None, 'token', 1, ('api.php', {'action': 'query'}))
+        self.assertEqual(writes.current_rate(), 12)
+        writes.waited(None, 'token', 1, ('api.php', [('action', 'edit'), ('title', 'PBB/1017')]))
+        self.assertEqual(writes.current_rate(), 6)
+
+    def test_save_sends_maxlag(self):
+        page = StubPage()
+        writes.save(page, 'text')
+        self.assertEqual(page.saved, [('text', 5)])
+        self.assertEqual(writes.status()['backoffs'], 0)
+
+    def test_lagged_save_backs_off(self):
+        with self.assertRaises(resilience.RetriesExhausted) as raised:
+            writes.save(StubPage(APIError('maxlag', 'Waiting for a database server', {})), 'text')
+        self.assertEqual(raised.exception.cause.code, 'maxlag')
+        self.assertEqual(writes.current_rate(), 6)
+        self.assertGreater(writes.paused_for(), 0)
@@ -1,9 +1,10 @@
 from django.conf import settings
-from django.db import models
 
-from genewiki.bio.g2p_redis import get_pmids, init_redis
+from genewiki.bio.g2p import get_ranked_pmids
+from genewiki.common import instrumentation, upstream, http
 
-import re, copy, json, datetime, urllib, PBB_Core, PBB_login
+from multiprocessing.pool import ThreadPool
+import os, re, copy, datetime, threading, PBB_Core, PBB_login
 
 
 def check(titles):
@@ -12,10 +13,9 @@ def check(titles):
         the first command-line argument.
     '''
     titles = [titles] if isinstance(titles, str) else titles
-    qtitles = [urllib.quote(x) for x in titles]
-    querystr = '|'.join(qtitles)
-    api = 'http://en.wikipedia.org/w/api.php?action=query&titles={title}&prop=info&redirects&format=json'
-    j = json.loads(urllib.urlopen(api.format(title=querystr)).read())
+    api = 'http://en.wikipedia.org/w/api.php'
+    params = {'action': 'query', 'titles': '|'.join(titles), 'prop': 'info', 'redirects': '', 'format': 'json'}
+    j = upstream.call('wikipedia', 'wikipedia.check_titles', http.session('wikipedia').get, api, params=params).json()
     results = {}
     pages = j['query']['pages']
     if 'redirects' in j['query']:
@@ -28,15 +28,18 @@ def check(titles):
     return results
 
 
-def create_stub(gene_id):
+def create_stub(gene_id, response=None, pmids=None):
     '''
         Contains templates and functions for generating article stubs for the Gene Wiki
         Project on Wikipedia.
+
+        The upstream response and the gene's PubMed ids are fetched unless passed
+        in as `response` and `pmids`.
     '''
 
     try:
         from genewiki.bio.mygeneinfo import get_response
-        root, meta, homolog, entrez, uniprot = get_response(gene_id)
+        root, meta, homolog, entrez, uniprot = response or get_response(gene_id)
     except Exception, e:
         print e
         return None
@@ -65,7 +68,8 @@ def create_stub(gene_id):
     values['entrezcite'] = settings.ENTREZ_CITE.format(**values)
 
     # build out the citations
-    pmids = get_pmids(gene_id, init_redis(), 100)
+    if pmids is None:
+        pmids = fetch_pmids(gene_id)
     limit = 9 if len(pmids) > 9 else len(pmids)
     citations = ''
     for pmid in pmids[:limit]:
@@ -76,18 +80,18 @@ def create_stub(gene_id):
     return stub
 
 
-def create(entrez, force=False):
-    results = {'titles': {}, 'template': '', 'stub': ''}
+def fetch_pmids(gene_id, count=9):
+    '''
+        Returns the gene's best ranked citations for a stub.
+    '''
+    with instrumentation.timer('g2p.get_pmids'):
+        return get_ranked_pmids(gene_id, count)
 
-    try:
-        from genewiki.bio.mygeneinfo import get_response
-        root, meta, homolog, entrez, uniprot = get_response(entrez)
-    except ValueError:
-        # invalid entrez
-        return None
- 
-    # Query wikidata for existance of entrez_id don't create new pages for entrez_ids not in wikidata
 
+def in_wikidata(entrez):
+    '''
+        Returns True if a Wikidata item carries the Entrez gene id.
+    '''
     entrez_query = """
         SELECT ?entrez_id  WHERE {
         ?cid wdt:P351 ?entrez_id  .
@@ -95,33 +99,81 @@ def create(entrez, force=False):
     }
     """
 
-    wikidata_results = PBB_Core.WDItemEngine.execute_sparql_query(prefix=settings.PREFIX, query=entrez_query)['results']['bindings']
-    entrez_id = ''
-    for x in wikidata_results:
-	entrez_id = x['entrez_id']['value']
-    if entrez_id != str(entrez):
+    wikidata_results = upstream.call('wikidata', 'wikidata.sparql', PBB_Core.WDItemEngine.execute_sparql_query, prefix=settings.PREFIX, query=entrez_query)['results']['bindings']
+    return any(x['entrez_id']['value'] == str(entrez) for x in wikidata_results)
+
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def _shared_pool():
+    '''
+        Returns this process's pool of CREATE_WORKERS threads, started on first
+        use; a forked process starts its own, as it inherits no threads.
+    '''
+    with _pool_lock:
+        if _pool.get('pid') != os.getpid():
+            _pool['pool'] = ThreadPool(settings.CREATE_WORKERS)
+            _pool['pid'] = os.getpid()
+        return _pool['pool']
+
+
+def create(entrez, force=False):
+    '''
+        Gathers what the article creation page shows for a gene: its possible
+        titles and whether each exists on Wikipedia, and a stub article when
+        none does. Returns None for genes unknown to mygene.info or Wikidata.
+
+        Requests that do not depend on each other run at the same time: the
+        upstream documents, the Wikidata lookup and the gene's PubMed ids start
+        together, and the title check starts as soon as the documents arrive.
+        The stub is built from the same responses. They run on a pool shared
+        by every call, so requests left behind by an early return finish on
+        its threads instead of leaving threads of their own.
+    '''
+    from genewiki.bio.resolver import resolve
+    results = {'titles': {}, 'template': '', 'stub': ''}
+
+    pool = _shared_pool()
+    requested = entrez
+    response = pool.apply_async(resolve, (entrez,))
+    known = pool.apply_async(in_wikidata, (entrez,))
+    pmids = pool.apply_async(fetch_pmids, (entrez,))
+
+    try:
+        root, meta, homolog, entrez, uniprot = response.get()
+    except ValueError:
+        # invalid entrez
         return None
-    else:
-       # Dictionary of each title key and tuple of it's (STR_NAME, IF_CREATED_ON_WIKI)
-       titles = {'name': (root['name'].capitalize(), False),
-                 'symbol': (root['symbol'], False),
-                 'test': (entrez_id, False),
-                 'altsym': ('{0} (gene)'.format(root['symbol']), False),
-                 'templatename': ('Template:PBB/{0}'.format(entrez), False)}
-
-       # For each of the titles, build out the correct names and
-       # corresponding Boolean for if they're on Wikipedia
-       checked = check([titles[key][0] for key in titles.keys()])
-       for key, value in titles.iteritems():
-           if checked.get(value[0]):
-               titles[key] = (value[0], True)
-       results['titles'] = titles
-
-       # Generate the Stub code if the Page (for any of the possible names) isn't on Wikipedia
-       if not (titles['name'][1] or titles['symbol'][1] or titles['altsym'][1]) or force:
-           results['stub'] = create_stub(entrez)
-
-       return results
+
+    # Dictionary of each title key and tuple of it's (STR_NAME, IF_CREATED_ON_WIKI)
+    titles = {'name': (root['name'].capitalize(), False),
+              'symbol': (root['symbol'], False),
+              'test': (str(entrez), False),
+              'altsym': ('{0} (gene)'.format(root['symbol']), False),
+              'templatename': ('Template:PBB/{0}'.format(entrez), False)}
+    # Check whether each title is already on Wikipedia
+    checked = pool.apply_async(check, ([titles[key][0] for key in titles.keys()],))
+
+    # don't create new pages for entrez_ids not in wikidata
+    if str(entrez) != str(requested):
+        known = pool.apply_async(in_wikidata, (entrez,))
+    if not known.get():
+        return None
+
+    checked = checked.get()
+    for key, value in titles.iteritems():
+        if checked.get(value[0]):
+            titles[key] = (value[0], True)
+    results['titles'] = titles
+
+    # Generate the Stub code if the Page (for any of the possible names) isn't on Wikipedia
+    if not (titles['name'][1] or titles['symbol'][1] or titles['altsym'][1]) or force:
+        citations = pmids.get() if str(entrez) == str(requested) else None
+        results['stub'] = create_stub(entrez, (root, meta, homolog, entrez, uniprot), citations)
+
+    return results
 
 def interwiki_link(entrez, name):
     # Query wikidata for Q-item id (cid)
@@ -133,7 +185,7 @@ def interwiki_link(entrez, name):
     }
     """
 
-    wikidata_results = PBB_Core.WDItemEngine.execute_sparql_query(prefix=settings.PREFIX, query=cid_query)['results']['bindings']
+    wikidata_results = upstream.call('wikidata', 'wikidata.sparql', PBB_Core.WDItemEngine.execute_sparql_query, prefix=settings.PREFIX, query=cid_query)['results']['bindings']
     cid = ''
     for x in wikidata_results:
         cid = x['cid']['value'].split('/')[-1]
@@ -146,7 +198,7 @@ def interwiki_link(entrez, name):
     # set the interwiki link to the correct Wikipedia page
     wd_gene_item.set_sitelink(site='enwiki', title=name)
     # write the changes to the item
-    wd_gene_item.write(login_obj)
+    upstream.call('wikidata', 'wikidata.write', wd_gene_item.write, login_obj)
 
 class ProteinBox(object):
     '''
@@ -346,16 +398,21 @@ class ProteinBox(object):
 
         return new, summary, updatedFields
 
-    def linkImage(self):
+    def linkImage(self, render=True, upload=True):
         '''
           If a pdb structure and hugo symbol are available, but no image field set,
-          we can attempt to find or render an image for the ProteinBox.
+          we can attempt to find or render an image for the ProteinBox (see
+          genewiki.bio.images.get_image). Returns True if an image was set.
         '''
         if (self.fieldsdict['PDB'] and self.fieldsdict['Symbol'] and not self.fieldsdict['image']):
             from genewiki.bio.images import get_image
-            image, caption = get_image(self, use_experimental=True)
-            self.setField('image', image)
-            self.setField('image_source', caption)
+            found = get_image(self, use_experimental=True, render=render, upload=upload)
+            if found:
+                image, caption = found
+                self.setField('image', image)
+                self.setField('image_source', caption)
+                return True
+        return False
 
     def wikitext(self):
         '''
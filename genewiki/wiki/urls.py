@@ -5,6 +5,12 @@ urlpatterns = patterns('genewiki.wiki.views',
     url(r'^$', r'home'),
     url(r'^page/(?P<page_num>\d+)/$', r'home'),
     url(r'^update/$', r'update'),
+    url(r'^metrics/$', r'run_metrics'),
+    url(r'^metrics/(?P<run_id>\d+)/$', r'run_metrics'),
+    url(r'^writes/$', r'write_status'),
+    url(r'^runs/$', r'runs'),
+    url(r'^runs/page/(?P<page_num>\d+)/$', r'runs'),
+    url(r'^runs/(?P<run_id>\d+)/retry/$', r'run_retry'),
 
     url(r'^article/create/(?P<entrez_id>\d+)/$', r'article_create'),
     url(r'^article/(?P<article_id>\d+)/update/$', r'article_update'),
@@ -6,16 +6,20 @@ from django.http import HttpResponse
 
 from genewiki.mapping.models import Relationship
 
-from genewiki.wiki.models import Article
-from genewiki.wiki.tasks import update_articles
+from genewiki.wiki.models import Article, RunMetrics, UpdateRun, OutboxEntry
+from genewiki.wiki.priority import refresh_queue
+from genewiki.wiki.tasks import update_articles, retry_failed_articles
 
 from genewiki.wiki.textutils import create, interwiki_link
+from genewiki.wiki import writes
+from genewiki.common.resilience import UpstreamUnavailable
 
 from datetime import datetime, timedelta
+import json
 
 
 def home(request, page_num=1):
-    article_list = Article.objects.all_infoboxes()
+    article_list = Article.objects.listing()
 
     article_list_paginator = Paginator(article_list, 200)
     try:
@@ -25,11 +29,12 @@ def home(request, page_num=1):
     except EmptyPage:
         articles = article_list_paginator.page(article_list_paginator.num_pages)
 
+    # Articles whose text actually changed, not merely re-fetched
     updated = {
-        'hour': Article.objects.filter(updated__gt=datetime.now() - timedelta(hours=1)).count(),
-        'day': Article.objects.filter(updated__gt=datetime.now() - timedelta(days=1)).count(),
-        'week': Article.objects.filter(updated__gt=datetime.now() - timedelta(weeks=1)).count(),
-        'month': Article.objects.filter(updated__gt=datetime.now() - timedelta(weeks=4)).count(),
+        'hour': Article.objects.filter(content_changed__gt=datetime.now() - timedelta(hours=1)).count(),
+        'day': Article.objects.filter(content_changed__gt=datetime.now() - timedelta(days=1)).count(),
+        'week': Article.objects.filter(content_changed__gt=datetime.now() - timedelta(weeks=1)).count(),
+        'month': Article.objects.filter(content_changed__gt=datetime.now() - timedelta(weeks=4)).count(),
     }
     return render_to_response('wiki/index.jade', {'articles': articles, 'updated': updated}, context_instance=RequestContext(request))
 
@@ -38,7 +43,7 @@ def home(request, page_num=1):
 def update(request):
     limit = request.POST.get('update_count', None)
     if limit:
-        update_list = Article.objects.order_by('updated').values_list('pk', flat=True).all()[:int(limit)]
+        update_list = refresh_queue(int(limit))
         update_articles.apply_async(args=[update_list, ])
     else:
         pass
@@ -55,7 +60,10 @@ def article_update(request, article_id):
 
 @require_http_methods(['GET', 'POST'])
 def article_create(request, entrez_id):
-    results = create(entrez_id)
+    try:
+        results = create(entrez_id)
+    except UpstreamUnavailable as e:
+        return HttpResponse('Upstream service unavailable, try again later ({0})'.format(e), status=503)
 
     # We failed to gather information then return the ID error
     if results is None:
@@ -85,7 +93,7 @@ def article_create(request, entrez_id):
         vals['title'] = title
         is_template = title.startswith('Template:PBB/')
         content = results['template'] if is_template else results['stub']
-        Article.objects.get_or_create(title=title, text=content, article_type=Article.INFOBOX if is_template else Article.PAGE, force_update=True)
+        Article.objects.publish(title, content, Article.INFOBOX if is_template else Article.PAGE)
 
         # create corresponding talk page with appropriate project banners
         if not is_template:
@@ -94,10 +102,9 @@ def article_create(request, entrez_id):
                               {{WikiProject Gene Wiki|class=stub|importance=low}}
                               {{Wikiproject MCB|class=stub|importance=low}}
                             }}"""
-            Article.objects.get_or_create(title=talk_title, text=talk_content, article_type=Article.TALK, force_update=True)
+            Article.objects.publish(talk_title, talk_content, Article.TALK)
             #create interwiki link
             link = interwiki_link(entrez_id, title)
-     
 
             # Save the entrez_id to title mapping for future reference
             if not Relationship.objects.filter(entrez_id=entrez_id).exists():
@@ -107,3 +114,45 @@ def article_create(request, entrez_id):
 
     return render_to_response('wiki/create.jade', vals, context_instance=RequestContext(request))
 
+
+@require_http_methods(['GET'])
+def run_metrics(request, run_id=None):
+    '''
+        Returns the instrumentation snapshot of one run, or of the most recent
+        runs (?limit=, default 20), as JSON.
+    '''
+    if run_id:
+        data = get_object_or_404(RunMetrics, pk=run_id).metrics()
+    else:
+        limit = int(request.GET.get('limit', 20))
+        data = [dict(run.metrics(), id=run.pk) for run in RunMetrics.objects.all()[:limit]]
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+@require_http_methods(['GET'])
+def write_status(request):
+    '''
+        Returns the write scheduler's state and the depth of the write outbox
+        as JSON.
+    '''
+    data = dict(writes.status(), queue=OutboxEntry.objects.depth())
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+def runs(request, page_num=1):
+    run_list_paginator = Paginator(UpdateRun.objects.select_related('metrics'), 50)
+    try:
+        run_list = run_list_paginator.page(page_num)
+    except PageNotAnInteger:
+        run_list = run_list_paginator.page(1)
+    except EmptyPage:
+        run_list = run_list_paginator.page(run_list_paginator.num_pages)
+
+    return render_to_response('wiki/runs.jade', {'runs': run_list}, context_instance=RequestContext(request))
+
+
+@require_http_methods(['POST'])
+def run_retry(request, run_id):
+    run = get_object_or_404(UpdateRun, pk=run_id)
+    retry_failed_articles.apply_async(args=[run.pk, ])
+    return HttpResponse(200)
@@ -0,0 +1,187 @@
+'''
+    Pacing of edits to Wikipedia.
+
+    Every page save goes through save(), which:
+
+    - sends maxlag=WIKI_WRITES['maxlag'], so MediaWiki turns the edit away
+      while its replicas lag by more than that many seconds;
+    - waits for its turn at the current edit rate, shared by all workers
+      through the 'wikipedia_write' token bucket (see genewiki.common.ratelimit).
+      The rate starts at the WIKI_WRITES['edits_per_minute'] ceiling, is
+      multiplied by `decrease` whenever MediaWiki reports lag or rate limiting
+      and recovers by `increase` edits per minute with every successful edit;
+    - after a lag or rate limit response, pauses every writer for
+      WIKI_WRITES['pause'] seconds before the next edit.
+
+    mwclient retries lagged requests itself, sleeping for the Retry-After
+    MediaWiki sends; waited() is given to the bot's Site as its wait_callback
+    so those retries back off the edit rate too.
+
+    The shared state lives in the RATE_LIMIT_REDIS database. If Redis cannot
+    be reached, edits are paced at the ceiling by the token bucket alone.
+    status() reports the state and the rate edits were actually made at.
+'''
+
+from django.conf import settings
+
+from genewiki.common import upstream, ratelimit, instrumentation
+
+from mwclient.errors import APIError
+
+import time, random, threading, logging, redis
+logger = logging.getLogger(__name__)
+
+CONGESTION_CODES = ('maxlag', 'ratelimited')
+
+RATE_KEY = 'writes:rate'
+PAUSE_KEY = 'writes:paused_until'
+DONE_KEY = 'writes:done'
+BACKOFF_KEY = 'writes:backoffs'
+
+# KEYS[1]: rate key. ARGV: ceiling, floor, factor, increment.
+# Sets the rate to rate * factor + increment within [floor, ceiling] and
+# returns it; a missing rate starts at the ceiling.
+ADJUST = '''
+local ceiling = tonumber(ARGV[1])
+local rate = tonumber(redis.call('GET', KEYS[1])) or ceiling
+rate = math.max(tonumber(ARGV[2]), math.min(ceiling, rate * tonumber(ARGV[3]) + tonumber(ARGV[4])))
+redis.call('SET', KEYS[1], tostring(rate))
+return tostring(rate)
+'''
+
+_state = {}
+_state_lock = threading.Lock()
+
+
+def _redis():
+    with _state_lock:
+        if 'redis' not in _state:
+            _state['redis'] = redis.StrictRedis(**settings.RATE_LIMIT_REDIS)
+            _state['adjust'] = _state['redis'].register_script(ADJUST)
+    return _state['redis']
+
+
+def _adjust(factor, increment):
+    options = settings.WIKI_WRITES
+    _redis()
+    return float(_state['adjust'](keys=[RATE_KEY], args=[options['edits_per_minute'], options['minimum'], factor, increment]))
+
+
+def current_rate():
+    '''
+        Returns the edits per minute currently allowed.
+    '''
+    ceiling = settings.WIKI_WRITES['edits_per_minute']
+    try:
+        rate = _redis().get(RATE_KEY)
+    except redis.RedisError:
+        return ceiling
+    return min(ceiling, float(rate)) if rate else ceiling
+
+
+def paused_for():
+    '''
+        Returns the seconds left before edits may resume, or 0.
+    '''
+    try:
+        until = _redis().get(PAUSE_KEY)
+    except redis.RedisError:
+        return 0
+    return max(0, float(until) - time.time()) if until else 0
+
+
+def congested():
+    '''
+        Backs off after MediaWiki reported lag or rate limiting: cuts the edit
+        rate and pauses all writers.
+    '''
+    options = settings.WIKI_WRITES
+    try:
+        rate = _adjust(options['decrease'], 0)
+        until = time.time() + options['pause']
+        connection = _redis()
+        if float(connection.get(PAUSE_KEY) or 0) < until:
+            connection.set(PAUSE_KEY, until, ex=options['pause'] + 60)
+        connection.incr(BACKOFF_KEY)
+    except redis.RedisError:
+        logger.warn('Write scheduler unavailable; not backing off', exc_info=True)
+        return
+    instrumentation.count('writes.backoff')
+    logger.warn('Wikipedia is lagged or rate limiting edits; slowing to {0:.1f} edits/minute'.format(rate))
+
+
+def succeeded():
+    options = settings.WIKI_WRITES
+    now = time.time()
+    try:
+        _adjust(1, options['increase'])
+        connection = _redis()
+        connection.zadd(DONE_KEY, now, '{0}:{1}'.format(now, random.random()))
+        connection.zremrangebyscore(DONE_KEY, 0, now - options['window'])
+    except redis.RedisError:
+        logger.warn('Write scheduler unavailable; edit not recorded', exc_info=True)
+
+
+def wait_turn():
+    '''
+        Blocks until the next edit may be made.
+    '''
+    pause = paused_for()
+    if pause:
+        instrumentation.record('writes.paused', pause)
+        time.sleep(pause)
+    ratelimit.acquire('wikipedia_write', limit=(current_rate() / 60.0, 1))
+
+
+def waited(site, token, retry, args):
+    '''
+        mwclient wait_callback, called each time mwclient waits to retry a
+        request. Backs off when the request was an edit; mwclient passes no
+        args when it retries after an HTTP error.
+    '''
+    if args is None:
+        return
+    script, data = args
+    if dict(data).get('action') == 'edit':
+        congested()
+
+
+def save(page, text, summary=None):
+    '''
+        Saves `text` to an mwclient page as a minor edit, paced as described
+        above. Returns mwclient's result.
+    '''
+    def edit():
+        wait_turn()
+        try:
+            result = page.save(text, summary, minor=True, maxlag=settings.WIKI_WRITES['maxlag'])
+        except APIError as e:
+            if e.code in CONGESTION_CODES:
+                congested()
+            raise
+        succeeded()
+        return result
+    return upstream.call('wikipedia_write', 'wikipedia.page_save', edit)
+
+
+def status():
+    '''
+        Returns the scheduler's state: the allowed and achieved edits per
+        minute, the seconds left in a pause and the number of back-offs.
+    '''
+    options = settings.WIKI_WRITES
+    now = time.time()
+    try:
+        connection = _redis()
+        done = connection.zcount(DONE_KEY, now - options['window'], now)
+        backoffs = int(connection.get(BACKOFF_KEY) or 0)
+    except redis.RedisError:
+        done, backoffs = None, None
+    return {
+        'ceiling': options['edits_per_minute'],
+        'rate': current_rate(),
+        'achieved_rate': done * 60.0 / options['window'] if done is not None else None,
+        'window': options['window'],
+        'paused_for': paused_for(),
+        'backoffs': backoffs,
+    }